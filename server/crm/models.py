@@ -14,4 +14,12 @@ class Customer(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pages of CustomerViewSet
+            models.Index(fields=['-created_at', '-id'], name='customer_created_idx'),
+            # Exact filters and lookups; ?search= uses icontains, which no B-tree index serves
+            models.Index(fields=['name'], name='customer_name_idx'),
+            models.Index(fields=['email'], name='customer_email_idx'),
+            models.Index(fields=['phone'], name='customer_phone_idx'),
+        ]
 
@@ -1,3 +1,40 @@
+from urllib.parse import parse_qs, urlparse
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+from .models import Customer
+from .views import CustomerViewSet
 
-# Create your tests here.
+
+class CustomerPaginationTest(TestCase):
+    def setUp(self):
+        """Create more customers than fit on a page"""
+        self.user = User.objects.create_user(username='crm', password='testpass123')
+        for n in range(15):
+            Customer.objects.create(name=f'Customer {n}', email=f'c{n}@example.com', phone=str(n), address='-')
+
+    def get(self, params):
+        request = APIRequestFactory().get('/customers/', params)
+        force_authenticate(request, user=self.user)
+        return CustomerViewSet.as_view({'get': 'list'})(request)
+
+    def test_cursor_pages(self):
+        """Test customers page by cursor, newest first"""
+        response = self.get({})
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(response.data['results'][0]['name'], 'Customer 14')
+        cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+
+        response = self.get({'cursor': cursor})
+        self.assertEqual([row['name'] for row in response.data['results']],
+                         [f'Customer {n}' for n in range(4, -1, -1)])
+        self.assertIsNone(response.data['next'])
+
+    def test_lookups_use_indexes(self):
+        """Test exact customer lookups are answered from an index"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Asserts on the SQLite query plan format')
+        for field in ('name', 'email', 'phone'):
+            plan = Customer.objects.filter(**{field: 'x'}).explain()
+            self.assertIn(f'customer_{field}_idx', plan)
@@ -2,6 +2,7 @@ from django.shortcuts import render
 from rest_framework import viewsets
 from .models import Customer
 from .serializers import CustomerSerializer
+from server.pagination import KeysetPagination
 
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.all()
@@ -9,5 +10,6 @@ class CustomerViewSet(viewsets.ModelViewSet):
     filterset_fields = ['name', 'email']
     search_fields = ['name', 'email', 'phone']
     ordering_fields = ['name', 'created_at']
+    pagination_class = KeysetPagination
 
 # Create your views here.
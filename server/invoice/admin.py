@@ -1,71 +1,70 @@
 from django.contrib import admin
-from django.utils.html import format_html
-from django.utils.safestring import mark_safe
-from django.conf import settings
-import os
-from .models import Invoice
-from .utils import generate_invoice_pdfs
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.utils.html import format_html, format_html_join
+from .models import GeneratedPDF, Invoice, InvoiceJob
+from .jobs import enqueue_invoice_job
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ['created_at', 'from_company', 'to_company', 'billing_date', 'download_pdf']
-    readonly_fields = ['created_at', 'pdf_file', 'generated_pdfs']
+    list_display = ['created_at', 'from_company', 'to_company', 'billing_date', 'generation_status', 'download_pdf']
+    readonly_fields = ['created_at', 'pdf_file', 'generation_status', 'generated_pdfs']
     
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        generate_invoice_pdfs(obj)
+        # PDFs are rendered by the run_invoice_jobs worker, not in this request
+        job = enqueue_invoice_job(obj)
+        self.message_user(request, f"Invoice PDF generation queued (job #{job.pk})")
+
+    def get_queryset(self, request):
+        # Each row shows its latest job; fetch those in one query for the page
+        latest = InvoiceJob.objects.filter(invoice=OuterRef('invoice')).order_by('-created_at', '-pk')
+        return super().get_queryset(request).prefetch_related(Prefetch(
+            'jobs', queryset=InvoiceJob.objects.filter(pk=Subquery(latest.values('pk')[:1])), to_attr='latest_jobs'
+        ))
+
+    def generation_status(self, obj):
+        job = next(iter(obj.latest_jobs), None) if hasattr(obj, 'latest_jobs') else obj.jobs.first()
+        if job is None:
+            return '-'
+        if job.status == 'running' and job.total:
+            return f"{job.get_status_display()} ({job.progress}/{job.total})"
+        if job.status == 'completed':
+            return f"{job.get_status_display()} ({job.rendered} rendered, {job.reused} reused)"
+        if job.failed_accounts:
+            return f"{job.get_status_display()} ({len(job.failed_accounts)} failed)"
+        return job.get_status_display()
+    generation_status.short_description = "PDF Generation"
 
     def download_pdf(self, obj):
         if obj.pdf_file:
-            # Get all PDFs in the invoices directory
-            invoice_dir = os.path.join(settings.MEDIA_ROOT, 'invoices')
-            if os.path.exists(invoice_dir):
-                pdfs = [f for f in os.listdir(invoice_dir) if f.endswith('.pdf')]
-                if pdfs:
-                    # Return link to the first PDF found
-                    pdf_url = f"{settings.MEDIA_URL}invoices/{pdfs[0]}"
-                    return format_html('<a href="{}" target="_blank">Download PDF</a>', pdf_url)
+            return format_html('<a href="{}" target="_blank">Download PDF</a>', obj.pdf_file.url)
         return "No PDF available"
     download_pdf.short_description = "Invoice PDF"
 
     def generated_pdfs(self, obj):
         """Display all PDFs generated for this invoice"""
-        invoice_dir = os.path.join(settings.MEDIA_ROOT, 'invoices')
-        if not os.path.exists(invoice_dir):
+        pdfs = list(obj.pdfs.all())
+        if not pdfs:
             return "No PDFs generated yet"
-            
-        # List all PDF files in the directory
-        pdf_files = [f for f in os.listdir(invoice_dir) if f.endswith('.pdf')]
-        
-        if not pdf_files:
-            return "No PDFs found"
-            
-        pdf_links = []
-        for pdf in pdf_files:
-            # Create the correct URL for each PDF
-            pdf_url = f"{settings.MEDIA_URL}invoices/{pdf}"
-            # Check if file exists
-            pdf_path = os.path.join(invoice_dir, pdf)
-            if os.path.exists(pdf_path):
-                file_size = os.path.getsize(pdf_path) / 1024  # Convert to KB
-                pdf_links.append(
-                    f'<div style="margin: 5px 0; padding: 8px; background-color: #f5f5f5; '
-                    f'border-radius: 4px; display: flex; justify-content: space-between; align-items: center;">'
-                    f'<span>📄 {pdf} ({file_size:.1f} KB)</span>'
-                    f'<a href="{pdf_url}" target="_blank" '
-                    f'style="background-color: #447e9b; color: white; padding: 4px 8px; '
-                    f'border-radius: 3px; text-decoration: none;">Download</a>'
-                    f'</div>'
-                )
-        
-        return mark_safe('<div style="max-height: 400px; overflow-y: auto;">' + 
-                        ''.join(pdf_links) + '</div>')
+
+        pdf_links = format_html_join(
+            '',
+            '<div style="margin: 5px 0; padding: 8px; background-color: #f5f5f5; '
+            'border-radius: 4px; display: flex; justify-content: space-between; align-items: center;">'
+            '<span>📄 {} ({} KB)</span>'
+            '<a href="{}" target="_blank" '
+            'style="background-color: #447e9b; color: white; padding: 4px 8px; '
+            'border-radius: 3px; text-decoration: none;">Download</a>'
+            '</div>',
+            ((pdf, f'{pdf.size / 1024:.1f}', pdf.file.url) for pdf in pdfs)
+        )
+        return format_html('<div style="max-height: 400px; overflow-y: auto;">{}</div>', pdf_links)
     generated_pdfs.short_description = "Generated PDFs"
 
     fieldsets = (
         (None, {
             'fields': ('excel_file', 'from_company', 'to_company', 
-                      'billing_date', 'gmt', 'created_at')
+                      'billing_date', 'gmt', 'created_at', 'generation_status')
         }),
         ('Generated Documents', {
             'fields': ('generated_pdfs',),
@@ -77,3 +76,21 @@ class InvoiceAdmin(admin.ModelAdmin):
         css = {
             'all': ('admin/css/custom.css',)
         }
+
+
+@admin.register(InvoiceJob)
+class InvoiceJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'invoice', 'status', 'progress', 'total', 'rendered', 'reused', 'attempts',
+                    'created_at', 'started_at', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['invoice', 'status', 'progress', 'total', 'attempts', 'rendered', 'reused', 'pending_accounts',
+                       'failed_accounts', 'error', 'created_at', 'started_at', 'heartbeat_at', 'finished_at']
+
+
+@admin.register(GeneratedPDF)
+class GeneratedPDFAdmin(admin.ModelAdmin):
+    list_display = ['file', 'invoice', 'account_id', 'size', 'render_time', 'rendered_at']
+    list_filter = ['invoice']
+    search_fields = ['account_id']
+    list_select_related = ['invoice']
+    readonly_fields = ['invoice', 'account_id', 'file', 'size', 'digest', 'render_time', 'rendered_at']
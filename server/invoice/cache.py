@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from .readers import REQUIRED_COLUMNS, iter_chunks, prepare
+
+DEFAULTS = {
+    'DIR': None,  # Defaults to parsed_uploads in the system temp directory
+    'MAX_BYTES': 2 * 1024 ** 3,
+}
+
+# Bump when the parsed layout or normalisation changes, so old entries are ignored
+FORMAT_VERSION = 1
+NUMERIC_COLUMNS = ['Total duration', 'Call charges']
+TEXT_COLUMNS = ['Account id', 'Area prefix', 'Area name']
+
+
+class ParsedUploadCache:
+    """
+    Parsed invoice uploads, stored once per file content.
+
+    An upload is streamed through ``iter_chunks`` and ``prepare`` a single
+    time and written as one raw array file per column: numbers as float64,
+    text as category codes (categories kept in first-appearance order).
+    Loading memory-maps those files, so a cached upload is never parsed or
+    copied again. Entries are keyed by a SHA-256 of the file and evicted
+    least recently used first once the cache grows past ``MAX_BYTES``.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULTS['MAX_BYTES']):
+        # Never under MEDIA_ROOT: everything there is served publicly
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'parsed_uploads')
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'INVOICE_UPLOAD_CACHE', {})}
+        return cls(options['DIR'], options['MAX_BYTES'])
+
+    @staticmethod
+    def key(path):
+        digest = hashlib.sha256(f'v{FORMAT_VERSION}:'.encode())
+        with open(path, 'rb') as upload:
+            for block in iter(lambda: upload.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def load_or_parse(self, path):
+        """The normalised upload at ``path``, parsing it only on a cache miss"""
+        key = self.key(path)
+        data = self.load(key)
+        if data is None:
+            self.store(key, iter_chunks(path))
+            data = self.load(key)
+        return data
+
+    def load(self, key):
+        """Memory-mapped DataFrame for ``key``, or None if it is not cached"""
+        entry = self._entry(key)
+
+        def column(name):
+            dtype = meta['dtypes'][name]
+            if not meta['rows']:
+                return np.empty(0, dtype)  # mmap cannot map an empty file
+            path = os.path.join(entry, f'{meta["files"][name]}.bin')
+            return np.memmap(path, dtype=dtype, mode='r', shape=(meta['rows'],))
+
+        try:
+            with open(os.path.join(entry, 'meta.json')) as meta_file:
+                meta = json.load(meta_file)
+            os.utime(os.path.join(entry, 'meta.json'))  # Marks it recently used
+            # Once mapped, the columns stay readable even if the entry is evicted
+            columns = {name: column(name) for name in NUMERIC_COLUMNS + TEXT_COLUMNS + ['index']}
+        except FileNotFoundError:
+            return None  # Not cached, or evicted by another process while loading
+        for name in TEXT_COLUMNS:
+            columns[name] = pd.Categorical.from_codes(columns[name], meta['categories'][name])
+        return pd.DataFrame(
+            {name: columns[name] for name in REQUIRED_COLUMNS}, index=pd.Index(columns['index'], copy=False),
+            columns=REQUIRED_COLUMNS, copy=False,
+        )
+
+    def store(self, key, chunks):
+        """Write an entry from DataFrame ``chunks``; only one chunk is held at a time"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f'{self._entry(key)}.tmp-{os.getpid()}'
+        os.makedirs(tmp, exist_ok=True)
+        files = {name: f'c{position}' for position, name in enumerate(REQUIRED_COLUMNS)}
+        files['index'] = 'index'
+        parts = {name: open(os.path.join(tmp, f'{files[name]}.bin'), 'wb') for name in files}
+        categories = {name: {} for name in TEXT_COLUMNS}
+        rows = 0
+        try:
+            for chunk in chunks:
+                chunk = prepare(chunk)
+                rows += len(chunk)
+                parts['index'].write(chunk.index.to_numpy(dtype='int64').tobytes())
+                for name in NUMERIC_COLUMNS:
+                    parts[name].write(chunk[name].to_numpy(dtype='float64').tobytes())
+                for name in TEXT_COLUMNS:
+                    parts[name].write(self._codes(chunk[name], categories[name]).tobytes())
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        finally:
+            for part in parts.values():
+                part.close()
+
+        dtypes = {name: 'int32' for name in TEXT_COLUMNS}
+        dtypes.update({name: 'float64' for name in NUMERIC_COLUMNS}, index='int64')
+        with open(os.path.join(tmp, 'meta.json'), 'w') as meta_file:
+            json.dump({
+                'rows': rows,
+                'files': files,
+                'dtypes': dtypes,
+                'categories': {name: list(values) for name, values in categories.items()},
+                'created_at': time.time(),
+            }, meta_file)
+
+        try:
+            os.rename(tmp, self._entry(key))
+        except OSError:
+            # Another process cached the same upload first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    @staticmethod
+    def _codes(values, categories):
+        """Codes for ``values`` against ``categories`` (value -> code), adding new ones in order"""
+        codes, uniques = pd.factorize(values.astype(str).where(values.notna()))
+        mapping = np.array([categories.setdefault(value, len(categories)) for value in uniques], dtype='int32')
+        return np.where(codes >= 0, mapping[codes] if len(mapping) else codes, -1).astype('int32')
+
+    def _size(self, entry):
+        return sum(
+            os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry)
+        )
+
+    def entries(self):
+        """[(key, bytes, last_used)] for every complete entry"""
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for key in os.listdir(self.directory):
+            meta = os.path.join(self._entry(key), 'meta.json')
+            if '.tmp-' in key or not os.path.exists(meta):
+                continue
+            result.append((key, self._size(self._entry(key)), os.path.getmtime(meta)))
+        return result
+
+    def evict(self, keep=None):
+        """Drop least recently used entries until the cache fits in ``max_bytes``"""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+upload_cache = ParsedUploadCache.from_settings()
+
+
+class AccountPartitions:
+    """
+    Splits a cached upload into partitions that no account spans.
+
+    The parsed upload is memory-mapped from ``upload_cache`` (parsing it on
+    the first use), and rows are grouped into buckets by account code. Each
+    bucket is copied out only when iterated, so memory stays bounded by one
+    bucket of about ``partition_rows`` rows. ``accounts`` lists the account
+    ids in order of first appearance.
+    """
+    PARTITION_ROWS = 50000
+
+    def __init__(self, path, accounts=None, partition_rows=PARTITION_ROWS, cache=None):
+        self.path = path
+        self.wanted = accounts
+        self.partition_rows = partition_rows
+        self.cache = cache or upload_cache
+        self.accounts = []
+
+    def __enter__(self):
+        data = self.cache.load_or_parse(self.path)
+        account_ids = data['Account id'].cat
+        codes = account_ids.codes.to_numpy()
+        if self.wanted is None:
+            rows = np.arange(len(codes))
+            wanted = np.arange(len(account_ids.categories))
+        else:
+            wanted = account_ids.categories.get_indexer(list(self.wanted))
+            wanted = np.unique(wanted[wanted >= 0])
+            rows = np.flatnonzero(np.isin(codes, wanted))
+
+        # Codes were assigned in order of first appearance
+        self.accounts = list(account_ids.categories[wanted])
+        self.data = data
+        self.buckets = max(1, -(-len(rows) // self.partition_rows))
+
+        # A stable sort keeps each bucket's rows in file order
+        buckets = codes[rows] % self.buckets
+        order = np.argsort(buckets, kind='stable')
+        self.rows = rows[order]
+        self.bounds = np.searchsorted(buckets[order], np.arange(self.buckets + 1))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.data = self.rows = None
+
+    def __len__(self):
+        return self.buckets
+
+    def __iter__(self):
+        for bucket in range(self.buckets):
+            rows = self.rows[self.bounds[bucket]:self.bounds[bucket + 1]]
+            if not len(rows):
+                continue
+            data = self.data.take(rows)
+            for name in TEXT_COLUMNS:
+                data[name] = data[name].astype(object)
+            yield data
@@ -0,0 +1,118 @@
+import re
+import struct
+import zlib
+import hashlib
+from collections import namedtuple
+
+READ_SIZE = 64 * 1024
+ZIP_LIMIT = 0xFFFFFFFF  # Classic (non-Zip64) archives address at most 4 GiB
+
+# Fixed-size parts of the ZIP records, as laid out in zipfile
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_OF_CENTRAL_DIR = struct.Struct('<4s4H2LH')
+UTF8_NAMES = 0x800
+
+ZipEntry = namedtuple('ZipEntry', ['name', 'path', 'size', 'crc32', 'date_time'])
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(READ_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def parse_byte_range(header, size):
+    """
+    (start, end) inclusive for a single-range ``Range`` header, None when
+    the header is absent, malformed or asks for several ranges (the whole
+    body is sent then), or raises ValueError if it cannot be satisfied.
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N is the last N bytes
+        if int(last) == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+class StreamingZip:
+    """
+    A stored (uncompressed) ZIP archive that is never materialised.
+
+    The CRC and size of every entry are known up front, so the layout and
+    total size are computed from the entries alone and any byte range can
+    be produced by reading just the files it overlaps. PDFs hardly shrink
+    under deflate, so storing them costs little.
+    """
+
+    def __init__(self, entries):
+        self.segments = []  # (offset, bytes or ZipEntry)
+        offset = 0
+        central = []
+        for entry in entries:
+            name = entry.name.encode('utf-8')
+            dos_time, dos_date = self._dos(entry.date_time)
+            header = LOCAL_HEADER.pack(
+                b'PK\x03\x04', 20, 0, UTF8_NAMES, 0, dos_time, dos_date,
+                entry.crc32, entry.size, entry.size, len(name), 0,
+            ) + name
+            central.append(CENTRAL_HEADER.pack(
+                b'PK\x01\x02', 20, 3, 20, 0, UTF8_NAMES, 0, dos_time, dos_date,
+                entry.crc32, entry.size, entry.size, len(name), 0, 0, 0, 0, 0o100644 << 16, offset,
+            ) + name)
+            self.segments.append((offset, header))
+            offset += len(header)
+            self.segments.append((offset, entry))
+            offset += entry.size
+
+        directory = b''.join(central)
+        directory += END_OF_CENTRAL_DIR.pack(
+            b'PK\x05\x06', 0, 0, len(central), len(central), len(directory), offset, 0,
+        )
+        if offset + len(directory) > ZIP_LIMIT or len(central) > 0xFFFF:
+            raise ValueError('Archive too large for a ZIP without Zip64')
+        self.segments.append((offset, directory))
+        self.size = offset + len(directory)
+        self.etag = '"%s"' % hashlib.sha256(
+            b''.join(segment if isinstance(segment, bytes) else b'' for _, segment in self.segments)
+        ).hexdigest()[:32]
+
+    @staticmethod
+    def _dos(date_time):
+        year, month, day, hour, minute, second = date_time
+        year = max(year, 1980)
+        return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+    def chunks(self, start=0, end=None):
+        """Yield the archive's bytes from ``start`` to ``end`` inclusive"""
+        end = self.size - 1 if end is None else end
+        for offset, segment in self.segments:
+            length = len(segment) if isinstance(segment, bytes) else segment.size
+            if offset + length <= start:
+                continue
+            if offset > end:
+                break
+            skip = max(start - offset, 0)
+            take = min(end + 1, offset + length) - offset - skip
+            if isinstance(segment, bytes):
+                yield segment[skip:skip + take]
+                continue
+            with open(segment.path, 'rb') as source:
+                source.seek(skip)
+                while take > 0:
+                    block = source.read(min(READ_SIZE, take))
+                    if not block:
+                        raise IOError(f'{segment.path} is shorter than recorded')
+                    take -= len(block)
+                    yield block
@@ -0,0 +1,117 @@
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import InvoiceJob
+from .utils import generate_invoice_pdfs
+
+# Progress is written at most this often, so large batches don't flood the DB
+PROGRESS_INTERVAL = 1.0
+
+
+def enqueue_invoice_job(invoice):
+    """Queue PDF generation for an invoice, reusing a job that has not started yet"""
+    job = invoice.jobs.filter(status='queued').first()
+    if job is None:
+        return InvoiceJob.objects.create(invoice=invoice)
+    if job.pending_accounts is not None or job.attempts:
+        # A retry of a few accounts; the invoice changed, so all of them need rendering
+        job.pending_accounts = None
+        job.attempts = 0
+        job.save(update_fields=['pending_accounts', 'attempts'])
+    return job
+
+
+def requeue_stale_jobs():
+    """Put running jobs whose worker stopped heartbeating back in the queue; returns how many"""
+    lease = getattr(settings, 'INVOICE_JOB_LEASE', 600)
+    max_attempts = getattr(settings, 'INVOICE_JOB_MAX_ATTEMPTS', 3)
+    cutoff = timezone.now() - timedelta(seconds=lease)
+    stale = InvoiceJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff), status='running'
+    )
+    # The attempt that crashed counts towards the limit
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status='failed', error='Worker stopped responding', finished_at=timezone.now()
+    )
+    return failed + stale.update(status='queued', heartbeat_at=None)
+
+
+def claim_next_job():
+    """Mark the oldest queued job as running and return it, or None"""
+    requeue_stale_jobs()
+    with transaction.atomic():
+        # skip_locked lets several workers poll the same table. Locking the
+        # invoice row too, and leaving out invoices with a running job, keeps
+        # two workers from rendering the same invoice at once.
+        running = InvoiceJob.objects.filter(status='running').values('invoice')
+        job = (InvoiceJob.objects.select_related('invoice')
+               .select_for_update(skip_locked=True, of=('self', 'invoice'))
+               .filter(status='queued').exclude(invoice__in=running)
+               .order_by('created_at', 'pk').first())
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.progress = 0
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.finished_at = None
+        job.save()
+        return job
+
+
+def run_job(job, workers=None):
+    """Generate the job's PDFs; failed accounts are re-queued until attempts run out"""
+    max_attempts = getattr(settings, 'INVOICE_JOB_MAX_ATTEMPTS', 3)
+    failures = {}
+    reused = []
+    last_write = 0
+
+    def progress(done, total, account_id):
+        nonlocal last_write
+        if done == total or time.monotonic() - last_write >= PROGRESS_INTERVAL:
+            job.heartbeat_at = timezone.now()
+            InvoiceJob.objects.filter(pk=job.pk).update(progress=done, total=total, heartbeat_at=job.heartbeat_at)
+            last_write = time.monotonic()
+        job.progress, job.total = done, total
+
+    def on_error(account_id, error):
+        failures[account_id] = str(error)
+
+    try:
+        results = generate_invoice_pdfs(
+            job.invoice, workers, progress, job.pending_accounts, on_error, reused.append
+        )
+    except Exception:
+        job.error = traceback.format_exc()
+        job.status = 'queued' if job.attempts < max_attempts else 'failed'
+    else:
+        job.error = ''
+        job.rendered += len(results) - len(reused)
+        job.reused += len(reused)
+        job.failed_accounts = failures
+        if not failures:
+            job.status = 'completed'
+            job.pending_accounts = None
+        else:
+            job.pending_accounts = sorted(failures)
+            job.status = 'queued' if job.attempts < max_attempts else 'failed'
+
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def run_pending_jobs(limit=None, workers=None):
+    """Process queued jobs in this process until none are left; returns how many ran"""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job, workers)
+        processed += 1
+    return processed
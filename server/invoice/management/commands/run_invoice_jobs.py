@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from invoice.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Process queued invoice PDF generation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the jobs currently queued and exit')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes used to render each job (defaults to INVOICE_PDF_WORKERS)')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_pending_jobs(workers=options['workers'])
+            if processed:
+                self.stdout.write(f"Processed {processed} invoice job(s)")
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,97 @@
+import os
+import re
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from invoice.cache import AccountPartitions
+from invoice.models import GeneratedPDF, Invoice
+from invoice.utils import safe_account_id
+
+FLAT_PDF = re.compile(r'^Invoice_(\d{4})(\d{2})-(.+)\.pdf$')
+
+
+class Command(BaseCommand):
+    help = ('Move PDFs generated into the flat MEDIA_ROOT/invoices directory into '
+            'per-invoice subdirectories and record them as GeneratedPDF rows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+
+    @staticmethod
+    def account_ids(invoice):
+        """{name in the file name: [account ids of the upload that clean to it]}"""
+        with AccountPartitions(invoice.excel_file.path) as partitions:
+            accounts = partitions.accounts
+        names = {}
+        for account_id in accounts:
+            names.setdefault(safe_account_id(account_id), []).append(account_id)
+        return names
+
+    def handle(self, *args, **options):
+        invoice_dir = os.path.join(settings.MEDIA_ROOT, 'invoices')
+        if not os.path.isdir(invoice_dir):
+            self.stdout.write("No invoices directory, nothing to do")
+            return
+
+        moved = skipped = 0
+        invoices = {}
+        account_ids = {}
+        for name in sorted(os.listdir(invoice_dir)):
+            match = FLAT_PDF.match(name)
+            if not match or not os.path.isfile(os.path.join(invoice_dir, name)):
+                continue
+            year, month, name_id = match.groups()
+
+            # Flat file names only carry the billing month, and each generation
+            # overwrote the previous one, so the files belong to the newest
+            # invoice for that month
+            if (year, month) not in invoices:
+                invoices[year, month] = Invoice.objects.filter(
+                    billing_date__year=year, billing_date__month=month
+                ).order_by('-created_at', '-pk').first()
+            invoice = invoices[year, month]
+            if invoice is None:
+                self.stdout.write(f"Skipping {name}: no invoice for {year}-{month}")
+                skipped += 1
+                continue
+
+            # File names carry the account id with special characters removed;
+            # the row needs the id itself, as generation looks it up by that
+            if invoice.pk not in account_ids:
+                try:
+                    account_ids[invoice.pk] = self.account_ids(invoice)
+                except Exception as e:
+                    self.stdout.write(f"Cannot read the upload of invoice #{invoice.pk}: {e}")
+                    account_ids[invoice.pk] = None
+            if account_ids[invoice.pk] is None:
+                self.stdout.write(f"Skipping {name}: unknown accounts for invoice #{invoice.pk}")
+                skipped += 1
+                continue
+            matches = account_ids[invoice.pk].get(name_id, [])
+            if len(matches) != 1:
+                reason = f"matches accounts {', '.join(matches)}" if matches else "matches no account"
+                self.stdout.write(f"Skipping {name}: {reason} of invoice #{invoice.pk}")
+                skipped += 1
+                continue
+            account_id = matches[0]
+
+            media_dir = f'invoices/{invoice.pk}'
+            if options['dry_run']:
+                self.stdout.write(f"Would move {name} to {media_dir}/")
+                moved += 1
+                continue
+
+            os.makedirs(os.path.join(settings.MEDIA_ROOT, media_dir), exist_ok=True)
+            os.replace(os.path.join(invoice_dir, name), os.path.join(settings.MEDIA_ROOT, media_dir, name))
+            GeneratedPDF.objects.update_or_create(
+                invoice=invoice, account_id=account_id,
+                defaults={
+                    'file': f'{media_dir}/{name}',
+                    'size': os.path.getsize(os.path.join(settings.MEDIA_ROOT, media_dir, name)),
+                },
+            )
+            if invoice.pdf_file and invoice.pdf_file.name == f'invoices/{name}':
+                Invoice.objects.filter(pk=invoice.pk).update(pdf_file=f'{media_dir}/{name}')
+            moved += 1
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(f"{verb} {moved} PDF(s), skipped {skipped}")
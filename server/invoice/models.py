@@ -1,8 +1,9 @@
+import os
 from django.db import models
 from django.conf import settings
 from crm.models import Customer
 from django.core.exceptions import ValidationError
-import pandas as pd
+from .readers import REQUIRED_COLUMNS, read_header
 
 class Invoice(models.Model):
     excel_file = models.FileField(upload_to='excel_files/')
@@ -13,15 +14,21 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     pdf_file = models.FileField(upload_to='invoices/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pages of InvoiceViewSet
+            models.Index(fields=['-created_at', '-id'], name='invoice_created_idx'),
+        ]
+
     def __str__(self):
         return f"Invoice {self.created_at.strftime('%Y-%m-%d')}"
 
     def clean(self):
         if self.excel_file:
             try:
-                df = pd.read_excel(self.excel_file)
-                required_columns = ['Account id', 'Area prefix', 'Area name', 'Total duration', 'Call charges']
-                missing_columns = [col for col in required_columns if col not in df.columns]
+                # Only the header row is read; the rows are streamed at generation time
+                columns = read_header(self.excel_file)
+                missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
                 if missing_columns:
                     raise ValidationError(f"Excel file missing required columns: {missing_columns}")
             except Exception as e:
@@ -39,3 +46,59 @@ class InvoiceItem(models.Model):
 
     def __str__(self):
         return f"{self.description} - {self.invoice.invoice_number}"
+
+class GeneratedPDF(models.Model):
+    """One account's invoice PDF, recorded when it is generated"""
+    invoice = models.ForeignKey(Invoice, related_name='pdfs', on_delete=models.CASCADE)
+    account_id = models.CharField(max_length=255)
+    file = models.FileField(upload_to='invoices/', max_length=255)
+    size = models.PositiveBigIntegerField(default=0)  # Bytes
+    crc32 = models.PositiveBigIntegerField(null=True, blank=True)  # Of the file, for streamed ZIP downloads
+    digest = models.CharField(max_length=64, blank=True)  # account_digest of the inputs it was rendered from
+    render_time = models.FloatField(null=True, blank=True)  # Seconds
+    rendered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['invoice', 'pk']
+        unique_together = ('invoice', 'account_id')
+
+    def __str__(self):
+        return os.path.basename(self.file.name)
+
+class InvoiceJob(models.Model):
+    """Background generation of an invoice's PDFs, processed by run_invoice_jobs"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    invoice = models.ForeignKey(Invoice, related_name='jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    progress = models.PositiveIntegerField(default=0)  # Accounts processed in the current attempt
+    total = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    rendered = models.PositiveIntegerField(default=0)  # PDFs rendered, over all attempts
+    reused = models.PositiveIntegerField(default=0)  # Unchanged PDFs kept from an earlier run
+    # Accounts still to render on the next attempt; null means all of them
+    pending_accounts = models.JSONField(null=True, blank=True)
+    failed_accounts = models.JSONField(default=dict, blank=True)  # account id -> error
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while running; a stale one means the worker died
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Job #{self.pk} for {self.invoice} ({self.status})"
+
+    @property
+    def duration(self):
+        if self.started_at and self.finished_at:
+            return (self.finished_at - self.started_at).total_seconds()
+        return None
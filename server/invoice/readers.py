@@ -0,0 +1,87 @@
+import csv
+import pandas as pd
+from openpyxl import load_workbook
+
+REQUIRED_COLUMNS = ['Account id', 'Area prefix', 'Area name', 'Total duration', 'Call charges']
+CHUNK_ROWS = 50000
+
+def is_csv(name):
+    return str(name).lower().endswith('.csv')
+
+def is_xlsx(name):
+    return str(name).lower().endswith(('.xlsx', '.xlsm'))
+
+def read_header(source):
+    """
+    Column names from the first row of a CSV or Excel upload, without
+    reading the rest of the file. ``source`` is a path or an open file.
+    """
+    name = getattr(source, 'name', source)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    try:
+        if is_csv(name):
+            if hasattr(source, 'readline'):
+                line = source.readline()
+            else:
+                with open(source, 'rb') as csv_file:
+                    line = csv_file.readline()
+            if isinstance(line, bytes):
+                line = line.decode('utf-8-sig')
+            return next(csv.reader([line]), [])
+        if is_xlsx(name):
+            workbook = load_workbook(source, read_only=True)
+            try:
+                header = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+            finally:
+                workbook.close()
+            header = list(header)
+            while header and header[-1] is None:
+                header.pop()
+            return header
+        # Legacy .xls has no streaming reader; pandas still only parses the header row
+        return list(pd.read_excel(source, nrows=0).columns)
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    Yield the rows of a CSV or Excel file as DataFrames of at most
+    ``chunk_rows`` rows. The index runs on across chunks, so it matches
+    what reading the whole file at once would give.
+    """
+    if is_csv(path):
+        # Account ids are kept as text so every chunk agrees on them
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={'Account id': str})
+        return
+
+    if not is_xlsx(path):
+        yield pd.read_excel(path)
+        return
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [column for column in next(rows, ()) if column is not None]
+        start, buffer = 0, []
+        for row in rows:
+            buffer.append(row[:len(header)])
+            if len(buffer) == chunk_rows:
+                yield _frame(buffer, header, start)
+                start, buffer = start + len(buffer), []
+        if buffer:
+            yield _frame(buffer, header, start)
+    finally:
+        workbook.close()
+
+def _frame(rows, header, start):
+    # object dtype stops a blank cell turning a chunk's integer ids into floats
+    return pd.DataFrame(rows, columns=header, index=pd.RangeIndex(start, start + len(rows)), dtype=object)
+
+def prepare(data):
+    """Coerce the columns the invoice needs to their working types"""
+    data['Total duration'] = pd.to_numeric(data['Total duration'], errors='coerce')
+    data['Call charges'] = pd.to_numeric(data['Call charges'], errors='coerce')
+    data['Account id'] = data['Account id'].astype(str)  # Ensure Account ID is string
+    return data
@@ -1,6 +1,6 @@
+from django.core.exceptions import ValidationError
 from rest_framework import serializers
-from .models import Invoice, InvoiceItem
-from crm.serializers import CustomerSerializer
+from .models import GeneratedPDF, Invoice, InvoiceItem, InvoiceJob
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
     total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -11,10 +11,33 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
 
 class InvoiceSerializer(serializers.ModelSerializer):
     items = InvoiceItemSerializer(many=True, read_only=True)
-    customer_details = CustomerSerializer(source='customer', read_only=True)
-    
+
     class Meta:
         model = Invoice
-        fields = ['id', 'customer', 'customer_details', 'invoice_number', 
-                 'issue_date', 'due_date', 'total_amount', 'status', 
-                 'items', 'created_at', 'updated_at']
\ No newline at end of file
+        fields = ['id', 'excel_file', 'from_company', 'to_company', 'billing_date', 'gmt',
+                  'pdf_file', 'items', 'created_at']
+        read_only_fields = ['pdf_file', 'created_at']
+
+    def validate_excel_file(self, value):
+        # The same header check as the admin form
+        try:
+            Invoice(excel_file=value).clean()
+        except ValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return value
+
+class InvoiceJobSerializer(serializers.ModelSerializer):
+    duration = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = InvoiceJob
+        fields = ['id', 'invoice', 'status', 'progress', 'total', 'attempts', 'rendered', 'reused', 'pending_accounts',
+                  'failed_accounts', 'error', 'created_at', 'started_at', 'finished_at', 'duration']
+        read_only_fields = [field for field in fields if field != 'invoice']
+
+
+class GeneratedPDFSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GeneratedPDF
+        fields = ['id', 'invoice', 'account_id', 'file', 'size', 'crc32', 'digest', 'render_time', 'rendered_at']
+        read_only_fields = fields
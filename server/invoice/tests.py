@@ -1,3 +1,718 @@
-from django.test import TestCase
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from . import utils
+from .jobs import claim_next_job, enqueue_invoice_job, run_pending_jobs
+from .models import Invoice, InvoiceJob
+from .cache import AccountPartitions, ParsedUploadCache
+from .readers import iter_chunks, prepare, read_header
+from .utils import account_totals, invoice_context, render_invoice_pdfs, split_accounts, table_cells
+
+
+def make_cdr_data(accounts=3, rows_per_account=4):
+    """Synthetic call detail rows in the uploaded Excel layout"""
+    rows = []
+    for row in range(rows_per_account):
+        for account in range(accounts):
+            rows.append({
+                'Account id': f'client{account}',
+                'Area prefix': 880 + row,
+                'Area name': f'Area {row}',
+                'Total duration': 60 * (row + 1) + account,
+                'Call charges': 0.37 * (row + 1) + account,
+            })
+    return pd.DataFrame(rows)
+
+
+class SplitAccountsTest(SimpleTestCase):
+    def test_matches_boolean_masks(self):
+        """Test the groupby split gives the same slices, in the same order, as masking per account"""
+        data = make_cdr_data(accounts=4, rows_per_account=5)
+        expected = [
+            (account_id, data[data['Account id'] == account_id])
+            for account_id in data['Account id'].unique()
+        ]
+        accounts = split_accounts(data)
+        self.assertEqual([account_id for account_id, _ in accounts], [account_id for account_id, _ in expected])
+        for (_, rows), (_, expected_rows) in zip(accounts, expected):
+            pd.testing.assert_frame_equal(rows, expected_rows)
+
+        self.assertEqual([account_id for account_id, _ in split_accounts(data, ['client3', 'client1'])],
+                         ['client1', 'client3'])
+
+    def test_account_totals(self):
+        """Test per-account totals match summing each account's rounded rows"""
+        data = make_cdr_data(accounts=3, rows_per_account=4)
+        totals = account_totals(data)
+        for account_id, rows in split_accounts(data):
+            sub_total = sum(Decimal(f'{charge:.2f}') for charge in rows['Call charges'])
+            tax = (sub_total / 10).quantize(Decimal('0.01'), ROUND_HALF_UP)
+            self.assertEqual(totals.at[account_id, 'lines'], 4)
+            self.assertEqual(totals.at[account_id, 'sub_total'], sub_total)
+            self.assertEqual(totals.at[account_id, 'total'], sub_total + tax)
+
+
+class TableCellsTest(SimpleTestCase):
+    def test_matches_row_by_row_formatting(self):
+        """Test the column-wise cell strings equal the ones built per row"""
+        _, rows = split_accounts(make_cdr_data())[1]
+        expected = [
+            (str(idx + 1), str(row['Area prefix']), str(row['Area name']),
+             f"{row['Total duration'] / 60:.2f} min", f"${row['Call charges']:.2f}")
+            for idx, row in rows.iterrows()
+        ]
+        self.assertEqual(list(table_cells(rows)), expected)
+
+
+class RenderInvoicePDFsTest(SimpleTestCase):
+    def setUp(self):
+        invoice = SimpleNamespace(
+            from_company='Provider', to_company='Client', gmt='+06:00',
+            billing_date=date(2025, 2, 1),
+        )
+        self.context = invoice_context(invoice, issued_at=datetime(2025, 3, 1, 9, 30))
+        self.data = make_cdr_data()
+
+    def render(self, workers, progress=None):
+        output_dir = tempfile.mkdtemp()
+        context = {**self.context, 'output_dir': output_dir}
+        results = render_invoice_pdfs(self.data, context, workers, progress)
+        contents = {}
+        for _, filename in results:
+            with open(os.path.join(output_dir, filename), 'rb') as pdf_file:
+                contents[filename] = pdf_file.read()
+        return results, contents
+
+    def test_one_pdf_per_account(self):
+        """Test each account gets its own invoice number"""
+        calls = []
+        results, _ = self.render(1, lambda done, total, account_id: calls.append((done, total)))
+        self.assertEqual(results, [
+            ('client0', 'Invoice_202502-client0.pdf'),
+            ('client1', 'Invoice_202502-client1.pdf'),
+            ('client2', 'Invoice_202502-client2.pdf'),
+        ])
+        self.assertEqual(calls, [(1, 3), (2, 3), (3, 3)])
+
+    def test_unchanged_accounts_are_reused(self):
+        """Test only accounts whose rows or invoice details changed are rendered again"""
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        context = {**self.context, 'output_dir': output_dir}
+
+        def render(data, context):
+            reused = []
+            results = render_invoice_pdfs(data, context, on_reused=reused.append)
+            return results, reused
+
+        first, reused = render(self.data, context)
+        self.assertEqual(reused, [])
+
+        again, reused = render(self.data, {**context, 'issued_at': datetime(2025, 3, 2)})
+        self.assertEqual(again, first)
+        self.assertEqual(reused, ['client0', 'client1', 'client2'])
+
+        changed = self.data.copy()
+        changed.loc[changed['Account id'] == 'client1', 'Call charges'] += 1
+        _, reused = render(changed, context)
+        self.assertEqual(reused, ['client0', 'client2'])
+
+        _, reused = render(changed, {**context, 'to_company': 'Other Client'})
+        self.assertEqual(reused, [])
+
+    def test_parallel_output_matches_serial(self):
+        """Test the process pool produces byte-identical PDFs"""
+        serial_results, serial = self.render(1)
+        calls = []
+        parallel_results, parallel = self.render(3, lambda *args: calls.append(args))
+        self.assertEqual(parallel_results, serial_results)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(sorted(call[0] for call in calls), [1, 2, 3])
+
+
+def cdr_upload(data, name='cdr.xlsx'):
+    content = io.BytesIO()
+    if name.endswith('.csv'):
+        data.to_csv(content, index=False)
+    else:
+        data.to_excel(content, index=False)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+def make_invoice(accounts=3, name='cdr.xlsx'):
+    return Invoice.objects.create(
+        excel_file=cdr_upload(make_cdr_data(accounts), name),
+        billing_date=date(2025, 2, 1),
+    )
+
+
+class ReadersTest(SimpleTestCase):
+    def setUp(self):
+        self.data = make_cdr_data(accounts=5, rows_per_account=7)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def write(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as cdr_file:
+            cdr_file.write(cdr_upload(self.data, name).read())
+        return path
+
+    def test_read_header(self):
+        """Test the header is read from uploads and paths, leaving uploads rewound"""
+        columns = list(self.data.columns)
+        for name in ('cdr.xlsx', 'cdr.csv'):
+            upload = cdr_upload(self.data, name)
+            self.assertEqual(read_header(upload), columns)
+            self.assertEqual(upload.tell(), 0)
+            self.assertEqual(read_header(self.write(name)), columns)
+
+    def test_chunks_match_full_read(self):
+        """Test chunked reading gives the same rows and index as reading the whole file"""
+        for name, read in (('cdr.xlsx', pd.read_excel), ('cdr.csv', pd.read_csv)):
+            path = self.write(name)
+            chunks = list(iter_chunks(path, chunk_rows=10))
+            self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 10, 5])
+            pd.testing.assert_frame_equal(
+                prepare(pd.concat(chunks)), prepare(read(path)), check_dtype=False
+            )
+
+
+
+class ParsedUploadCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.cache = ParsedUploadCache(os.path.join(self.tmp_dir, 'cache'))
+        self.data = make_cdr_data(accounts=5, rows_per_account=7)
+        self.path = self.write('cdr.xlsx', self.data)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as cdr_file:
+            cdr_file.write(cdr_upload(data, name).read())
+        return path
+
+    def test_parsed_once_and_memory_mapped(self):
+        """Test a second load reuses the parsed columns without reading the upload"""
+        data = self.cache.load_or_parse(self.path)
+        expected = prepare(pd.read_excel(self.path))
+        self.assertEqual(
+            data.astype({'Account id': str, 'Area prefix': int, 'Area name': str}).to_dict('index'),
+            expected.to_dict('index'),
+        )
+        # The column's memory is the mapped cache file, not a copy
+        buffer = data['Call charges'].to_numpy()
+        while isinstance(buffer, np.ndarray):
+            buffer = buffer.base
+        self.assertIsInstance(buffer, mmap.mmap)
+
+        with mock.patch('invoice.cache.iter_chunks') as iter_chunks:
+            again = self.cache.load_or_parse(self.path)
+        iter_chunks.assert_not_called()
+        pd.testing.assert_frame_equal(again, data)
+
+    def test_evicts_least_recently_used(self):
+        """Test the cache drops the oldest entries once it is over its size limit"""
+        first = self.cache.key(self.path)
+        self.cache.load_or_parse(self.path)
+        size = self.cache.entries()[0][1]
+        # Room for two entries of this shape, but not three
+        self.cache.max_bytes = size * 2 + size // 2
+
+        second = self.write('second.csv', self.data.iloc[::-1])
+        self.cache.load_or_parse(second)
+        self.assertEqual(len(self.cache.entries()), 2)
+
+        os.utime(os.path.join(self.cache.directory, first, 'meta.json'), (0, 0))
+        self.cache.load_or_parse(self.write('third.csv', self.data.iloc[1:].iloc[::-1]))
+        keys = {key for key, _, _ in self.cache.entries()}
+        self.assertNotIn(first, keys)
+        self.assertIn(self.cache.key(second), keys)
+
+    def test_concurrent_eviction_is_a_miss(self):
+        """Test an entry evicted while being loaded is parsed again"""
+        key = self.cache.key(self.path)
+        self.cache.load_or_parse(self.path)
+        os.remove(os.path.join(self.cache.directory, key, 'c2.bin'))
+        self.assertIsNone(self.cache.load(key))
+
+        shutil.rmtree(os.path.join(self.cache.directory, key))
+        self.assertEqual(len(self.cache.load_or_parse(self.path)), len(self.data))
+
+    def test_partitions_split_by_account(self):
+        """Test every account lands in exactly one partition with all of its rows"""
+        expected = prepare(pd.read_excel(self.path))
+        with AccountPartitions(self.path, partition_rows=10, cache=self.cache) as partitions:
+            frames = list(partitions)
+            self.assertEqual(len(partitions), 4)
+            self.assertEqual(partitions.accounts, list(expected['Account id'].unique()))
+
+        accounts = [account_id for frame in frames for account_id in frame['Account id'].unique()]
+        self.assertEqual(sorted(accounts), sorted(set(accounts)))
+        pd.testing.assert_frame_equal(
+            pd.concat(frames).sort_index().astype({'Area prefix': int}), expected, check_dtype=False
+        )
+
+    def test_partitions_filter_accounts(self):
+        """Test partitions can be limited to some accounts"""
+        with AccountPartitions(self.path, accounts=['client3', 'client1', 'other'], cache=self.cache) as partitions:
+            frames = list(partitions)
+            self.assertEqual(partitions.accounts, ['client1', 'client3'])
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(len(frames[0]), 14)
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root, INVOICE_PDF_WORKERS=1)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache = mock.patch('invoice.cache.upload_cache', ParsedUploadCache(os.path.join(media_root, '.parsed')))
+        cache.start()
+        self.addCleanup(cache.stop)
+
+
+class InvoiceJobTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoice()
+
+    def test_job_renders_all_accounts(self):
+        """Test a queued job is picked up and completes with progress recorded"""
+        job = enqueue_invoice_job(self.invoice)
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(enqueue_invoice_job(self.invoice), job)
+
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((job.progress, job.total, job.attempts), (3, 3, 1))
+        self.assertEqual((job.rendered, job.reused), (3, 0))
+        self.assertEqual(job.failed_accounts, {})
+        self.assertIsNotNone(job.duration)
+        self.assertEqual(run_pending_jobs(), 0)
+
+        self.invoice.refresh_from_db()
+        media_dir = f'invoices/{self.invoice.pk}'
+        self.assertEqual(self.invoice.pdf_file.name, f'{media_dir}/Invoice_202502-client2.pdf')
+
+        pdfs = list(self.invoice.pdfs.all())
+        self.assertEqual([(pdf.account_id, pdf.file.name) for pdf in pdfs], [
+            (f'client{n}', f'{media_dir}/Invoice_202502-client{n}.pdf') for n in range(3)
+        ])
+        for pdf in pdfs:
+            self.assertEqual(pdf.size, os.path.getsize(pdf.file.path))
+            self.assertEqual(len(pdf.digest), 64)
+            self.assertIsNotNone(pdf.render_time)
+
+        # Saving the invoice again without changes reuses every PDF
+        job = enqueue_invoice_job(self.invoice)
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rendered, job.reused), ('completed', 0, 3))
+        self.assertEqual(
+            [(pdf.rendered_at, pdf.render_time) for pdf in self.invoice.pdfs.all()],
+            [(pdf.rendered_at, pdf.render_time) for pdf in pdfs],
+        )
+
+    def test_shard_flat_pdfs(self):
+        """Test PDFs from the old flat directory move under the newest invoice for their month"""
+        older = make_invoice()
+        Invoice.objects.filter(pk=older.pk).update(created_at=datetime(2025, 1, 1, tzinfo=timezone.utc))
+        flat_dir = os.path.join(settings.MEDIA_ROOT, 'invoices')
+        os.makedirs(flat_dir, exist_ok=True)
+        for name in ('Invoice_202502-client0.pdf', 'Invoice_202502-client1.pdf', 'Invoice_202401-gone.pdf'):
+            with open(os.path.join(flat_dir, name), 'wb') as pdf_file:
+                pdf_file.write(b'%PDF-1.3')
+        Invoice.objects.filter(pk=self.invoice.pk).update(pdf_file='invoices/Invoice_202502-client1.pdf')
+
+        call_command('shard_invoice_pdfs', stdout=io.StringIO())
+
+        self.assertEqual(set(os.listdir(flat_dir)), {'Invoice_202401-gone.pdf', str(self.invoice.pk)})
+        self.assertEqual(
+            list(self.invoice.pdfs.values_list('account_id', 'file', 'size')),
+            [('client0', f'invoices/{self.invoice.pk}/Invoice_202502-client0.pdf', 8),
+             ('client1', f'invoices/{self.invoice.pk}/Invoice_202502-client1.pdf', 8)],
+        )
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_file.name, f'invoices/{self.invoice.pk}/Invoice_202502-client1.pdf')
+        self.assertFalse(older.pdfs.exists())
+
+
+    def test_shard_maps_file_names_to_account_ids(self):
+        """Test sharded PDFs are recorded under the upload's account ids, not their cleaned file names"""
+        ids = {'client0': 'ACC 1', 'client1': 'ACC.2', 'client2': 'ACC2'}
+        data = make_cdr_data(accounts=3).replace({'Account id': ids})
+        invoice = Invoice.objects.create(excel_file=cdr_upload(data), billing_date=date(2025, 2, 1))
+        flat_dir = os.path.join(settings.MEDIA_ROOT, 'invoices')
+        os.makedirs(flat_dir, exist_ok=True)
+        for name in ('Invoice_202502-ACC1.pdf', 'Invoice_202502-ACC2.pdf'):
+            with open(os.path.join(flat_dir, name), 'wb') as pdf_file:
+                pdf_file.write(b'%PDF-1.3')
+
+        out = io.StringIO()
+        call_command('shard_invoice_pdfs', stdout=out)
+        self.assertIn('Skipping Invoice_202502-ACC2.pdf: matches accounts ACC.2, ACC2', out.getvalue())
+        self.assertEqual(list(invoice.pdfs.values_list('account_id', flat=True)), ['ACC 1'])
+
+        # The next generation updates that row instead of adding a second one
+        enqueue_invoice_job(invoice)
+        run_pending_jobs()
+        self.assertEqual(invoice.pdfs.filter(file=f'invoices/{invoice.pk}/Invoice_202502-ACC1.pdf').count(), 1)
+
+    def test_csv_upload(self):
+        """Test CSV uploads are validated from their header and rendered"""
+        invoice = make_invoice(accounts=2, name='cdr.csv')
+        invoice.full_clean()
+        enqueue_invoice_job(invoice)
+        run_pending_jobs()
+        self.assertEqual(invoice.jobs.get().status, 'completed')
+
+        invoice.excel_file = cdr_upload(make_cdr_data().drop(columns=['Call charges']), 'bad.csv')
+        with self.assertRaisesMessage(ValidationError, 'missing required columns'):
+            invoice.full_clean()
+
+    def test_failed_accounts_are_retried(self):
+        """Test only the accounts that failed are rendered again"""
+        render = utils.render_account_pdf
+        calls = []
+
+        def flaky(account_id, *args):
+            calls.append(account_id)
+            if account_id == 'client1' and calls.count('client1') == 1:
+                raise OSError('disk full')
+            return render(account_id, *args)
+
+        job = enqueue_invoice_job(self.invoice)
+        with mock.patch('invoice.utils.render_account_pdf', flaky):
+            self.assertEqual(run_pending_jobs(limit=1), 1)
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'queued')
+            self.assertEqual(job.failed_accounts, {'client1': 'disk full'})
+            self.assertEqual(job.pending_accounts, ['client1'])
+
+            run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(calls, ['client0', 'client1', 'client2', 'client1'])
+
+    def test_requeue_renders_every_account(self):
+        """Test enqueueing over a queued retry renders all accounts again"""
+        job = enqueue_invoice_job(self.invoice)
+        InvoiceJob.objects.filter(pk=job.pk).update(pending_accounts=['client1'], attempts=1)
+
+        self.assertEqual(enqueue_invoice_job(self.invoice), job)
+        job.refresh_from_db()
+        self.assertEqual((job.pending_accounts, job.attempts), (None, 0))
+
+    def test_one_running_job_per_invoice(self):
+        """Test a job is not claimed while another job for its invoice runs"""
+        running = enqueue_invoice_job(self.invoice)
+        self.assertEqual(claim_next_job(), running)
+        queued = enqueue_invoice_job(self.invoice)
+        other = enqueue_invoice_job(make_invoice())
+
+        self.assertEqual(claim_next_job(), other)
+        self.assertIsNone(claim_next_job())
+        InvoiceJob.objects.filter(pk=running.pk).update(status='completed')
+        self.assertEqual(claim_next_job(), queued)
+
+    @override_settings(INVOICE_JOB_LEASE=60, INVOICE_JOB_MAX_ATTEMPTS=2)
+    def test_stale_running_jobs_are_requeued(self):
+        """Test a job whose worker stopped heartbeating is picked up again"""
+        job = enqueue_invoice_job(self.invoice)
+        claim_next_job()
+        self.assertIsNone(claim_next_job())
+
+        expired = datetime.now(timezone.utc) - timedelta(seconds=61)
+        InvoiceJob.objects.filter(pk=job.pk).update(heartbeat_at=expired)
+        self.assertEqual(claim_next_job(), job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('running', 2))
+
+        # Out of attempts, it fails instead
+        InvoiceJob.objects.filter(pk=job.pk).update(heartbeat_at=expired)
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    @override_settings(INVOICE_JOB_MAX_ATTEMPTS=2)
+    def test_job_fails_after_max_attempts(self):
+        """Test a job that keeps failing stops being retried"""
+        job = enqueue_invoice_job(self.invoice)
+        with mock.patch('invoice.utils.render_account_pdf', side_effect=OSError('disk full')):
+            self.assertEqual(run_pending_jobs(), 2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(sorted(job.failed_accounts), ['client0', 'client1', 'client2'])
+
+
+class InvoiceAdminTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user_model().objects.create_superuser(username='admin', password='testpass123'))
+
+    def test_changelist_query_count(self):
+        """Test the generation status column does not query once per invoice"""
+        def changelist():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/invoice/invoice/')
+            self.assertEqual(response.status_code, 200)
+            return response, len(queries)
+
+        enqueue_invoice_job(make_invoice(accounts=1))
+        _, expected = changelist()
+        for _ in range(4):
+            invoice = make_invoice(accounts=1)
+            enqueue_invoice_job(invoice)
+        InvoiceJob.objects.create(invoice=invoice, status='completed', rendered=1)
+
+        response, count = changelist()
+        self.assertEqual(count, expected)
+        self.assertContains(response, 'Completed (1 rendered, 0 reused)', count=1)
+        self.assertContains(response, 'Queued', count=4)
+
+
+class InvoiceJobAPITest(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(
+            username='testuser', email='test@example.com', password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.invoice = make_invoice(accounts=2)
+
+    def test_enqueue_and_poll(self):
+        """Test enqueuing a job over the API and polling its status"""
+        response = self.client.post('/api/invoice/jobs/', {'invoice': self.invoice.pk})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'queued')
+        job_id = response.data['id']
+
+        run_pending_jobs()
+
+        response = self.client.get(f'/api/invoice/jobs/{job_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual((response.data['progress'], response.data['total']), (2, 2))
+
+        response = self.client.get('/api/invoice/jobs/', {'invoice': self.invoice.pk})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(InvoiceJob.objects.count(), 1)
+
+    def test_generated_pdfs(self):
+        """Test the generated PDFs of an invoice are listed from the database"""
+        other = make_invoice(accounts=1)
+        for invoice in (self.invoice, other):
+            enqueue_invoice_job(invoice)
+        run_pending_jobs()
+
+        # The invoice filter is validated, then a count and one page of rows
+        with mock.patch('os.listdir') as listdir, self.assertNumQueries(3):
+            response = self.client.get('/api/invoice/pdfs/', {'invoice': self.invoice.pk})
+        listdir.assert_not_called()
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([pdf['account_id'] for pdf in response.data['results']], ['client0', 'client1'])
+        self.assertTrue(response.data['results'][0]['file'].endswith(
+            f'/media/invoices/{self.invoice.pk}/Invoice_202502-client0.pdf'
+        ))
+
+
+class InvoiceAPITest(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+    def test_list_filter_and_search(self):
+        """Test invoices page newest first and filter by their own fields"""
+        invoices = [make_invoice(accounts=1) for _ in range(12)]
+        Invoice.objects.filter(pk=invoices[0].pk).update(to_company='Acme Ltd.', billing_date=date(2025, 1, 1))
+
+        response = self.client.get('/api/invoice/invoices/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual([row['id'] for row in response.data['results']],
+                         [invoice.pk for invoice in invoices[:-11:-1]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], [invoices[1].pk, invoices[0].pk])
+
+        for params in ({'billing_date': '2025-01-01'}, {'to_company': 'Acme Ltd.'}, {'search': 'acme'}):
+            response = self.client.get('/api/invoice/invoices/', params)
+            self.assertEqual([row['id'] for row in response.data['results']], [invoices[0].pk], params)
+
+    def test_create_queues_generation(self):
+        """Test a new invoice is validated and its PDFs queued"""
+        response = self.client.post('/api/invoice/invoices/', {
+            'excel_file': cdr_upload(make_cdr_data(accounts=2)), 'billing_date': '2025-02-01',
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(InvoiceJob.objects.get().invoice_id, response.data['id'])
+
+        response = self.client.post('/api/invoice/invoices/', {
+            'excel_file': cdr_upload(make_cdr_data().drop(columns=['Call charges'])), 'billing_date': '2025-02-01',
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('missing required columns', str(response.data['excel_file']))
+
+
+class InvoicePDFArchiveTest(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(
+            username='testuser', email='test@example.com', password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.invoice = make_invoice(accounts=3)
+        enqueue_invoice_job(self.invoice)
+        run_pending_jobs()
+        self.url = f'/api/invoice/{self.invoice.pk}/pdfs.zip'
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_streams_every_pdf(self):
+        """Test the archive is streamed, valid and contains each PDF unchanged"""
+        response, content = self.download()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [f'Invoice_202502-client{n}.pdf' for n in range(3)])
+            for pdf in self.invoice.pdfs.all():
+                with open(pdf.file.path, 'rb') as pdf_file:
+                    self.assertEqual(archive.read(os.path.basename(pdf.file.name)), pdf_file.read())
+
+    def test_resume_with_range(self):
+        """Test byte ranges can be stitched back into the full archive"""
+        _, full = self.download()
+        response, head = self.download(HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 0-99/{len(full)}')
+
+        etag = response['ETag']
+        response, tail = self.download(HTTP_RANGE='bytes=100-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(head + tail, full)
+
+        response, suffix = self.download(HTTP_RANGE='bytes=-22')
+        self.assertEqual(suffix, full[-22:])
+
+        response, content = self.download(HTTP_RANGE='bytes=0-99', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(content, full)
+
+        response, _ = self.download(HTTP_RANGE=f'bytes={len(full)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(full)}')
+
+    def test_missing_checksums_are_backfilled(self):
+        """Test PDFs recorded without a checksum (e.g. sharded ones) still download"""
+        self.invoice.pdfs.update(crc32=None)
+        _, content = self.download()
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+        self.assertFalse(self.invoice.pdfs.filter(crc32=None).exists())
+
+
+class MediaServingTest(MediaRootMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 40
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'invoices', '1'))
+        with open(os.path.join(settings.MEDIA_ROOT, 'invoices', '1', 'Invoice_202502-a.pdf'), 'wb') as pdf_file:
+            pdf_file.write(self.content)
+        self.url = '/media/invoices/1/Invoice_202502-a.pdf'
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_serves_file_with_validators(self):
+        """Test media is streamed with ETag and Last-Modified, and revalidates to 304"""
+        response, content = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(int(response['Content-Length']), len(self.content))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        response, _ = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response, _ = self.download(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        """Test single byte ranges, stale If-Range and unsatisfiable ranges"""
+        size = len(self.content)
+        response, content = self.download(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{size}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response, content = self.download(HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.content[1000:])
+
+        response, content = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.content)
+
+        response, _ = self.download(HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+    def test_missing_and_traversal_paths(self):
+        """Test missing files, directories and paths outside MEDIA_ROOT are 404"""
+        for url in ['/media/invoices/1/missing.pdf', '/media/invoices/1', '/media/../settings.py']:
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+    def test_proxy_backends(self):
+        """Test the proxy backends hand off the file without sending a body"""
+        with self.settings(MEDIA_SERVING={'BACKEND': 'x-accel', 'ACCEL_PREFIX': '/protected-media/'}):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/invoices/1/Invoice_202502-a.pdf')
+        self.assertEqual(response.content, b'')
+
+        with self.settings(MEDIA_SERVING={'BACKEND': 'x-sendfile'}):
+            response = self.client.get(self.url)
+        self.assertEqual(
+            response['X-Sendfile'], os.path.join(settings.MEDIA_ROOT, 'invoices', '1', 'Invoice_202502-a.pdf')
+        )
+        self.assertEqual(response['Content-Type'], 'application/pdf')
@@ -1,8 +1,16 @@
-from django.urls import path
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
 from . import views
 
+router = DefaultRouter()
+router.register(r'invoices', views.InvoiceViewSet, basename='invoice')
+router.register(r'jobs', views.InvoiceJobViewSet, basename='invoice-job')
+router.register(r'pdfs', views.GeneratedPDFViewSet, basename='generated-pdf')
+
 app_name = 'invoice'  # or 'invoice' for invoice/urls.py
 urlpatterns = [
     # Add your URL patterns here
     path('debug-media/<path:path>', views.debug_media, name='debug_media'),
+    path('<int:pk>/pdfs.zip', views.InvoicePDFArchiveView.as_view(), name='invoice-pdf-archive'),
+    path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,11 +1,64 @@
 from fpdf import FPDF
+from fpdf.fpdf import FPDF_VERSION
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+import hashlib
+import json
+import logging
 import os
+import time
 from django.conf import settings
-from .models import Invoice
+from django.utils import timezone
+from .cache import AccountPartitions
+from .downloads import file_crc32
+from .models import GeneratedPDF
+
+logger = logging.getLogger(__name__)
+
+TABLE_COLUMNS = ['Area prefix', 'Area name', 'Total duration', 'Call charges']
+# Bump whenever InvoicePDF's layout changes, so cached PDFs are rendered again
+TEMPLATE_VERSION = 1
+MANIFEST_NAME = '.manifest.json'
+TAX_RATE = Decimal('0.10')
+CENT = Decimal('0.01')
+
+def to_cents(charges):
+    """Charges as whole cents, the same amounts the table prints to 2 decimals"""
+    return (charges * 100).round().fillna(0).astype('int64')
+
+def cents_to_decimal(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+def invoice_totals(sub_total):
+    """(sub total, tax, total) as Decimals rounded to the cent"""
+    tax = (sub_total * TAX_RATE).quantize(CENT, ROUND_HALF_UP)
+    return sub_total, tax, sub_total + tax
+
+def table_cells(data):
+    """The table's cell strings row by row, formatted a whole column at a time"""
+    return zip(
+        (data.index + 1).astype(str).tolist(),
+        data['Area prefix'].astype(str).tolist(),
+        data['Area name'].astype(str).tolist(),
+        np.char.mod('%.2f min', data['Total duration'].to_numpy(dtype=float) / 60).tolist(),
+        np.char.mod('$%.2f', data['Call charges'].to_numpy(dtype=float)).tolist(),
+    )
 
 class InvoicePDF(FPDF):
+    def __init__(self, *args, issued_at=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Fixed once per batch so every renderer produces identical bytes
+        self.issued_at = issued_at or datetime.now()
+
+    def _putinfo(self):
+        # Same as FPDF._putinfo, but dated from issued_at instead of now()
+        self._out('/Producer '+self._textstring('PyFPDF '+FPDF_VERSION+' http://pyfpdf.googlecode.com/'))
+        self._out('/CreationDate '+self._textstring('D:'+self.issued_at.strftime('%Y%m%d%H%M%S')))
+
     def design_header(self, invoice_number, logo_path=None):
         # Header with logo and title
         if logo_path and os.path.exists(logo_path):
@@ -22,7 +75,7 @@ class InvoicePDF(FPDF):
         # Date and Invoice number row
         self.set_xy(10, 40)
         self.set_font('Arial', 'B', 10)
-        self.cell(90, 10, f'Date: {datetime.now().strftime("%d/%m/%Y")}', 0, 0, 'L')
+        self.cell(90, 10, f'Date: {self.issued_at.strftime("%d/%m/%Y")}', 0, 0, 'L')
         self.cell(90, 10, f'Invoice No: {invoice_number}', 0, 1, 'R')
         
         # Another horizontal line
@@ -50,7 +103,7 @@ class InvoicePDF(FPDF):
         # Reset position for table with more space
         self.set_xy(10, 100)  # Increased spacing before table
 
-    def add_table(self, data):
+    def add_table(self, data, sub_total=None):
         # Table headers with light gray background
         self.set_fill_color(240, 240, 240)
         self.set_font('Arial', 'B', 10)
@@ -66,19 +119,16 @@ class InvoicePDF(FPDF):
 
         # Data rows
         self.set_font('Arial', '', 9)
-        total_duration = 0
-        total_charges = 0
+        if sub_total is None:
+            sub_total = cents_to_decimal(to_cents(data['Call charges']).sum())
+        sub_total, tax, total = invoice_totals(sub_total)
         
-        for idx, row in data.iterrows():
-            duration = row['Total duration'] / 60
-            total_duration += duration
-            total_charges += row['Call charges']
-            
-            self.cell(15, 8, str(idx + 1), 1, 0, 'C')
-            self.cell(30, 8, str(row['Area prefix']), 1, 0, 'C')
-            self.cell(60, 8, str(row['Area name']), 1, 0, 'L')
-            self.cell(40, 8, f"{duration:.2f} min", 1, 0, 'R')
-            self.cell(40, 8, f"${row['Call charges']:.2f}", 1, 1, 'R')
+        for sn, prefix, name, duration, charge in table_cells(data):
+            self.cell(15, 8, sn, 1, 0, 'C')
+            self.cell(30, 8, prefix, 1, 0, 'C')
+            self.cell(60, 8, name, 1, 0, 'L')
+            self.cell(40, 8, duration, 1, 0, 'R')
+            self.cell(40, 8, charge, 1, 1, 'R')
 
         # Totals section
         self.ln(5)
@@ -86,17 +136,16 @@ class InvoicePDF(FPDF):
         
         # Subtotal
         self.cell(145, 8, 'Sub Total:', 0, 0, 'R')
-        self.cell(40, 8, f"${total_charges:.2f}", 0, 1, 'R')
+        self.cell(40, 8, f"${sub_total:.2f}", 0, 1, 'R')
         
         # Tax (10%)
-        tax = total_charges * 0.10
         self.cell(145, 8, 'Tax (10%):', 0, 0, 'R')
         self.cell(40, 8, f"${tax:.2f}", 0, 1, 'R')
         
         # Total with tax
         self.set_font('Arial', 'B', 12)
         self.cell(145, 10, 'Total:', 0, 0, 'R')
-        self.cell(40, 10, f"${(total_charges + tax):.2f}", 0, 1, 'R')
+        self.cell(40, 10, f"${total:.2f}", 0, 1, 'R')
 
     def footer(self):
         # Move to bottom of page
@@ -111,71 +160,289 @@ class InvoicePDF(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
-def generate_invoice_pdfs(invoice_obj):
+def invoice_context(invoice_obj, issued_at=None):
+    """Everything render_account_pdf needs from the invoice, as plain picklable values"""
+    logo_path = os.path.join(settings.STATIC_ROOT, 'logo.jpg')
+    # Each invoice gets its own directory, so accounts in the same month don't collide
+    media_dir = f'invoices/{invoice_obj.pk}' if getattr(invoice_obj, 'pk', None) else 'invoices'
+    return {
+        'from_company': invoice_obj.from_company,
+        'to_company': invoice_obj.to_company,
+        'billing_month': invoice_obj.billing_date.strftime("%B %Y"),
+        'billing_prefix': invoice_obj.billing_date.strftime('%Y%m'),
+        'gmt': invoice_obj.gmt,
+        'logo_path': logo_path if os.path.exists(logo_path) else None,
+        'issued_at': issued_at or datetime.now(),
+        'media_dir': media_dir,
+        'output_dir': os.path.join(settings.MEDIA_ROOT, media_dir),
+    }
+
+def split_accounts(data, accounts=None):
+    """
+    Partition ``data`` by account in a single groupby pass.
+
+    Returns ``[(account_id, rows)]`` in order of first appearance, the same
+    order as ``data['Account id'].unique()``. Each frame keeps its original
+    index, which the PDF uses for the SN column.
+    """
+    if accounts is not None:
+        data = data[data['Account id'].isin(set(accounts))]
+    return list(data.groupby('Account id', sort=False))
+
+def account_totals(data):
+    """Per-account line count, minutes, sub total, tax and total, computed in one groupby"""
+    # Rounded like the table rows, so the totals match what the PDF shows
+    totals = data.assign(
+        minutes=data['Total duration'].round(2) / 60,
+        cents=to_cents(data['Call charges'].round(2)),
+    ).groupby('Account id', sort=False).agg(
+        lines=('cents', 'size'),
+        minutes=('minutes', 'sum'),
+        cents=('cents', 'sum'),
+    )
+    amounts = [invoice_totals(cents_to_decimal(cents)) for cents in totals.pop('cents')]
+    totals['sub_total'], totals['tax'], totals['total'] = zip(*amounts) if amounts else ((), (), ())
+    return totals
+
+def safe_account_id(account_id):
+    # Clean the account_id for filename (remove special characters)
+    return "".join(c for c in account_id if c.isalnum() or c in ('-', '_')).strip()
+
+def invoice_number(account_id, context):
+    # Generate invoice number with cleaned account ID
+    return f"{context['billing_prefix']}-{safe_account_id(account_id)}"
+
+def invoice_filename(account_id, context):
+    return f'Invoice_{invoice_number(account_id, context)}.pdf'
+
+def account_digest(account_id, account_data, context):
+    """
+    Hash of everything that ends up in an account's PDF: its rows (with the
+    index, which numbers them), the invoice details and the template version.
+    The issue date is left out, so unchanged invoices keep their original PDF.
+    """
+    digest = hashlib.sha256(json.dumps([
+        TEMPLATE_VERSION,
+        account_id,
+        context['from_company'],
+        context['to_company'],
+        context['billing_month'],
+        context['billing_prefix'],
+        context['gmt'],
+        bool(context['logo_path']),
+    ]).encode())
+    digest.update(pd.util.hash_pandas_object(account_data[TABLE_COLUMNS], index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def load_manifest(output_dir):
+    """{filename: digest} for the PDFs already rendered in ``output_dir``"""
     try:
-        # Read data from the uploaded Excel file
-        data = pd.read_excel(invoice_obj.excel_file.path)
-        
-        # Convert numeric columns to appropriate types
-        data['Total duration'] = pd.to_numeric(data['Total duration'], errors='coerce')
-        data['Call charges'] = pd.to_numeric(data['Call charges'], errors='coerce')
-        data['Account id'] = data['Account id'].astype(str)  # Ensure Account ID is string
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp, path)
+
+def render_account_pdf(account_id, account_data, context, sub_total=None):
+    """Render the invoice PDF for one account and return its file name"""
+    number = invoice_number(account_id, context)
+
+    # Create PDF
+    pdf = InvoicePDF(issued_at=context['issued_at'])
+    pdf.add_page()
+    pdf.design_header(number, context['logo_path'])
+    pdf.add_company_details(
+        context['from_company'],
+        context['to_company'],
+        context['billing_month'],
+        context['gmt']
+    )
+
+    # Format numeric columns before adding to table
+    table_data = account_data[TABLE_COLUMNS].copy()
+    table_data['Total duration'] = table_data['Total duration'].round(2)
+    table_data['Call charges'] = table_data['Call charges'].round(2)
+
+    pdf.add_table(table_data, sub_total)
 
+    filename = invoice_filename(account_id, context)
+    pdf.output(os.path.join(context['output_dir'], filename))
+    return filename
+
+def timed_render_account_pdf(*args):
+    """render_account_pdf, also returning how many seconds it took"""
+    start = time.perf_counter()
+    filename = render_account_pdf(*args)
+    return filename, time.perf_counter() - start
+
+def render_invoice_pdfs(data, context, workers=1, progress=None, accounts=None, on_error=None, on_reused=None,
+                        on_rendered=None):
+    """
+    Render one PDF per account in ``data``.
+
+    With ``workers`` > 1 the accounts are spread over a process pool. The
+    output is the same either way; results come back as
+    ``[(account_id, filename)]`` in account order. ``progress`` is called
+    as ``progress(done, total, account_id)`` after each account.
+
+    ``accounts`` limits rendering to those account ids. If ``on_error`` is
+    given, an account that fails is reported as ``on_error(account_id, exc)``
+    and left out of the results instead of aborting the whole batch.
+
+    An account whose ``account_digest`` matches the PDF already in the
+    output directory is not rendered again; it is reported as
+    ``on_reused(account_id)`` and still included in the results. Accounts
+    that are rendered are reported as ``on_rendered(account_id, seconds)``.
+    """
+    if accounts is not None:
+        data = data[data['Account id'].isin(set(accounts))]
+    total = data['Account id'].nunique()
+    return render_partitions([data], context, total, workers, progress, on_error, on_reused, on_rendered)
+
+def render_partitions(partitions, context, total, workers=1, progress=None, on_error=None, on_reused=None,
+                      on_rendered=None):
+    """
+    Same as render_invoice_pdfs for data that comes in several frames, such
+    as the buckets of an AccountPartitions. No account may span two frames;
+    ``total`` is the number of accounts across all of them. Frames are
+    rendered one after the other, so only one needs to be in memory.
+    """
+    output_dir = context['output_dir']
+    manifest = load_manifest(output_dir)
+    filenames = {}
+    results = []
+    done = 0
+
+    def finish(account_id):
+        nonlocal done
+        done += 1
+        if progress:
+            progress(done, total, account_id)
+
+    def render(account_id, digest, render_result):
+        filename = invoice_filename(account_id, context)
+        manifest.pop(filename, None)
+        try:
+            filenames[account_id], seconds = render_result()
+            manifest[filename] = digest
+            if on_rendered:
+                on_rendered(account_id, seconds)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(account_id, e)
+        finish(account_id)
+
+    executor = ProcessPoolExecutor(max_workers=min(workers, total)) if workers > 1 and total > 1 else None
+    try:
+        with executor or nullcontext():
+            for data in partitions:
+                accounts = split_accounts(data)
+                sub_totals = account_totals(data)['sub_total']
+                pending = []
+                for account_id, account_data in accounts:
+                    digest = account_digest(account_id, account_data, context)
+                    filename = invoice_filename(account_id, context)
+                    if manifest.get(filename) == digest and os.path.exists(os.path.join(output_dir, filename)):
+                        filenames[account_id] = filename
+                        if on_reused:
+                            on_reused(account_id)
+                        finish(account_id)
+                    else:
+                        pending.append((account_id, account_data, digest))
+
+                if executor:
+                    futures = {
+                        executor.submit(
+                            timed_render_account_pdf, account_id, account_data, context, sub_totals[account_id]
+                        ): (account_id, digest)
+                        for account_id, account_data, digest in pending
+                    }
+                    for future in as_completed(futures):
+                        render(*futures[future], future.result)
+                else:
+                    for account_id, account_data, digest in pending:
+                        render(account_id, digest, lambda: timed_render_account_pdf(
+                            account_id, account_data, context, sub_totals[account_id]
+                        ))
+                results.extend(
+                    (account_id, filenames[account_id]) for account_id, _ in accounts if account_id in filenames
+                )
+    finally:
+        # Saved even after a failure, so finished PDFs are reused on retry
+        save_manifest(output_dir, manifest)
+
+    return results
+
+def record_generated_pdfs(invoice_obj, results, context, render_times):
+    """Create or update the invoice's GeneratedPDF rows; reused PDFs keep their render time"""
+    digests = load_manifest(context['output_dir'])
+    existing = {pdf.account_id: pdf for pdf in invoice_obj.pdfs.all()}
+    rendered_at = timezone.now()
+    created, updated = [], []
+    for account_id, filename in results:
+        pdf = existing.get(account_id) or GeneratedPDF(invoice=invoice_obj, account_id=account_id)
+        pdf.file = f"{context['media_dir']}/{filename}"
+        path = os.path.join(context['output_dir'], filename)
+        pdf.size = os.path.getsize(path)
+        pdf.digest = digests.get(filename, '')
+        if account_id in render_times or pdf.crc32 is None:
+            pdf.crc32 = file_crc32(path)
+        if account_id in render_times:
+            pdf.render_time = render_times[account_id]
+            pdf.rendered_at = rendered_at
+        (updated if pdf.pk else created).append(pdf)
+    GeneratedPDF.objects.bulk_create(created)
+    GeneratedPDF.objects.bulk_update(updated, ['file', 'size', 'crc32', 'digest', 'render_time', 'rendered_at'])
+
+def generate_invoice_pdfs(invoice_obj, workers=None, progress=None, accounts=None, on_error=None,
+                          on_reused=None):
+    try:
         # Create output directory within media
-        output_dir = os.path.join(settings.MEDIA_ROOT, 'invoices')
-        os.makedirs(output_dir, exist_ok=True)
+        context = invoice_context(invoice_obj)
+        os.makedirs(context['output_dir'], exist_ok=True)
 
         # Generate separate invoices for each Account ID
-        unique_accounts = data['Account id'].unique()
-        
-        for account_id in unique_accounts:
-            account_data = data[data['Account id'] == account_id].copy()
-            
-            # Clean the account_id for filename (remove special characters)
-            safe_account_id = "".join(c for c in account_id if c.isalnum() or c in ('-', '_')).strip()
-            
-            # Generate invoice number with cleaned account ID
-            invoice_number = f"{invoice_obj.billing_date.strftime('%Y%m')}-{safe_account_id}"
-            
-            # Create PDF
-            pdf = InvoicePDF()
-            pdf.add_page()
-            
-            # Get logo path from static files
-            logo_path = os.path.join(settings.STATIC_ROOT, 'logo.jpg')
-            
-            pdf.design_header(invoice_number, logo_path if os.path.exists(logo_path) else None)
-            pdf.add_company_details(
-                invoice_obj.from_company,
-                invoice_obj.to_company,
-                invoice_obj.billing_date.strftime("%B %Y"),
-                invoice_obj.gmt
+        if workers is None:
+            workers = getattr(settings, 'INVOICE_PDF_WORKERS', 1)
+
+        reused = []
+        render_times = {}
+
+        def rendered(account_id, seconds):
+            render_times[account_id] = seconds
+
+        def reuse(account_id):
+            reused.append(account_id)
+            if on_reused:
+                on_reused(account_id)
+
+        # The upload is parsed once into the upload cache and rendered one
+        # partition at a time, so memory stays bounded by a partition
+        with AccountPartitions(invoice_obj.excel_file.path, accounts) as partitions:
+            results = render_partitions(
+                partitions, context, len(partitions.accounts), workers, progress, on_error, reuse, rendered
             )
-            
-            # Format numeric columns before adding to table
-            table_data = account_data[['Area prefix', 'Area name', 'Total duration', 'Call charges']].copy()
-            table_data['Total duration'] = table_data['Total duration'].round(2)
-            table_data['Call charges'] = table_data['Call charges'].round(2)
-            
-            pdf.add_table(table_data)
-
-            # Create filename and ensure directory exists
-            filename = f'Invoice_{invoice_number}.pdf'
-            output_file = os.path.join(output_dir, filename)
-            
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
-            
-            # Save PDF
-            pdf.output(output_file)
-            
-            # Update the model with the PDF file path
-            relative_path = f'invoices/{filename}'
-            invoice_obj.pdf_file = relative_path
+            order = {account_id: position for position, account_id in enumerate(partitions.accounts)}
+        results.sort(key=lambda result: order[result[0]])
+        logger.info("Invoice %s: rendered %s PDFs, reused %s unchanged",
+                    invoice_obj.pk, len(results) - len(reused), len(reused))
+
+        record_generated_pdfs(invoice_obj, results, context, render_times)
+
+        # Update the model with the last PDF file path
+        if results:
+            invoice_obj.pdf_file = f"{context['media_dir']}/{results[-1][1]}"
             invoice_obj.save()
 
-            print(f"Generated PDF at: {output_file}")  # Debug print
+        return results
 
     except Exception as e:
         print(f"Detailed error: {str(e)}")  # Add detailed logging
-        raise Exception(f"Error generating invoices: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Error generating invoices: {str(e)}") 
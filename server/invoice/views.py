@@ -1,23 +1,112 @@
-from django.shortcuts import render
-from rest_framework import viewsets
-from .models import Invoice, InvoiceItem
-from .serializers import InvoiceSerializer, InvoiceItemSerializer
-from django.http import HttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from rest_framework import mixins, status, viewsets
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .downloads import StreamingZip, ZipEntry, file_crc32, parse_byte_range
+from .jobs import enqueue_invoice_job
+from .models import GeneratedPDF, Invoice, InvoiceItem, InvoiceJob
+from .serializers import InvoiceSerializer, InvoiceItemSerializer, InvoiceJobSerializer, GeneratedPDFSerializer
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
 import os
+from server.pagination import KeysetPagination
 
 class InvoiceViewSet(viewsets.ModelViewSet):
-    queryset = Invoice.objects.all()
+    """Invoices, newest first; saving one queues its PDF generation"""
+    queryset = Invoice.objects.prefetch_related('items')
     serializer_class = InvoiceSerializer
-    filterset_fields = ['status', 'customer']
-    search_fields = ['invoice_number', 'customer__name']
-    ordering_fields = ['issue_date', 'due_date', 'total_amount']
+    filterset_fields = ['billing_date', 'to_company']
+    search_fields = ['from_company', 'to_company']
+    ordering_fields = ['billing_date', 'created_at']
+    pagination_class = KeysetPagination
+
+    def perform_create(self, serializer):
+        enqueue_invoice_job(serializer.save())
+
+    def perform_update(self, serializer):
+        enqueue_invoice_job(serializer.save())
 
 class InvoiceItemViewSet(viewsets.ModelViewSet):
     queryset = InvoiceItem.objects.all()
     serializer_class = InvoiceItemSerializer
     filterset_fields = ['invoice']
 
+class InvoiceJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """Queue PDF generation for an invoice (POST) and poll its status (GET)"""
+    queryset = InvoiceJob.objects.select_related('invoice')
+    serializer_class = InvoiceJobSerializer
+    filterset_fields = ['invoice', 'status']
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = enqueue_invoice_job(serializer.validated_data['invoice'])
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+class GeneratedPDFViewSet(viewsets.ReadOnlyModelViewSet):
+    """Generated invoice PDFs, filterable by invoice and account"""
+    queryset = GeneratedPDF.objects.all()
+    serializer_class = GeneratedPDFSerializer
+    filterset_fields = ['invoice', 'account_id']
+
+class InvoicePDFArchiveView(APIView):
+    """
+    All PDFs of an invoice as one ZIP, streamed as it is read from disk.
+
+    Supports single byte ranges (with If-Range) so interrupted downloads
+    of large batches can be resumed.
+    """
+
+    @staticmethod
+    def entries(invoice):
+        entries = []
+        stale = []
+        for pdf in invoice.pdfs.all():
+            try:
+                size = os.path.getsize(pdf.file.path)
+            except OSError:
+                continue  # Deleted from disk since it was recorded
+            if pdf.crc32 is None or size != pdf.size:
+                pdf.size, pdf.crc32 = size, file_crc32(pdf.file.path)
+                stale.append(pdf)
+            rendered_at = timezone.localtime(pdf.rendered_at or invoice.created_at)
+            entries.append(ZipEntry(
+                os.path.basename(pdf.file.name), pdf.file.path, pdf.size, pdf.crc32,
+                rendered_at.timetuple()[:6],
+            ))
+        GeneratedPDF.objects.bulk_update(stale, ['size', 'crc32'])
+        return entries
+
+    def get(self, request, pk):
+        invoice = get_object_or_404(Invoice, pk=pk)
+        try:
+            archive = StreamingZip(self.entries(invoice))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        byte_range = None
+        if request.headers.get('If-Range', archive.etag) == archive.etag:
+            try:
+                byte_range = parse_byte_range(request.headers.get('Range'), archive.size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{archive.size}'
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(archive.chunks(start, end), status=206, content_type='application/zip')
+            response['Content-Range'] = f'bytes {start}-{end}/{archive.size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            response = StreamingHttpResponse(archive.chunks(), content_type='application/zip')
+            response['Content-Length'] = archive.size
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = archive.etag
+        response['Content-Disposition'] = f'attachment; filename="invoice-{invoice.pk}-pdfs.zip"'
+        return response
+
 def debug_media(request, path):
     full_path = os.path.join(settings.MEDIA_ROOT, path)
     print(f"Requested path: {path}")
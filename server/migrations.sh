@@ -1,4 +1,6 @@
 python manage.py makemigrations
+# Duplicate cart rows would make the CartItem unique constraints fail to apply
+python manage.py merge_duplicate_cart_items
 python manage.py migrate
 python manage.py shell < tools/create_superuser.py
 python manage.py collectstatic --noinput
\ No newline at end of file
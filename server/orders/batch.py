@@ -0,0 +1,207 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.validators import UniqueValidator
+from .signals import batched_refresh
+
+
+class BatchWriteMixin:
+    """
+    Adds a ``batch/`` endpoint to a ModelViewSet taking a list of rows:
+    POST creates them, PATCH updates them and DELETE removes them.
+
+    Rows are validated together (unique fields with one query rather than
+    one per row) and written with ``bulk_create``/``bulk_update`` in a single
+    transaction, with the price cache and order totals refreshed once for
+    the whole batch. If any row is invalid nothing is written. Rows to
+    update or delete are identified by ``id`` or by ``batch_lookup_field``,
+    and the response has one result per row in request order.
+    """
+    batch_lookup_field = None
+    MAX_BATCH_ROWS = 5000
+
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='batch', permission_classes=[IsAdminUser])
+    def batch(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': 'Expected a non-empty list of rows'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > self.MAX_BATCH_ROWS:
+            return Response({'error': f'At most {self.MAX_BATCH_ROWS} rows per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        handler = {'POST': self.batch_create, 'PATCH': self.batch_update, 'DELETE': self.batch_delete}[request.method]
+        try:
+            results, written = handler(rows)
+        except IntegrityError as e:
+            return Response({'error': f'Batch rejected by the database: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        if not written:
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+        code = status.HTTP_201_CREATED if request.method == 'POST' else status.HTTP_200_OK
+        return Response({'results': results}, status=code)
+
+    # Hooks for the changes bulk writes make without sending signals
+
+    def record_batch_changes(self, changes, created=(), updated=(), deleting=()):
+        """
+        Add to ``changes`` what the batch invalidates. ``updated`` holds
+        (instance, {field: previous value}) pairs.
+        """
+
+    # Validation
+
+    def _validator(self, partial):
+        serializer = self.get_serializer(partial=partial)
+        # Uniqueness is checked for the whole batch in _check_unique
+        for field in serializer.fields.values():
+            field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+        return serializer
+
+    def _validate(self, rows, partial=False):
+        serializer = self._validator(partial)
+        values, errors = [], []
+        for row in rows:
+            try:
+                values.append(serializer.run_validation(row))
+                errors.append(None)
+            except ValidationError as e:
+                values.append(None)
+                errors.append(e.detail)
+        return values, errors
+
+    def _unique_fields(self):
+        model = self.get_queryset().model
+        return [field.name for field in model._meta.fields if field.unique and not field.primary_key]
+
+    def _check_unique(self, values, errors, instances=None):
+        """Flag rows whose unique fields repeat within the batch or clash with other rows in the table"""
+        model = self.get_queryset().model
+        own_pks = [instance.pk for instance in instances or [] if instance is not None]
+        for name in self._unique_fields():
+            final = {}
+            for index, row in enumerate(values):
+                if row is None:
+                    continue
+                if name in row:
+                    final[index] = row[name]
+                elif instances and instances[index] is not None:
+                    final[index] = getattr(instances[index], name)
+            taken = set(
+                model.objects.filter(**{f'{name}__in': set(final.values())})
+                .exclude(pk__in=own_pks).values_list(name, flat=True)
+            )
+            message = f'{model._meta.verbose_name} with this {name} already exists.'
+            seen = set()
+            for index, value in final.items():
+                if value in taken or value in seen:
+                    errors[index] = {**(errors[index] or {}), name: [message]}
+                seen.add(value)
+
+    def _resolve(self, rows, errors):
+        """The existing instance each row refers to, by ``id`` or the lookup field"""
+        model = self.get_queryset().model
+        keys = []
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                row = {'id': row}  # DELETE accepts bare ids
+            if row.get('id') is not None:
+                name, field, value = 'id', 'pk', row['id']
+            elif self.batch_lookup_field and row.get(self.batch_lookup_field) is not None:
+                name = field = self.batch_lookup_field
+                value = row[field]
+            else:
+                keys.append(None)
+                errors[index] = {**(errors[index] or {}), 'id': [f'Give id or {self.batch_lookup_field}.']}
+                continue
+            try:
+                model_field = model._meta.pk if field == 'pk' else model._meta.get_field(field)
+                keys.append((field, model_field.to_python(value)))
+            except DjangoValidationError as e:
+                keys.append(None)
+                errors[index] = {**(errors[index] or {}), name: e.messages}
+
+        found = {}
+        for field in {key[0] for key in keys if key}:
+            found[field] = self.get_queryset().in_bulk(
+                [key[1] for key in keys if key and key[0] == field], field_name=field,
+            )
+
+        instances, seen = [], set()
+        for index, key in enumerate(keys):
+            instance = found[key[0]].get(key[1]) if key else None
+            if key and instance is None:
+                errors[index] = {**(errors[index] or {}), 'id': ['Not found.']}
+            elif instance is not None and instance.pk in seen:
+                errors[index] = {**(errors[index] or {}), 'id': ['Duplicate row for this object.']}
+                instance = None
+            if instance is not None:
+                seen.add(instance.pk)
+            instances.append(instance)
+        return instances
+
+    @staticmethod
+    def _rejected(errors):
+        # Valid rows of a rejected batch are reported as skipped
+        return [{'status': 'error', 'errors': error} if error else {'status': 'skipped'} for error in errors]
+
+    # Writes
+
+    def batch_create(self, rows):
+        values, errors = self._validate(rows)
+        self._check_unique(values, errors)
+        if any(errors):
+            return self._rejected(errors), False
+
+        model = self.get_queryset().model
+        objs = [model(**row) for row in values]
+        with transaction.atomic(), batched_refresh() as changes:
+            self.record_batch_changes(changes, created=objs)
+            model.objects.bulk_create(objs)
+
+        # Not every backend sets pks from bulk_create, so read them back
+        unique = self._unique_fields()[0]
+        pks = dict(model.objects.filter(**{f'{unique}__in': [getattr(obj, unique) for obj in objs]})
+                   .values_list(unique, 'pk'))
+        for obj in objs:
+            obj.pk = pks[getattr(obj, unique)]
+        data = self.get_serializer(objs, many=True).data
+        return [{'status': 'created', 'data': row} for row in data], True
+
+    def batch_update(self, rows):
+        values, errors = self._validate(rows, partial=True)
+        instances = self._resolve(rows, errors)
+        self._check_unique(values, errors, instances)
+        if any(errors):
+            return self._rejected(errors), False
+
+        model = self.get_queryset().model
+        updated, fields = [], set()
+        for instance, row in zip(instances, values):
+            previous = {name: getattr(instance, name) for name in row}
+            for name, value in row.items():
+                setattr(instance, name, value)
+            fields.update(row)
+            updated.append((instance, previous))
+        with transaction.atomic(), batched_refresh() as changes:
+            self.record_batch_changes(changes, updated=updated)
+            if fields:
+                model.objects.bulk_update(instances, sorted(fields))
+        data = self.get_serializer(instances, many=True).data
+        return [{'status': 'updated', 'data': row} for row in data], True
+
+    def batch_delete(self, rows):
+        errors = [None] * len(rows)
+        instances = self._resolve(rows, errors)
+        if any(errors):
+            return self._rejected(errors), False
+
+        pks = [instance.pk for instance in instances]
+        with transaction.atomic(), batched_refresh() as changes:
+            self.record_batch_changes(changes, deleting=instances)
+            # A queryset delete still cascades; its per-row signals only
+            # add to the batched refresh
+            self.get_queryset().filter(pk__in=pks).delete()
+        return [{'status': 'deleted', 'id': pk} for pk in pks], True
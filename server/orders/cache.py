@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'CACHE_ALIAS': None,
+}
+
+
+class PriceCache:
+    """
+    Product price cache keyed by SKU or by product pk.
+
+    Lookups go to a per-process LRU first, then to the optional shared
+    Django cache (``CACHE_ALIAS``), and only then to the database, which
+    is queried once for everything still missing. Entries expire after
+    ``TTL`` seconds and are invalidated by ``orders.signals`` whenever a
+    product is saved or deleted.
+    """
+    FIELDS = ('sku', 'pk')
+
+    def __init__(self, max_size=DEFAULTS['MAX_SIZE'], ttl=DEFAULTS['TTL'], cache_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()  # (field, value) -> (expires_at, price)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'PRICE_CACHE', {})}
+        return cls(options['MAX_SIZE'], options['TTL'], options['CACHE_ALIAS'])
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    @staticmethod
+    def _shared_key(field, value):
+        return f'orders:price:{field}:{value}'
+
+    def reset_stats(self):
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+        }
+
+    def _store(self, field, prices):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for value, price in prices.items():
+                self._entries[(field, value)] = (expires_at, price)
+                self._entries.move_to_end((field, value))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_many(self, field, values):
+        """Return {value: price} for the products matching ``field`` in ``values``"""
+        from .models import Product
+
+        missing = set(values)
+        found = {}
+        now = time.monotonic()
+
+        with self._lock:
+            for value in list(missing):
+                entry = self._entries.get((field, value))
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self._entries[(field, value)]
+                    continue
+                self._entries.move_to_end((field, value))
+                found[value] = entry[1]
+                missing.discard(value)
+            self.hits += len(found)
+
+        if missing and self.shared is not None:
+            keys = {self._shared_key(field, value): value for value in missing}
+            shared = {keys[key]: price for key, price in self.shared.get_many(keys).items()}
+            self.shared_hits += len(shared)
+            self._store(field, shared)
+            found.update(shared)
+            missing.difference_update(shared)
+
+        if missing:
+            self.misses += len(missing)
+            loaded = dict(Product.objects.filter(**{f'{field}__in': missing}).values_list(field, 'price'))
+            self._store(field, loaded)
+            if self.shared is not None and loaded:
+                self.shared.set_many(
+                    {self._shared_key(field, value): price for value, price in loaded.items()},
+                    timeout=self.ttl,
+                )
+            found.update(loaded)
+
+        return found
+
+    def get(self, field, value, default=None):
+        return self.get_many(field, [value]).get(value, default)
+
+    def invalidate(self, skus=(), pks=()):
+        keys = [('sku', sku) for sku in skus] + [('pk', pk) for pk in pks]
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.shared is not None and keys:
+            self.shared.delete_many([self._shared_key(*key) for key in keys])
+
+    def invalidate_on_commit(self, skus=(), pks=()):
+        """Invalidate now and again once the surrounding transaction commits"""
+        skus, pks = list(skus), list(pks)
+        self.invalidate(skus, pks)
+        # A concurrent reader may re-cache the old price before we commit
+        transaction.on_commit(lambda: self.invalidate(skus, pks))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.reset_stats()
+
+
+price_cache = PriceCache.from_settings()
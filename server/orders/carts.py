@@ -0,0 +1,225 @@
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery
+from .models import CartItem
+
+DEFAULTS = {
+    'CACHE_ALIAS': None,
+    'TTL': 3600,
+}
+
+# Session entry naming the anonymous cart; it survives the key change at login
+SESSION_CART_KEY = 'cart_key'
+
+
+class CartStore:
+    """
+    Cart summaries (subtotal in cents and item count) in a Django cache.
+
+    The CartItem rows stay the source of truth: a missing summary is
+    rebuilt from one aggregate query, and writes adjust a cached summary
+    with atomic ``incr`` calls instead of dropping it. Keys carry a
+    version that is bumped whenever product prices change, which retires
+    every cached subtotal at once.
+
+    ``CACHE_ALIAS`` must name a cache shared by every worker process; a
+    per-process cache would serve other workers' stale subtotals. Without
+    one (None) nothing is cached and every summary is an aggregate query.
+    """
+
+    def __init__(self, cache_alias=DEFAULTS['CACHE_ALIAS'], ttl=DEFAULTS['TTL']):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'CART_CACHE', {})}
+        return cls(options['CACHE_ALIAS'], options['TTL'])
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _version(self):
+        version = self.cache.get('orders:cart:version')
+        if version is None:
+            self.cache.add('orders:cart:version', 1, timeout=None)
+            version = self.cache.get('orders:cart:version', 1)
+        return version
+
+    def _keys(self, owner):
+        prefix = f'orders:cart:{self._version()}:{owner}'
+        return f'{prefix}:cents', f'{prefix}:items'
+
+    def get(self, owner):
+        """(subtotal cents, item count), or None if not cached"""
+        if self.cache is None:
+            return None
+        keys = self._keys(owner)
+        values = self.cache.get_many(keys)
+        if len(values) != len(keys):
+            return None
+        return values[keys[0]], values[keys[1]]
+
+    def set(self, owner, cents, items):
+        # add() so a summary adjusted since the aggregate was read wins
+        if self.cache is None:
+            return
+        cents_key, items_key = self._keys(owner)
+        self.cache.add(cents_key, cents, timeout=self.ttl)
+        self.cache.add(items_key, items, timeout=self.ttl)
+
+    def adjust(self, owner, cents, items):
+        """Apply a change to a cached summary; an uncached one is rebuilt on next read"""
+        if self.cache is None:
+            return
+        cents_key, items_key = self._keys(owner)
+        try:
+            self.cache.incr(cents_key, cents)
+            self.cache.incr(items_key, items)
+        except ValueError:
+            # Not cached (or evicted between the two calls)
+            self.cache.delete_many([cents_key, items_key])
+
+    def forget(self, owner):
+        if self.cache is None:
+            return
+        self.cache.delete_many(self._keys(owner))
+
+    def invalidate_all(self):
+        if self.cache is None:
+            return
+        try:
+            self.cache.incr('orders:cart:version')
+        except ValueError:
+            pass  # No version yet, so nothing is cached
+
+    def invalidate_all_on_commit(self):
+        """Retire every summary now and again once the surrounding transaction commits"""
+        self.invalidate_all()
+        # A concurrent reader may re-cache a subtotal at the old prices before we commit
+        transaction.on_commit(self.invalidate_all)
+
+
+cart_store = CartStore.from_settings()
+
+
+def to_cents(price):
+    return int(price * 100)
+
+
+class Cart:
+    """
+    The cart of a user or of an anonymous session: one CartItem per product.
+
+    Adding a product that is already in the cart increments its quantity
+    with a single UPDATE, so concurrent adds never lose a count or create
+    a second row. Every write also adjusts the cached summary, after the
+    transaction commits.
+    """
+
+    def __init__(self, user=None, session_key=None):
+        if user is None and not session_key:
+            raise ValueError('A cart needs a user or a session key')
+        self.user = user
+        self.session_key = None if user is not None else session_key
+
+    @classmethod
+    def for_request(cls, request, create=False):
+        """
+        The cart of the requesting user, after merging in any anonymous
+        cart from their session; for anonymous requests the session cart,
+        or None if there is none and ``create`` is False.
+        """
+        session = request.session
+        session_cart = session.get(SESSION_CART_KEY) or session.session_key
+        if request.user.is_authenticated:
+            cart = cls(user=request.user)
+            if session.get(SESSION_CART_KEY):
+                cart.merge(session.pop(SESSION_CART_KEY))
+            return cart
+        if not session_cart:
+            if not create:
+                return None
+            session.create()
+            session_cart = session.session_key
+        if create and not session.get(SESSION_CART_KEY):
+            session[SESSION_CART_KEY] = session_cart
+        return cls(session_key=session_cart)
+
+    @property
+    def owner(self):
+        return f'user:{self.user.pk}' if self.user is not None else f'session:{self.session_key}'
+
+    @property
+    def owner_filter(self):
+        if self.user is not None:
+            return {'user': self.user}
+        return {'user__isnull': True, 'session_key': self.session_key}
+
+    def items(self):
+        return CartItem.objects.filter(**self.owner_filter).select_related('product')
+
+    def _adjust_on_commit(self, cents, items):
+        transaction.on_commit(lambda: cart_store.adjust(self.owner, cents, items))
+
+    def add(self, product, quantity=1):
+        """Add ``quantity`` of ``product``, returning its (refreshed) cart item"""
+        items = CartItem.objects.filter(product=product, **self.owner_filter)
+        with transaction.atomic():
+            if not items.update(quantity=F('quantity') + quantity):
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(
+                            user=self.user, session_key=self.session_key, product=product, quantity=quantity,
+                        )
+                except IntegrityError:
+                    # A concurrent add created the row first
+                    items.update(quantity=F('quantity') + quantity)
+            self._adjust_on_commit(to_cents(product.price) * quantity, quantity)
+        return items.select_related('product').get()
+
+    def set_quantity(self, item, quantity):
+        with transaction.atomic():
+            previous = CartItem.objects.select_for_update().values_list('quantity', flat=True).get(pk=item.pk)
+            CartItem.objects.filter(pk=item.pk).update(quantity=quantity)
+            delta = quantity - previous
+            self._adjust_on_commit(to_cents(item.product.price) * delta, delta)
+        item.quantity = quantity
+        return item
+
+    def remove(self, item):
+        with transaction.atomic():
+            if CartItem.objects.filter(pk=item.pk).delete()[0]:
+                self._adjust_on_commit(-to_cents(item.product.price) * item.quantity, -item.quantity)
+
+    def clear(self):
+        CartItem.objects.filter(**self.owner_filter).delete()
+        transaction.on_commit(lambda: cart_store.forget(self.owner))
+
+    def summary(self):
+        """{'subtotal': Decimal, 'items': total quantity}, from the cache when possible"""
+        cached = cart_store.get(self.owner)
+        if cached is None:
+            totals = CartItem.objects.filter(**self.owner_filter).totals()
+            cached = (to_cents(totals['subtotal']), totals['items'])
+            cart_store.set(self.owner, *cached)
+        return {'subtotal': (Decimal(cached[0]) / 100).quantize(Decimal('0.01')), 'items': cached[1]}
+
+    def merge(self, session_key):
+        """
+        Move the anonymous cart of ``session_key`` into this user's cart in
+        a fixed number of queries: quantities of products in both carts are
+        added up, the other rows just change owner.
+        """
+        session_items = CartItem.objects.filter(user__isnull=True, session_key=session_key)
+        with transaction.atomic():
+            shared = CartItem.objects.filter(user=self.user, product__in=session_items.values('product'))
+            shared.update(quantity=F('quantity') + Subquery(
+                session_items.filter(product=OuterRef('product')).values('quantity')[:1]
+            ))
+            session_items.filter(product__in=shared.values('product')).delete()
+            session_items.update(user=self.user, session_key=None)
+            transaction.on_commit(lambda: (cart_store.forget(self.owner), cart_store.forget(f'session:{session_key}')))
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DEFAULTS = {
+    'TTL': 60,
+    'CACHE_ALIAS': None,
+}
+
+HUNDRED = Decimal(100)
+
+
+class DiscountRule(namedtuple('DiscountRule', ['pk', 'code', 'percentage', 'fraction'])):
+    """
+    A discount ready to evaluate. ``percentage`` is stored in percent (10
+    for 10% off) and ``fraction`` is the share of the subtotal taken off;
+    every discount amount in the app comes from ``get_discount_amount``.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, pk, code, percentage):
+        return cls(pk, code, percentage, percentage / HUNDRED)
+
+    @classmethod
+    def for_discount(cls, discount):
+        return cls.compile(discount.pk, discount.code, discount.percentage)
+
+    def get_discount_amount(self, subtotal):
+        return subtotal * self.fraction
+
+
+_State = namedtuple('_State', ['by_code', 'by_pk', 'expires_at', 'version'])
+
+
+class DiscountRegistry:
+    """
+    Every discount, compiled and held in memory by code and by pk.
+
+    The table is read on the first lookup and again once ``TTL`` seconds
+    have passed or ``orders.signals`` reports a Discount write. Writes in
+    other processes are seen within ``TTL``, or on the next lookup if
+    ``CACHE_ALIAS`` names a Django cache shared by all workers, which then
+    holds a version number bumped on every invalidation.
+    """
+    VERSION_KEY = 'orders:discounts:version'
+
+    def __init__(self, ttl=DEFAULTS['TTL'], cache_alias=None):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._state = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'DISCOUNT_REGISTRY', {})}
+        return cls(options['TTL'], options['CACHE_ALIAS'])
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _shared_version(self):
+        return self.shared.get(self.VERSION_KEY, 0) if self.shared is not None else None
+
+    def _load(self, version):
+        from .models import Discount
+
+        rules = [DiscountRule.compile(*row) for row in Discount.objects.values_list('pk', 'code', 'percentage')]
+        self.loads += 1
+        return _State(
+            by_code={rule.code: rule for rule in rules},
+            by_pk={rule.pk: rule for rule in rules},
+            expires_at=time.monotonic() + self.ttl,
+            version=version,
+        )
+
+    def _current(self, reload=False):
+        version = self._shared_version()
+        state = self._state
+        if reload or state is None or state.expires_at <= time.monotonic() or state.version != version:
+            with self._lock:
+                # Another thread may have reloaded while we waited
+                if self._state is state:
+                    self._state = self._load(version)
+                state = self._state
+        return state
+
+    def get(self, code):
+        """The rule for ``code``, or None if there is no such discount"""
+        if not isinstance(code, str):
+            return None
+        return self._current().by_code.get(code)
+
+    def get_pk(self, pk):
+        rule = self._current().by_pk.get(pk)
+        if rule is None:
+            # A pk comes from a row that references the discount, so it is
+            # newer than what was loaded
+            rule = self._current(reload=True).by_pk.get(pk)
+        return rule
+
+    def for_order(self, order):
+        """The rule for the order's discount, or None"""
+        from .models import Order
+
+        if order.discount_id is None:
+            return None
+        if Order.discount.is_cached(order):
+            # Loaded with the order, so at least as fresh as the registry
+            return DiscountRule.for_discount(order.discount) if order.discount else None
+        return self.get_pk(order.discount_id)
+
+    def invalidate(self):
+        self._state = None
+        if self.shared is not None:
+            self.shared.add(self.VERSION_KEY, 0, timeout=None)
+            try:
+                self.shared.incr(self.VERSION_KEY)
+            except ValueError:
+                pass  # Evicted in between; the TTL still bounds how stale others get
+
+    def invalidate_on_commit(self):
+        """Invalidate now and again once the surrounding transaction commits"""
+        self.invalidate()
+        # A concurrent lookup may reload the old rows before we commit
+        transaction.on_commit(self.invalidate)
+
+
+discount_registry = DiscountRegistry.from_settings()
@@ -0,0 +1,329 @@
+import codecs
+import json
+import time
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .cache import price_cache
+from .carts import cart_store
+from .discounts import discount_registry
+from .models import Product, Discount, Order, OrderItem, Sequence
+from .services import OrderTotals, PricingEngine, load_prices
+
+READ_SIZE = 64 * 1024
+MAX_ERRORS = 100
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yield the elements of the top-level JSON array in ``stream`` one by one.
+
+    Only the element being decoded and one read of ``read_size`` are held
+    in memory, so arrays of any length can be imported.
+    """
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    text = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, position, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        block = stream.read(read_size)
+        eof = not block
+        if isinstance(block, bytes):
+            block = text.decode(block, final=eof)
+        buffer = buffer[position:] + block
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[position:position + 1] != '[':
+        raise ValueError('Expected a JSON array')
+    position += 1
+    expect_value = True
+    while True:
+        skip_whitespace()
+        if position >= len(buffer):
+            raise ValueError('Unterminated JSON array')
+        if buffer[position] == ']':
+            return
+        if not expect_value:
+            if buffer[position] != ',':
+                raise ValueError(f'Expected "," or "]", got {buffer[position]!r}')
+            position += 1
+            expect_value = True
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()  # The element continues past what has been read
+            continue
+        if end == len(buffer) and not eof:
+            fill()  # A number at the end of the buffer may be cut short
+            continue
+        position = end
+        expect_value = False
+        yield value
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # (row number, message), the first MAX_ERRORS only
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': [{'row': row, 'error': error} for row, error in self.errors],
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+    def __str__(self):
+        return (f"{self.rows} rows ({self.created} created, {self.updated} updated, {self.failed} failed) "
+                f"in {self.seconds:.2f}s, {self.rows_per_second:.0f} rows/s")
+
+
+Row = namedtuple('Row', ['number', 'key', 'values'])
+
+
+class BulkImporter:
+    """
+    Streams a JSON array of records into the database in batches.
+
+    Every batch is upserted in its own transaction: the rows that already
+    exist are fetched with one query, the rest are inserted with
+    ``bulk_create`` and changed ones written with ``bulk_update``. Bulk
+    writes send no signals, so subclasses invalidate prices and refresh
+    order totals for each batch themselves. Rows that do not validate are
+    counted and reported instead of aborting the import.
+    """
+    model = None
+    key_field = None
+    update_fields = []
+    BATCH_SIZE = 1000
+
+    def __init__(self, batch_size=BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def parse(self, record):
+        """(key, {field: value}) for one JSON record; raises ValueError if it is invalid"""
+        raise NotImplementedError
+
+    def run(self, stream):
+        stats = ImportStats()
+        batch = {}
+        for number, record in enumerate(iter_json_array(stream), 1):
+            stats.rows += 1
+            try:
+                if not isinstance(record, dict):
+                    raise ValueError('Expected an object')
+                key, values = self.parse(record)
+            except ValidationError as e:
+                self._error(stats, number, ' '.join(e.messages))
+                continue
+            except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+                message = f'Missing field {e}' if isinstance(e, KeyError) else str(e) or type(e).__name__
+                self._error(stats, number, message)
+                continue
+            # A key repeated within a batch keeps its last values
+            batch[key] = Row(number, key, values)
+            if len(batch) >= self.batch_size:
+                self._flush(batch, stats)
+                batch = {}
+        if batch:
+            self._flush(batch, stats)
+        self.finish(stats)
+        stats.seconds = time.perf_counter() - stats.started
+        return stats
+
+    @staticmethod
+    def _error(stats, number, message):
+        stats.failed += 1
+        if len(stats.errors) < MAX_ERRORS:
+            stats.errors.append((number, message))
+
+    def _flush(self, batch, stats):
+        with transaction.atomic():
+            created, updated = self.upsert(list(batch.values()), stats)
+        stats.created += created
+        stats.updated += updated
+        if self.progress:
+            self.progress(stats)
+
+    def upsert(self, rows, stats):
+        existing = self.model.objects.in_bulk([row.key for row in rows], field_name=self.key_field)
+        new, changed = [], []
+        for row in rows:
+            obj = existing.get(row.key)
+            if obj is None:
+                new.append(self.model(**{self.key_field: row.key}, **row.values))
+            elif any(getattr(obj, field) != value for field, value in row.values.items()):
+                for field, value in row.values.items():
+                    setattr(obj, field, value)
+                changed.append(obj)
+        self.model.objects.bulk_create(new)
+        self.model.objects.bulk_update(changed, self.update_fields)
+        self.after_upsert(new, changed)
+        return len(new), len(changed)
+
+    def after_upsert(self, created, changed):
+        pass
+
+    def finish(self, stats):
+        pass
+
+
+def clean_decimal(model, name, value):
+    """``value`` rounded to and validated against the model's DecimalField"""
+    field = model._meta.get_field(name)
+    value = field.to_python(str(value)).quantize(Decimal(1).scaleb(-field.decimal_places))
+    field.run_validators(value)
+    return value
+
+
+class ProductImporter(BulkImporter):
+    """``[{"sku": 1001, "price": 14.99}, ...]``"""
+    model = Product
+    key_field = 'sku'
+    update_fields = ['price']
+
+    def parse(self, record):
+        return int(record['sku']), {'price': clean_decimal(Product, 'price', record['price'])}
+
+    def after_upsert(self, created, changed):
+        skus = {product.sku for product in created + changed}
+        price_cache.invalidate_on_commit(skus=skus, pks=[product.pk for product in changed])
+        if changed:
+            cart_store.invalidate_all_on_commit()
+        # New SKUs may be on orders that were priced at zero until now
+        OrderTotals.refresh_for_skus(skus)
+
+
+class DiscountImporter(BulkImporter):
+    """
+    ``[{"key": "SALE10", "value": 0.1}, ...]``, where ``value`` is the
+    fraction taken off, or ``[{"code": "SALE10", "percentage": 10}, ...]``
+    """
+    model = Discount
+    key_field = 'code'
+    update_fields = ['percentage']
+
+    def parse(self, record):
+        code = str(record['key'] if 'key' in record else record['code'])
+        if not code or len(code) > Discount._meta.get_field('code').max_length:
+            raise ValueError(f'Invalid code {code!r}')
+        if 'value' in record:
+            percentage = Decimal(str(record['value'])) * 100
+        else:
+            percentage = record['percentage']
+        return code, {'percentage': clean_decimal(Discount, 'percentage', percentage)}
+
+    def after_upsert(self, created, changed):
+        discount_registry.invalidate_on_commit()
+        if changed:
+            OrderTotals.refresh(Order.objects.filter(discount__in=changed))
+
+
+class OrderImporter(BulkImporter):
+    """
+    ``[{"orderId": 1, "discount": "SALE10", "items": [{"sku": 1001, "quantity": 3}]}, ...]``
+
+    Imported orders belong to ``user``. An order that already exists keeps
+    its owner and status, and has its discount and items replaced. Totals
+    are priced before the bulk writes, from one price lookup per batch.
+    """
+    model = Order
+    key_field = 'order_id'
+
+    def __init__(self, user, batch_size=BulkImporter.BATCH_SIZE, progress=None):
+        super().__init__(batch_size, progress)
+        self.user = user
+        self.max_order_id = 0
+
+    def parse(self, record):
+        order_id = int(record['orderId'] if 'orderId' in record else record['order_id'])
+        items = []
+        for item in record.get('items') or []:
+            sku, quantity = int(item['sku']), int(item['quantity'])
+            if quantity <= 0:
+                raise ValueError(f'Invalid quantity {quantity} for SKU {sku}')
+            items.append((sku, quantity))
+        return order_id, {'discount': record.get('discount') or None, 'items': items}
+
+    def upsert(self, rows, stats):
+        codes = {row.values['discount'] for row in rows} - {None}
+        discounts = Discount.objects.in_bulk(codes, field_name='code')
+        valid = []
+        for row in rows:
+            if row.values['discount'] is not None and row.values['discount'] not in discounts:
+                self._error(stats, row.number, f"Unknown discount {row.values['discount']!r}")
+            else:
+                valid.append(row)
+
+        existing = Order.objects.in_bulk([row.key for row in valid], field_name='order_id')
+        engine = PricingEngine(load_prices(sku for row in valid for sku, _ in row.values['items']))
+        new, changed, items = [], [], {}
+        now = timezone.now()
+        for row in valid:
+            order = existing.get(row.key) or Order(order_id=row.key, user=self.user)
+            order.discount = discounts.get(row.values['discount'])
+            items[row.key] = [OrderItem(sku=sku, quantity=quantity) for sku, quantity in row.values['items']]
+            for field, value in OrderTotals.expected(order, engine, items[row.key]).items():
+                setattr(order, field, value)
+            if order.pk:
+                order.updated_at = now  # bulk_update skips auto_now
+                changed.append(order)
+            else:
+                new.append(order)
+            self.max_order_id = max(self.max_order_id, row.key)
+
+        Order.objects.bulk_create(new)
+        Order.objects.bulk_update(changed, ['discount', 'updated_at'] + Order.TOTAL_FIELDS)
+        # The totals are already right, so skip the per-item delete signals
+        # (and the order refresh each would trigger)
+        replaced = OrderItem.objects.filter(order__in=changed)
+        replaced._raw_delete(replaced.db)
+
+        # Not every backend sets pks from bulk_create, so read them back
+        pks = dict(Order.objects.filter(order_id__in=items).values_list('order_id', 'pk'))
+        for order_id, order_items in items.items():
+            for item in order_items:
+                item.order_id = pks[order_id]
+        OrderItem.objects.bulk_create([item for order_items in items.values() for item in order_items])
+        return len(new), len(changed)
+
+    def finish(self, stats):
+        # Keep Checkout from handing out an order_id that was just imported
+        Sequence.objects.filter(name='order_id', value__lt=self.max_order_id).update(value=self.max_order_id)
+
+
+IMPORTERS = {
+    'products': ProductImporter,
+    'discounts': DiscountImporter,
+    'orders': OrderImporter,
+}
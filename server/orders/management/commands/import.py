@@ -0,0 +1,45 @@
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from orders.importers import IMPORTERS, BulkImporter, OrderImporter
+
+
+class Command(BaseCommand):
+    help = ('Bulk import products, discounts or orders from a JSON array file in the '
+            'todo/*.json format, upserting in batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="JSON file to import, or - for stdin")
+        parser.add_argument('--batch-size', type=int, default=BulkImporter.BATCH_SIZE)
+        parser.add_argument('--user', help='Username that imported orders belong to')
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {stats.rows} rows read")
+
+        importer_class = IMPORTERS[options['kind']]
+        if importer_class is OrderImporter:
+            if not options['user']:
+                raise CommandError('--user is required to import orders')
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['user']}")
+            importer = OrderImporter(user, options['batch_size'], progress)
+        else:
+            importer = importer_class(options['batch_size'], progress)
+
+        try:
+            if options['path'] == '-':
+                stats = importer.run(sys.stdin.buffer)
+            else:
+                with open(options['path'], 'rb') as source:
+                    stats = importer.run(source)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Import failed: {e}")
+
+        for row, error in stats.errors:
+            self.stderr.write(f"Row {row}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {options['kind']}: {stats}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Min, Sum
+from orders.models import CartItem
+
+
+class Command(BaseCommand):
+    help = ('Merge cart rows for the same product in the same cart, adding up their quantities. '
+            'Run before migrate adds the one-row-per-product constraints (see migrations.sh)')
+
+    def handle(self, *args, **options):
+        if CartItem._meta.db_table not in connection.introspection.table_names():
+            self.stdout.write("No cart table yet, nothing to merge")
+            return
+
+        merged = 0
+        with transaction.atomic():
+            # The same owners as the constraints: a user's cart, then a session's
+            for owner in ('user', 'session_key'):
+                groups = (CartItem.objects.filter(**{f'{owner}__isnull': False})
+                          .values(owner, 'product')
+                          .annotate(keep=Min('pk'), total=Sum('quantity'), rows=Count('pk'))
+                          .filter(rows__gt=1)
+                          .order_by())
+                for group in groups:
+                    CartItem.objects.filter(pk=group['keep']).update(quantity=group['total'])
+                    merged += (CartItem.objects.filter(**{owner: group[owner], 'product': group['product']})
+                               .exclude(pk=group['keep']).delete()[0])
+        self.stdout.write(self.style.SUCCESS(f"Merged {merged} duplicate cart row(s)"))
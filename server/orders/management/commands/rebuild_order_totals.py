@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders.models import Order
+from orders.services import OrderTotals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the subtotal/discount/total/item count stored on orders, or check them for drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report orders whose stored totals are out of date')
+        parser.add_argument('--batch-size', type=int, default=OrderTotals.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        batch_size = options['batch_size']
+
+        if options['check']:
+            drifted = 0
+            for order, expected in OrderTotals.find_drift(orders, batch_size):
+                drifted += 1
+                stored = {field: getattr(order, field) for field in expected}
+                self.stdout.write(f"Order #{order.order_id}: stored {stored}, expected {expected}")
+            if drifted:
+                raise CommandError(f"{drifted} order(s) have out of date totals")
+            self.stdout.write(self.style.SUCCESS("All order totals are up to date"))
+            return
+
+        changed = OrderTotals.refresh(orders, batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt totals, {changed} order(s) were out of date"))
@@ -0,0 +1,37 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from orders.discounts import HUNDRED, discount_registry
+from orders.models import Discount, Order
+from orders.services import OrderTotals
+
+
+class Command(BaseCommand):
+    help = ('One-off upgrade: Discount.percentage is read as percent (10 for 10% off), so rows '
+            'still holding a fraction (0.1) would take almost nothing off. Multiplies every '
+            'percentage above 0 and up to --max by 100 and reprices the orders using them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max', type=Decimal, default=Decimal('1'),
+                            help='Largest stored value that is a fraction (default: 1)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the discounts that would be rescaled')
+
+    def handle(self, *args, **options):
+        discounts = list(Discount.objects.filter(percentage__gt=0, percentage__lte=options['max']).order_by('code'))
+        for discount in discounts:
+            self.stdout.write(f"{discount.code}: {discount.percentage} -> {discount.percentage * HUNDRED}")
+        if options['dry_run']:
+            self.stdout.write(f"{len(discounts)} discount(s) would be rescaled")
+            return
+
+        with transaction.atomic():
+            for discount in discounts:
+                discount.percentage *= HUNDRED
+            # bulk_update sends no signals, so invalidate as the importer does
+            Discount.objects.bulk_update(discounts, ['percentage'])
+            discount_registry.invalidate_on_commit()
+            repriced = OrderTotals.refresh(Order.objects.filter(discount__in=discounts))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rescaled {len(discounts)} discount(s), repriced {repriced} order(s)"
+        ))
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.conf import settings
@@ -15,23 +17,63 @@ class Discount(models.Model):
     percentage = models.DecimalField(max_digits=5, decimal_places=2)  # Changed from (3,2) to (5,2)
 
     def get_discount_amount(self, subtotal):
-        return (self.percentage* subtotal)
+        from .discounts import DiscountRule
+        return DiscountRule.for_discount(self).get_discount_amount(subtotal)
 
     def __str__(self):
         return f"{self.code} ({self.percentage}% off)"
 
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+class OrderItemQuerySet(models.QuerySet):
+    def with_unit_prices(self):
+        """Annotate each item with its product's price, joining Product on sku"""
+        return self.annotate(
+            unit_price=Coalesce(F('product__price'), Value(Decimal('0.00')), output_field=MONEY),
+        )
+
+    def with_line_totals(self):
+        """Annotate unit price, line total and discount"""
+        return self.with_unit_prices().annotate(
+            line_total=ExpressionWrapper(F('quantity') * F('unit_price'), output_field=MONEY),
+        ).annotate(
+            # Same rule as DiscountRule.get_discount_amount, applied per line
+            line_discount=ExpressionWrapper(
+                F('line_total') * Coalesce(F('order__discount__percentage'), Value(Decimal('0.00')))
+                / Value(Decimal(100)),
+                output_field=MONEY,
+            ),
+        )
+
 class OrderItem(models.Model):
     sku = models.IntegerField()
     quantity = models.IntegerField()
     order = models.ForeignKey('Order', related_name='items', on_delete=models.CASCADE)
+    # The relation to Product over the sku column itself. Items may name a
+    # SKU with no product (priced at zero), so there is no database
+    # constraint, deleting a product leaves its items alone and joins are
+    # LEFT OUTER.
+    product = models.ForeignObject(
+        Product, on_delete=models.DO_NOTHING, from_fields=['sku'], to_fields=['sku'],
+        null=True, related_name='order_items',
+    )
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Repricing finds the orders holding a SKU from this index alone
+            models.Index(fields=['sku', 'order'], name='orderitem_sku_order_idx'),
+        ]
 
     def get_total(self):
         """Calculate total for this item"""
-        try:
-            product = Product.objects.get(sku=self.sku)
-            return product.price * self.quantity
-        except Product.DoesNotExist:
-            return Decimal('0.00')
+        # Items priced by PricingEngine or loaded through with_unit_prices()
+        # already carry their unit price
+        if hasattr(self, 'unit_price'):
+            return self.unit_price * self.quantity
+        from .cache import price_cache
+        return price_cache.get('sku', self.sku, Decimal('0.00')) * self.quantity
 
     def __str__(self):
         return f"Order #{self.order.order_id} - SKU: {self.sku} (Qty: {self.quantity})"
@@ -51,29 +93,29 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized totals, kept up to date by orders.signals
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    discount_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    items_count = models.PositiveIntegerField(default=0)
+
+    TOTAL_FIELDS = ['subtotal', 'discount_amount', 'total', 'items_count']
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # OrderViewSet lists a user's orders newest first, a page at a time
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
 
     def get_summary(self):
-        """Calculate order summary including subtotal, discount and total"""
-        # Calculate subtotal from order items
-        subtotal = sum(item.get_total() for item in self.items.all())
-        
-        # Calculate discount if applicable
-        discount_amount = Decimal('0.00')
-        if self.discount:
-            # Convert percentage to decimal (e.g., 10% becomes 0.10)
-            discount_amount = self.discount.get_discount_amount(subtotal)
-        
-        # Calculate final total
-        total = subtotal - discount_amount
-        
+        """Order summary including subtotal, discount and total"""
         return {
             'order_id': self.order_id,
-            'subtotal': float(subtotal),
-            'discount_amount': float(discount_amount),
-            'total': float(total),
-            'items_count': self.items.count(),
+            'subtotal': float(self.subtotal),
+            'discount_amount': float(self.discount_amount),
+            'total': float(self.total),
+            'items_count': self.items_count,
             'status': self.status,
             'discount_percentage': float(self.discount.percentage) if self.discount else 0.00
         }
@@ -82,14 +124,63 @@ class Order(models.Model):
         discount_str = f" with {self.discount.code}" if self.discount else ""
         return f"Order #{self.order_id}{discount_str} - {self.status}"
 
+class Sequence(models.Model):
+    """Named counter used to hand out ids such as Order.order_id without races"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+    @classmethod
+    def next_value(cls, name, initial=lambda: 0):
+        """
+        Increment and return the named counter.
+
+        The UPDATE locks the row until the surrounding transaction ends, so
+        concurrent callers never see the same value. ``initial`` is only
+        called to seed a counter that does not exist yet.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(value=models.F('value') + 1):
+                try:
+                    with transaction.atomic():
+                        return cls.objects.create(name=name, value=initial() + 1).value
+                except IntegrityError:
+                    # Someone else seeded it first
+                    cls.objects.filter(name=name).update(value=models.F('value') + 1)
+            return cls.objects.values_list('value', flat=True).get(name=name)
+
+class CartItemQuerySet(models.QuerySet):
+    def totals(self):
+        """{'subtotal': Decimal, 'items': total quantity}, summed by the database"""
+        totals = self.aggregate(
+            subtotal=Sum(F('quantity') * F('product__price'), output_field=MONEY),
+            items=Sum('quantity'),
+        )
+        return {'subtotal': totals['subtotal'] or Decimal('0.00'), 'items': totals['items'] or 0}
+
 class CartItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     session_key = models.CharField(max_length=40, null=True, blank=True)  # Django session key
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One row per product in a cart, which is read by user or, for
+            # anonymous visitors, by session; the unique indexes serve both
+            models.UniqueConstraint(fields=['user', 'product'], name='cartitem_user_product_uniq'),
+            models.UniqueConstraint(fields=['session_key', 'product'], name='cartitem_session_product_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.sku}"
 
     def get_total(self):
-        return self.product.price * self.quantity
+        if CartItem.product.is_cached(self):
+            return self.product.price * self.quantity
+        from .cache import price_cache
+        return price_cache.get('pk', self.product_id) * self.quantity
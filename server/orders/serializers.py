@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Product, Discount, Order, OrderItem, CartItem
+from .services import Checkout
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,22 +20,17 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'sku', 'quantity', 'total']
 
 class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
+    items = OrderItemSerializer(many=True, required=False)
     summary = serializers.DictField(read_only=True, source='get_summary')
     
     class Meta:
         model = Order
         fields = ['id', 'order_id', 'user', 'status', 'discount', 'items', 'summary', 'created_at', 'updated_at']
-        read_only_fields = ['user', 'created_at', 'updated_at']
+        read_only_fields = ['order_id', 'user', 'created_at', 'updated_at']
 
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
-        
-        return order
+        items_data = validated_data.pop('items', [])
+        return Checkout.from_items(items=items_data, **validated_data)
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)  # Nested serializer for product details
@@ -45,4 +41,4 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'total']
 
     def get_total(self, obj):
-        return obj.product.price * obj.quantity
\ No newline at end of file
+        return obj.get_total()
\ No newline at end of file
@@ -1,32 +1,313 @@
 from decimal import Decimal
-from .models import Product, Order
+from django.db import transaction
+from django.db.models import Count, DateField, F, Max, Sum, prefetch_related_objects
+from django.db.models.functions import TruncDate, TruncWeek
+from .cache import price_cache
+from .carts import Cart, cart_store
+from .discounts import discount_registry
+from .models import Product, Order, OrderItem, CartItem, Sequence
+
+
+def load_prices(skus, cached=False):
+    """
+    Return a {sku: price} dict for the given SKUs, querying at most once.
+
+    Anything that writes money (orders, stored totals) reads the database:
+    the price cache is per process unless PRICE_CACHE names a shared alias,
+    so another worker may still hold a price changed moments ago. Pass
+    ``cached=True`` for display-only reads.
+    """
+    skus = set(skus)
+    if not skus:
+        return {}
+    if cached:
+        return price_cache.get_many('sku', skus)
+    return dict(Product.objects.filter(sku__in=skus).values_list('sku', 'price'))
+
+
+class PricingEngine:
+    """
+    Prices order items in memory from one SKU -> price lookup.
+
+    Build it with ``for_orders`` (or ``for_items``) so every SKU involved is
+    resolved up front; pricing then costs no further queries, however many
+    orders or line items are involved.
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+
+    @classmethod
+    def for_items(cls, items, cached=False):
+        return cls(load_prices((item.sku for item in items), cached))
+
+    @classmethod
+    def for_orders(cls, orders, cached=False):
+        # Items are fetched once for the whole batch; discounts come from
+        # the registry
+        prefetch_related_objects(orders, 'items')
+        return cls.for_items((item for order in orders for item in order.items.all()), cached)
+
+    def price_item(self, item):
+        """Price a single item and remember its unit price on the instance"""
+        item.unit_price = self.prices.get(item.sku, Decimal('0.00'))
+        return item.unit_price * item.quantity
+
+    def price_order(self, order, items=None):
+        if items is None:
+            items = order.items.all()
+
+        lines = [(item, self.price_item(item)) for item in items]
+        subtotal = sum((total for _, total in lines), Decimal('0.00'))
+
+        discount = discount_registry.for_order(order)
+        discount_amount = discount.get_discount_amount(subtotal) if discount else Decimal('0.00')
+
+        return {
+            'lines': lines,
+            'discount': discount,
+            'subtotal': subtotal,
+            'discount_amount': discount_amount,
+            'total': subtotal - discount_amount,
+            'items_count': len(lines),
+        }
+
+
+CENT = Decimal('0.01')
+
+
+class OrderTotals:
+    """Maintains the subtotal, discount, total and item count stored on Order"""
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def _batches(orders, batch_size):
+        orders = orders.select_related('discount').order_by('pk')
+        last_pk = None
+        while True:
+            batch = orders if last_pk is None else orders.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    @staticmethod
+    def expected(order, engine, items=None):
+        pricing = engine.price_order(order, items)
+        subtotal = pricing['subtotal'].quantize(CENT)
+        discount_amount = pricing['discount_amount'].quantize(CENT)
+        return {
+            'subtotal': subtotal,
+            'discount_amount': discount_amount,
+            'total': subtotal - discount_amount,
+            'items_count': pricing['items_count'],
+        }
+
+    @classmethod
+    def _drift(cls, batch):
+        engine = PricingEngine.for_orders(batch)
+        for order in batch:
+            expected = cls.expected(order, engine)
+            if any(getattr(order, field) != value for field, value in expected.items()):
+                yield order, expected
+
+    @classmethod
+    def find_drift(cls, orders, batch_size=BATCH_SIZE):
+        """Yield (order, expected_totals) for orders whose stored totals are stale"""
+        for batch in cls._batches(orders, batch_size):
+            yield from cls._drift(batch)
+
+    @classmethod
+    def refresh(cls, orders, batch_size=BATCH_SIZE):
+        """Recompute totals for the given orders queryset; returns how many changed"""
+        updated = 0
+        for batch in cls._batches(orders, batch_size):
+            changed = []
+            for order, expected in cls._drift(batch):
+                for field, value in expected.items():
+                    setattr(order, field, value)
+                changed.append(order)
+
+            # bulk_update sends no signals, so this never re-triggers a refresh
+            Order.objects.bulk_update(changed, Order.TOTAL_FIELDS)
+            updated += len(changed)
+        return updated
+
+    @classmethod
+    def refresh_for_skus(cls, skus):
+        return cls.refresh(Order.objects.filter(
+            pk__in=OrderItem.objects.filter(sku__in=set(skus)).values('order_id')
+        ))
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+class Checkout:
+    """Creates orders in one transaction with a single bulk insert of their items"""
+
+    @staticmethod
+    def next_order_id():
+        return Sequence.next_value(
+            'order_id',
+            initial=lambda: Order.objects.aggregate(last=Max('order_id'))['last'] or 0,
+        )
+
+    @staticmethod
+    def _create(user, lines, order_fields, engine):
+        order = Order(order_id=Checkout.next_order_id(), user=user, **order_fields)
+        items = [OrderItem(sku=sku, quantity=quantity) for sku, quantity in lines]
+
+        # bulk_create skips the item signals, so the totals are priced up front
+        for field, value in OrderTotals.expected(order, engine, items).items():
+            setattr(order, field, value)
+        order.save()
+
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        return order
+
+    @staticmethod
+    def from_items(user, items, **order_fields):
+        lines = [(item['sku'], item['quantity']) for item in items]
+        with transaction.atomic():
+            engine = PricingEngine(load_prices(sku for sku, _ in lines))
+            return Checkout._create(user, lines, order_fields, engine)
+
+    @staticmethod
+    def from_cart(user, **order_fields):
+        """Turn the user's cart into an order and empty the cart"""
+        with transaction.atomic():
+            # Locking the cart rows makes a concurrent checkout of the same
+            # cart wait for this one, then find the cart empty
+            cart_items = list(
+                CartItem.objects.select_for_update(of=('self',))
+                .filter(user=user)
+                .select_related('product')
+            )
+            if not cart_items:
+                raise EmptyCartError('Cart is empty')
+
+            engine = PricingEngine({item.product.sku: item.product.price for item in cart_items})
+            lines = [(item.product.sku, item.quantity) for item in cart_items]
+            order = Checkout._create(user, lines, order_fields, engine)
+            CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+            transaction.on_commit(lambda: cart_store.forget(Cart(user=user).owner))
+            return order
+
 
 class OrderCalculator:
     @staticmethod
     def calculate_order_total(order: Order) -> dict:
-        total = Decimal('0.00')
-        items_summary = []
-        
-        for item in order.items.all():
-            product = Product.objects.get(sku=item.sku)
-            item_total = product.price * item.quantity
-            total += item_total
-            items_summary.append({
+        return OrderCalculator.calculate_totals([order])[order.pk]
+
+    @staticmethod
+    def calculate_totals(orders) -> dict:
+        """Calculate totals for a batch of orders, keyed by order pk"""
+        orders = list(orders)
+        # Only displayed, so cached prices will do
+        engine = PricingEngine.for_orders(orders, cached=True)
+        return {
+            order.pk: OrderCalculator._format(order, engine.price_order(order))
+            for order in orders
+        }
+
+    @staticmethod
+    def _format(order, pricing):
+        items_summary = [
+            {
                 'sku': item.sku,
                 'quantity': item.quantity,
-                'unit_price': str(product.price),
+                'unit_price': str(item.unit_price),
                 'total': str(item_total)
-            })
-        
-        if order.discount:
-            discount_amount = total * order.discount.percentage
-            total -= discount_amount
-            
+            }
+            for item, item_total in pricing['lines']
+        ]
+
         return {
             'order_id': order.order_id,
             'items': items_summary,
-            'discount_code': order.discount.code if order.discount else None,
-            'subtotal': str(total + (discount_amount if order.discount else Decimal('0.00'))),
-            'discount_amount': str(discount_amount) if order.discount else '0.00',
-            'total': str(total)
+            'discount_code': pricing['discount'].code if pricing['discount'] else None,
+            'subtotal': str(pricing['subtotal']),
+            'discount_amount': str(pricing['discount_amount']),
+            'total': str(pricing['total'])
         }
+
+
+class SalesReport:
+    """
+    Sales figures aggregated in the database.
+
+    Line totals come from ``OrderItem.objects.with_line_totals()``, so no
+    order is loaded or priced in Python.
+    """
+    BUCKETS = {
+        'day': TruncDate,
+        'week': lambda field: TruncWeek(field, output_field=DateField()),
+    }
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.items = OrderItem.objects.filter(order__in=orders.values('pk')).with_line_totals()
+
+    @staticmethod
+    def _money(value):
+        return str((value or Decimal('0.00')).quantize(Decimal('0.01')))
+
+    def _group(self, order_key, item_key):
+        """Order counts and sales grouped by the given order/item expressions"""
+        counts = self.orders.order_by().values(key=order_key).annotate(orders=Count('id'))
+        sales = self.items.order_by().values(key=item_key).annotate(
+            subtotal=Sum('line_total'),
+            discount_amount=Sum('line_discount'),
+        )
+        sales = {row['key']: row for row in sales}
+
+        rows = []
+        for row in counts.order_by('key'):
+            subtotal = sales.get(row['key'], {}).get('subtotal') or Decimal('0.00')
+            discount_amount = sales.get(row['key'], {}).get('discount_amount') or Decimal('0.00')
+            rows.append({
+                'key': row['key'],
+                'orders': row['orders'],
+                'subtotal': subtotal,
+                'discount_amount': discount_amount,
+                'total': subtotal - discount_amount,
+            })
+        return rows
+
+    def _serialize(self, rows, key_name):
+        return [
+            {
+                key_name: row['key'],
+                'orders': row['orders'],
+                'subtotal': self._money(row['subtotal']),
+                'discount_amount': self._money(row['discount_amount']),
+                'total_sales': self._money(row['total']),
+            }
+            for row in rows
+        ]
+
+    def summarize(self, bucket=None):
+        by_status = self._group(F('status'), F('order__status'))
+        subtotal = sum((row['subtotal'] for row in by_status), Decimal('0.00'))
+        discount_amount = sum((row['discount_amount'] for row in by_status), Decimal('0.00'))
+
+        result = {
+            'total_orders': sum(row['orders'] for row in by_status),
+            'subtotal': self._money(subtotal),
+            'discount_amount': self._money(discount_amount),
+            'total_sales': self._money(subtotal - discount_amount),
+            'by_status': self._serialize(by_status, 'status'),
+        }
+
+        if bucket:
+            trunc = self.BUCKETS[bucket]
+            series = self._group(trunc('created_at'), trunc('order__created_at'))
+            result['bucket'] = bucket
+            result['series'] = self._serialize(series, 'period')
+
+        return result
@@ -0,0 +1,166 @@
+import threading
+from contextlib import contextmanager
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .cache import price_cache
+from .carts import SESSION_CART_KEY, Cart, cart_store
+from .discounts import discount_registry
+from .models import Product, Discount, Order, OrderItem
+from .services import OrderTotals
+
+_batch = threading.local()
+
+
+class CatalogChanges:
+    """Price invalidations and order total refreshes collected from a batch of writes"""
+
+    def __init__(self):
+        self.skus = set()
+        self.product_pks = set()
+        self.discount_pks = set()
+        self.order_pks = set()
+
+    def add_products(self, skus, pks=()):
+        self.skus.update(skus)
+        self.product_pks.update(pks)
+
+    def add_discounts(self, pks):
+        """Remember the orders using these discounts; call it before deleting them"""
+        pks = set(pks) - self.discount_pks
+        if pks:
+            self.discount_pks.update(pks)
+            self.order_pks.update(Order.objects.filter(discount__in=pks).values_list('pk', flat=True))
+
+    def apply(self):
+        if self.skus or self.product_pks:
+            price_cache.invalidate_on_commit(skus=self.skus, pks=self.product_pks)
+            cart_store.invalidate_all_on_commit()
+        if self.skus:
+            OrderTotals.refresh_for_skus(self.skus)
+        if self.order_pks:
+            OrderTotals.refresh(Order.objects.filter(pk__in=self.order_pks))
+
+
+def pending_changes():
+    return getattr(_batch, 'changes', None)
+
+
+@contextmanager
+def batched_refresh():
+    """
+    Collect what product and discount writes in the block would invalidate
+    or refresh row by row, and apply it once when the block exits. Bulk
+    writes send no signals, so callers add those changes to the yielded
+    CatalogChanges themselves.
+    """
+    if pending_changes() is not None:
+        yield pending_changes()
+        return
+    _batch.changes = changes = CatalogChanges()
+    try:
+        yield changes
+    finally:
+        _batch.changes = None
+    changes.apply()
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_item_order_totals(sender, instance, **kwargs):
+    OrderTotals.refresh(Order.objects.filter(pk=instance.order_id))
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_totals(sender, instance, created, update_fields=None, **kwargs):
+    # A new order has no items yet; otherwise only a discount change matters
+    if created or (update_fields is not None and 'discount' not in update_fields):
+        return
+    if OrderTotals.refresh(Order.objects.filter(pk=instance.pk)):
+        instance.refresh_from_db(fields=Order.TOTAL_FIELDS)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_price(sender, instance, **kwargs):
+    """Record which SKUs need repricing, if the price or SKU is changing"""
+    previous = Product.objects.filter(pk=instance.pk).values_list('sku', 'price').first() if instance.pk else None
+    if previous == (instance.sku, instance.price):
+        instance._stale_skus = set()
+    else:
+        instance._stale_skus = {instance.sku} | ({previous[0]} if previous else set())
+
+
+# Connected before the order totals receivers below, so they reprice
+# orders from fresh prices
+@receiver(post_save, sender=Product)
+def invalidate_product_price(sender, instance, **kwargs):
+    stale_skus = getattr(instance, '_stale_skus', {instance.sku})
+    if stale_skus:
+        if pending_changes() is not None:
+            pending_changes().add_products(stale_skus, [instance.pk])
+            return
+        price_cache.invalidate_on_commit(skus=stale_skus, pks=[instance.pk])
+        cart_store.invalidate_all_on_commit()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product_price(sender, instance, **kwargs):
+    if pending_changes() is not None:
+        pending_changes().add_products([instance.sku], [instance.pk])
+        return
+    price_cache.invalidate_on_commit(skus=[instance.sku], pks=[instance.pk])
+    cart_store.invalidate_all_on_commit()
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_order_totals(sender, instance, **kwargs):
+    stale_skus = getattr(instance, '_stale_skus', {instance.sku})
+    if stale_skus and pending_changes() is None:
+        OrderTotals.refresh_for_skus(stale_skus)
+
+
+@receiver(post_delete, sender=Product)
+def refresh_deleted_product_order_totals(sender, instance, **kwargs):
+    if pending_changes() is None:
+        OrderTotals.refresh_for_skus([instance.sku])
+
+
+# Connected before the order totals receivers below, so they reprice
+# orders with the new rules
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_discount_registry(sender, instance, **kwargs):
+    discount_registry.invalidate_on_commit()
+
+
+@receiver(post_save, sender=Discount)
+def refresh_discount_order_totals(sender, instance, created, **kwargs):
+    if created:
+        return
+    if pending_changes() is not None:
+        pending_changes().add_discounts([instance.pk])
+        return
+    OrderTotals.refresh(Order.objects.filter(discount=instance))
+
+
+@receiver(pre_delete, sender=Discount)
+def remember_discount_orders(sender, instance, **kwargs):
+    # Orders lose the discount through SET_NULL, which sends no signals
+    if pending_changes() is not None:
+        pending_changes().add_discounts([instance.pk])
+        return
+    instance._order_pks = list(instance.order_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Discount)
+def refresh_deleted_discount_order_totals(sender, instance, **kwargs):
+    if pending_changes() is None:
+        OrderTotals.refresh(Order.objects.filter(pk__in=getattr(instance, '_order_pks', [])))
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    # Session logins only; API clients on JWT are merged by Cart.for_request
+    session = getattr(request, 'session', None)
+    if session is not None and session.get(SESSION_CART_KEY):
+        Cart(user=user).merge(session.pop(SESSION_CART_KEY))
@@ -1,9 +1,26 @@
-from django.test import TestCase
+import asyncio
+import threading
+from django.core.cache import caches
+from django.db import IntegrityError, connection
+from unittest import mock, skipUnless
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import BytesIO, StringIO
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, force_authenticate
 from rest_framework import status
 from decimal import Decimal
-from .models import Product, Discount, Order, OrderItem
+from datetime import datetime, timezone
+from django.conf import settings
+from .cache import PriceCache, price_cache
+from . import async_views
+from .carts import Cart, cart_store
+from .discounts import DiscountRegistry, discount_registry
+from .importers import OrderImporter, ProductImporter, iter_json_array
+from .models import Product, Discount, Order, OrderItem, CartItem
+from .services import Checkout, EmptyCartError, OrderCalculator
+from .views import apply_coupon
 
 class OrdersAPITest(APITestCase):
     def setUp(self):
@@ -120,4 +137,922 @@ class OrdersAPITest(APITestCase):
         response = self.client.get('/api/orders/?search=12345')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)
-        self.assertEqual(response.data['results'][0]['order_id'], 12345)
\ No newline at end of file
+        self.assertEqual(response.data['results'][0]['order_id'], 12345)
+
+class OrderPricingTest(TestCase):
+    def setUp(self):
+        """Create products and a user to attach orders to"""
+        price_cache.clear()
+        self.user = User.objects.create_user(username='pricing', password='testpass123')
+        self.products = [
+            Product.objects.create(sku=2000 + i, price=Decimal('1.50') * (i + 1))
+            for i in range(10)
+        ]
+        self.discount = Discount.objects.create(code='BATCH', percentage=Decimal('10.00'))
+
+    def create_orders(self, order_count, items_per_order, start_id=1, discount=None):
+        for order_id in range(start_id, start_id + order_count):
+            order = Order.objects.create(order_id=order_id, user=self.user, discount=discount)
+            for product in self.products[:items_per_order]:
+                OrderItem.objects.create(order=order, sku=product.sku, quantity=2)
+
+    def test_calculate_order_total(self):
+        """Test single order pricing"""
+        self.create_orders(1, 3)
+        order = Order.objects.get(order_id=1)
+
+        result = OrderCalculator.calculate_order_total(order)
+        self.assertEqual(result['subtotal'], '18.00')  # 2 * (1.50 + 3.00 + 4.50)
+        self.assertEqual(result['total'], '18.00')
+        self.assertEqual(result['items'][0]['unit_price'], '1.50')
+
+    def test_unknown_sku_is_priced_at_zero(self):
+        """Test items without a matching product"""
+        order = Order.objects.create(order_id=1, user=self.user)
+        OrderItem.objects.create(order=order, sku=9999, quantity=3)
+
+        self.assertEqual(order.get_summary()['total'], 0.0)
+        self.assertEqual(OrderCalculator.calculate_order_total(order)['total'], '0.00')
+
+    def test_batch_pricing_query_count_is_constant(self):
+        """Test that pricing N orders with M items uses a fixed number of queries"""
+        self.create_orders(2, 2, discount=self.discount)
+        price_cache.clear()
+        discount_registry.invalidate()
+        with self.assertNumQueries(4):  # orders, items, discounts (registry load), products
+            small = OrderCalculator.calculate_totals(Order.objects.all())
+
+        self.create_orders(8, 10, start_id=100, discount=self.discount)
+        price_cache.clear()
+        discount_registry.invalidate()
+        with self.assertNumQueries(4):
+            large = OrderCalculator.calculate_totals(Order.objects.all())
+
+        self.assertEqual(len(small), 2)
+        self.assertEqual(len(large), 10)
+
+    def test_summary_reads_stored_totals(self):
+        """Test that get_summary does not query items or products"""
+        self.create_orders(1, 10)
+        order = Order.objects.get(order_id=1)
+
+        with self.assertNumQueries(0):
+            summary = order.get_summary()
+        self.assertEqual(summary['items_count'], 10)
+        self.assertEqual(summary['subtotal'], 165.0)  # 2 * 1.50 * (1 + ... + 10)
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        """Create an order with two items"""
+        price_cache.clear()
+        self.user = User.objects.create_user(username='totals', password='testpass123')
+        self.product1 = Product.objects.create(sku=3001, price=Decimal('10.00'))
+        self.product2 = Product.objects.create(sku=3002, price=Decimal('5.00'))
+        self.discount = Discount.objects.create(code='QUARTER', percentage=Decimal('25.00'))
+        self.order = Order.objects.create(order_id=1, user=self.user)
+        self.item = OrderItem.objects.create(order=self.order, sku=3001, quantity=2)
+        OrderItem.objects.create(order=self.order, sku=3002, quantity=4)
+
+    def assertTotals(self, subtotal, discount_amount, total, items_count):
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.subtotal, Decimal(subtotal))
+        self.assertEqual(self.order.discount_amount, Decimal(discount_amount))
+        self.assertEqual(self.order.total, Decimal(total))
+        self.assertEqual(self.order.items_count, items_count)
+
+    def test_item_changes(self):
+        """Test totals follow item creation, updates and deletion"""
+        self.assertTotals('40.00', '0.00', '40.00', 2)
+        self.item.quantity = 1
+        self.item.save()
+        self.assertTotals('30.00', '0.00', '30.00', 2)
+        self.item.delete()
+        self.assertTotals('20.00', '0.00', '20.00', 1)
+
+    def test_product_price_change(self):
+        """Test totals follow product price changes"""
+        self.product2.price = Decimal('2.50')
+        self.product2.save()
+        self.assertTotals('30.00', '0.00', '30.00', 2)
+        self.product2.delete()
+        self.assertTotals('20.00', '0.00', '20.00', 2)
+
+    def test_discount_changes(self):
+        """Test totals follow the order discount and the discount itself"""
+        self.order.discount = self.discount
+        self.order.save()
+        self.assertEqual(self.order.total, Decimal('30.00'))
+
+        self.discount.percentage = Decimal('50.00')
+        self.discount.save()
+        self.assertTotals('40.00', '20.00', '20.00', 2)
+
+        self.discount.delete()
+        self.assertTotals('40.00', '0.00', '40.00', 2)
+
+    def test_rebuild_command(self):
+        """Test the rebuild command detects and repairs drift"""
+        Order.objects.filter(pk=self.order.pk).update(total=Decimal('1.00'))
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_order_totals', '--check', stdout=out)
+        self.assertIn('Order #1', out.getvalue())
+
+        call_command('rebuild_order_totals', stdout=StringIO())
+        self.assertTotals('40.00', '0.00', '40.00', 2)
+        call_command('rebuild_order_totals', '--check', stdout=StringIO())
+
+
+class SalesSummaryAPITest(APITestCase):
+    def setUp(self):
+        """Create orders spread over two weeks"""
+        self.user = User.objects.create_user(username='sales', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+        Product.objects.create(sku=1001, price=Decimal('10.00'))
+        Product.objects.create(sku=1002, price=Decimal('20.00'))
+        discount = Discount.objects.create(code='HALF', percentage=Decimal('50.00'))
+
+        dates = [datetime(2025, 1, 6, 12, tzinfo=timezone.utc),   # Monday
+                 datetime(2025, 1, 7, 12, tzinfo=timezone.utc),
+                 datetime(2025, 1, 14, 12, tzinfo=timezone.utc)]
+        orders = [
+            (1, 'completed', None, [(1001, 2)]),            # 20.00
+            (2, 'completed', discount, [(1002, 2)]),        # 40.00 - 20.00
+            (3, 'pending', None, [(1001, 1), (1002, 1)]),   # 30.00
+        ]
+        for (order_id, order_status, order_discount, items), created_at in zip(orders, dates):
+            order = Order.objects.create(order_id=order_id, user=self.user,
+                                         status=order_status, discount=order_discount)
+            for sku, quantity in items:
+                OrderItem.objects.create(order=order, sku=sku, quantity=quantity)
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+
+    def test_totals(self):
+        """Test overall totals and status breakdown"""
+        response = self.client.get('/api/orders/sales_summary/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_orders'], 3)
+        self.assertEqual(response.data['subtotal'], '90.00')
+        self.assertEqual(response.data['discount_amount'], '20.00')
+        self.assertEqual(response.data['total_sales'], '70.00')
+
+        by_status = {row['status']: row for row in response.data['by_status']}
+        self.assertEqual(by_status['completed']['orders'], 2)
+        self.assertEqual(by_status['completed']['total_sales'], '40.00')
+        self.assertEqual(by_status['pending']['total_sales'], '30.00')
+
+    def test_filters_and_weekly_series(self):
+        """Test date range, status filter and weekly buckets"""
+        response = self.client.get('/api/orders/sales_summary/', {
+            'start': '2025-01-01', 'end': '2025-01-31', 'status': 'completed,pending', 'bucket': 'week',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        series = [(str(row['period']), row['orders'], row['total_sales']) for row in response.data['series']]
+        self.assertEqual(series, [('2025-01-06', 2, '40.00'), ('2025-01-13', 1, '30.00')])
+
+        response = self.client.get('/api/orders/sales_summary/', {'end': '2025-01-06', 'bucket': 'day'})
+        self.assertEqual(response.data['total_orders'], 1)
+        self.assertEqual(response.data['series'][0]['total_sales'], '20.00')
+
+    def test_invalid_parameters(self):
+        """Test bad dates and buckets are rejected"""
+        response = self.client.get('/api/orders/sales_summary/', {'start': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/orders/sales_summary/', {'end': '2025-02-30'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/orders/sales_summary/', {'bucket': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_summary_query_count(self):
+        """Test the summary is aggregated in the database"""
+        with self.assertNumQueries(4):
+            self.client.get('/api/orders/sales_summary/', {'bucket': 'day'})
+
+
+class OrderListQueryCountTest(APITestCase):
+    def setUp(self):
+        """Create a user with a page worth of orders"""
+        self.user = User.objects.create_user(username='lister', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.discount = Discount.objects.create(code='LIST10', percentage=Decimal('10.00'))
+        for sku in range(4001, 4006):
+            Product.objects.create(sku=sku, price=Decimal('2.00'))
+
+    def create_orders(self, count, items_per_order):
+        start = Order.objects.count() + 1
+        for order_id in range(start, start + count):
+            order = Order.objects.create(order_id=order_id, user=self.user, discount=self.discount)
+            for sku in range(4001, 4001 + items_per_order):
+                OrderItem.objects.create(order=order, sku=sku, quantity=1)
+
+    def test_list_query_count(self):
+        """Test a page of orders costs a fixed number of queries"""
+        self.create_orders(2, 1)
+        with self.assertNumQueries(2):  # orders with discount and user, items with prices
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.create_orders(10, 5)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.data['results']), 10)
+
+        order = response.data['results'][0]
+        self.assertEqual(order['items'][0]['total'], '2.00')
+        self.assertEqual(order['summary']['total'], 9.0)
+
+    def test_cursor_pages(self):
+        """Test cursor pages cover every order once, newest first, without a count"""
+        self.create_orders(25, 1)
+        # Orders created in the same instant are told apart by id
+        Order.objects.filter(order_id__lte=10).update(created_at=datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+        seen, url = [], '/api/orders/'
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen += [order['order_id'] for order in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, list(range(25, 0, -1)))
+
+        response = self.client.get('/api/orders/', {'ordering': 'order_id', 'page_size': 5})
+        self.assertEqual([order['order_id'] for order in response.data['results']], [1, 2, 3, 4, 5])
+
+        # Numbered pages remain available on request
+        response = self.client.get('/api/orders/', {'page': 3})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual([order['order_id'] for order in response.data['results']], [5, 4, 3, 2, 1])
+
+    def test_retrieve_query_count(self):
+        """Test a single order is served from one order and one items query"""
+        self.create_orders(1, 5)
+        order = Order.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/orders/{order.pk}/')
+        self.assertEqual(len(response.data['items']), 5)
+
+
+class CheckoutTest(APITestCase):
+    def setUp(self):
+        """Create a user with two products in the cart"""
+        price_cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.product1 = Product.objects.create(sku=5001, price=Decimal('3.00'))
+        self.product2 = Product.objects.create(sku=5002, price=Decimal('4.00'))
+        CartItem.objects.create(user=self.user, product=self.product1, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.product2, quantity=1)
+
+    def test_checkout_cart(self):
+        """Test the cart becomes one order and is emptied"""
+        Order.objects.create(order_id=41, user=self.user)
+
+        # Independent of cart size; includes seeding the order id sequence
+        with self.assertNumQueries(15):
+            response = self.client.post('/api/orders/', {'status': 'pending'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['order_id'], 42)
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertEqual(response.data['summary']['total'], 10.0)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+        response = self.client.post('/api/orders/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_ids_come_from_sequence(self):
+        """Test order ids keep increasing after orders are deleted"""
+        first = Checkout.from_items(self.user, [{'sku': 5001, 'quantity': 1}])
+        first.delete()
+        second = Checkout.from_cart(self.user)
+        self.assertEqual(second.order_id, first.order_id + 1)
+        self.assertEqual(second.items_count, 2)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='racer', password='testpass123')
+        product = Product.objects.create(sku=6001, price=Decimal('1.00'))
+        CartItem.objects.create(user=self.user, product=product, quantity=3)
+
+    def test_parallel_checkouts_of_one_cart(self):
+        """Test parallel checkouts of the same cart create exactly one order"""
+        barrier = threading.Barrier(4)
+        results = []
+
+        def checkout():
+            barrier.wait()
+            try:
+                results.append(Checkout.from_cart(self.user).order_id)
+            except EmptyCartError:
+                results.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len([order_id for order_id in results if order_id]), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.get().quantity, 3)
+
+    def test_parallel_checkouts_get_unique_order_ids(self):
+        """Test concurrent checkouts never collide on order_id"""
+        users = [User.objects.create_user(username=f'racer{i}') for i in range(6)]
+        barrier = threading.Barrier(len(users))
+
+        def checkout(user):
+            barrier.wait()
+            try:
+                Checkout.from_items(user, [{'sku': 6001, 'quantity': 1}])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order_ids = list(Order.objects.values_list('order_id', flat=True))
+        self.assertEqual(sorted(order_ids), list(range(1, len(users) + 1)))
+
+
+class PriceCacheTest(TestCase):
+    def setUp(self):
+        """Create products and reset the shared price cache"""
+        price_cache.clear()
+        self.user = User.objects.create_user(username='cached', password='testpass123', is_staff=True)
+        self.product = Product.objects.create(sku=7001, price=Decimal('5.00'))
+        Product.objects.create(sku=7002, price=Decimal('6.00'))
+
+    def test_hits_and_misses(self):
+        """Test repeated lookups are served without queries"""
+        with self.assertNumQueries(1):
+            self.assertEqual(price_cache.get_many('sku', [7001, 7002, 7999]),
+                             {7001: Decimal('5.00'), 7002: Decimal('6.00')})
+        with self.assertNumQueries(0):
+            self.assertEqual(price_cache.get('sku', 7001), Decimal('5.00'))
+        self.assertEqual(price_cache.stats()['hits'], 1)
+        self.assertEqual(price_cache.stats()['misses'], 3)
+
+    def test_invalidated_on_save_and_delete(self):
+        """Test product writes invalidate cached prices"""
+        price_cache.get_many('sku', [7001])
+        price_cache.get_many('pk', [self.product.pk])
+
+        self.product.price = Decimal('7.50')
+        self.product.save()
+        self.assertEqual(price_cache.get('sku', 7001), Decimal('7.50'))
+        self.assertEqual(price_cache.get('pk', self.product.pk), Decimal('7.50'))
+
+        self.product.delete()
+        self.assertIsNone(price_cache.get('sku', 7001))
+
+    def test_lru_and_ttl(self):
+        """Test size bound and expiry of local entries"""
+        cache = PriceCache(max_size=1, ttl=60)
+        cache.get_many('sku', [7001])
+        cache.get_many('sku', [7002])
+        self.assertEqual(cache.stats()['size'], 1)
+        with self.assertNumQueries(1):
+            cache.get('sku', 7001)
+
+        cache = PriceCache(ttl=0)
+        cache.get('sku', 7001)
+        with self.assertNumQueries(1):
+            cache.get('sku', 7001)
+
+    def test_money_writes_ignore_the_cache(self):
+        """Test orders and stored totals are priced from the database, not a stale cached price"""
+        price_cache.get('sku', 7001)
+        # A price change saved by another worker leaves this process's cache stale
+        Product.objects.filter(sku=7001).update(price=Decimal('9.00'))
+        order = Checkout.from_items(self.user, [{'sku': 7001, 'quantity': 2}])
+        self.assertEqual(order.subtotal, Decimal('18.00'))
+        call_command('rebuild_order_totals', '--check', stdout=StringIO())
+
+    def test_cart_item_total_uses_cache(self):
+        """Test cart item totals read the cached price"""
+        CartItem.objects.create(user=self.user, product=self.product, quantity=3)
+        item = CartItem.objects.get()
+        price_cache.get('pk', self.product.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(item.get_total(), Decimal('15.00'))
+
+    def test_stats_endpoint(self):
+        """Test the stats endpoint is available to staff"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get('/api/products/price_cache_stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_rate', response.data)
+
+
+TODO_DIR = settings.BASE_DIR.parent / 'todo'
+
+
+class BulkImportTest(TestCase):
+    def setUp(self):
+        """Create the user imported orders belong to"""
+        price_cache.clear()
+        self.user = User.objects.create_user(username='importer', password='testpass123', is_staff=True)
+
+    def import_fixtures(self):
+        out = StringIO()
+        call_command('import', 'products', str(TODO_DIR / 'products.json'), stdout=out)
+        call_command('import', 'discounts', str(TODO_DIR / 'discounts.json'), stdout=out)
+        call_command('import', 'orders', str(TODO_DIR / 'orders.json'), '--user', 'importer', stdout=out)
+        return out.getvalue()
+
+    def test_streaming_parser(self):
+        """Test array elements are decoded across small reads"""
+        data = b'\xef\xbb\xbf [ {"sku": 1, "price": 1.25}, {"a": [1, {"b": "]"}]} ,12345, "x" ]'
+        self.assertEqual(
+            list(iter_json_array(BytesIO(data), read_size=3)),
+            [{'sku': 1, 'price': Decimal('1.25')}, {'a': [1, {'b': ']'}]}, 12345, 'x'],
+        )
+        self.assertEqual(list(iter_json_array(BytesIO(b'[]'))), [])
+        for invalid in (b'{}', b'[1 2]', b'[1,'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(BytesIO(invalid), read_size=2))
+
+    def test_import_fixtures(self):
+        """Test the todo fixtures import with priced totals"""
+        out = self.import_fixtures()
+        self.assertIn('rows/s', out)
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(Discount.objects.get(code='SALE20').percentage, Decimal('20.00'))
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(OrderItem.objects.count(), 8)
+
+        order = Order.objects.get(order_id=1)
+        self.assertEqual(order.discount.code, 'SALE10')
+        self.assertEqual(order.subtotal, Decimal('109.96'))
+        self.assertEqual(order.total, order.subtotal - order.discount_amount)
+        call_command('rebuild_order_totals', '--check', stdout=StringIO())
+
+    def test_reimport_upserts(self):
+        """Test importing again updates rows in place and reprices orders"""
+        self.import_fixtures()
+        stats = ProductImporter().run(BytesIO(b'[{"sku": 1001, "price": 10}, {"sku": 1999, "price": 1}]'))
+        self.assertEqual((stats.created, stats.updated), (1, 1))
+        self.assertEqual(price_cache.get('sku', 1001), Decimal('10.00'))
+        self.assertEqual(Order.objects.get(order_id=4).subtotal, Decimal('70.00'))
+
+        stats = OrderImporter(self.user, batch_size=2).run(BytesIO(
+            b'[{"orderId": 4, "items": [{"sku": 1999, "quantity": 2}]},'
+            b' {"orderId": 6, "discount": "NOPE", "items": []}, {"orderId": "x"}]'
+        ))
+        self.assertEqual((stats.rows, stats.updated, stats.failed), (3, 1, 2))
+        order = Order.objects.get(order_id=4)
+        self.assertIsNone(order.discount)
+        self.assertEqual(list(order.items.values_list('sku', 'quantity')), [(1999, 2)])
+        self.assertEqual(order.total, Decimal('2.00'))
+        call_command('rebuild_order_totals', '--check', stdout=StringIO())
+
+        # Checkout continues after the imported order ids
+        self.assertEqual(Checkout.from_items(self.user, []).order_id, 6)
+
+    def test_import_endpoint(self):
+        """Test the bulk endpoint is admin only and reports its counts"""
+        client = APIClient()
+        body = (TODO_DIR / 'products.json').read_bytes()
+        response = client.post('/api/products/import/', body, content_type='application/json')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+        client.force_authenticate(user=self.user)
+        response = client.post('/api/products/import/', body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['rows'], response.data['created']), (4, 4))
+        self.assertIn('rows_per_second', response.data)
+
+        response = client.post('/api/discounts/import/', b'[{"key": "BAD", "value": 1000}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchWriteAPITest(APITestCase):
+    def setUp(self):
+        """Create an order priced from two products and a discount"""
+        price_cache.clear()
+        self.admin = User.objects.create_user(username='batch', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=self.admin)
+        self.product1 = Product.objects.create(sku=8001, price=Decimal('10.00'))
+        self.product2 = Product.objects.create(sku=8002, price=Decimal('5.00'))
+        self.discount = Discount.objects.create(code='HALF', percentage=Decimal('50.00'))
+        self.order = Checkout.from_items(self.admin, [{'sku': 8001, 'quantity': 2}, {'sku': 8003, 'quantity': 1}])
+
+    def test_requires_admin(self):
+        """Test batch writes are limited to staff"""
+        self.client.force_authenticate(user=User.objects.create_user(username='plain'))
+        response = self.client.post('/api/products/batch/', [{'sku': 1, 'price': '1.00'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_batch_create(self):
+        """Test rows are created together and orders with new SKUs repriced"""
+        rows = [{'sku': 8003 + n, 'price': f'{n + 1}.00'} for n in range(50)]
+        # Validation, insert, one repricing pass and reading back the pks,
+        # however many rows there are
+        with self.assertNumQueries(10):
+            response = self.client.post('/api/products/batch/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row['status'] for row in response.data['results']], ['created'] * 50)
+        self.assertEqual(response.data['results'][0]['data']['sku'], 8003)
+        self.assertIsNotNone(response.data['results'][0]['data']['id'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.subtotal, Decimal('21.00'))
+
+    def test_invalid_rows_reject_the_batch(self):
+        """Test one invalid row means nothing is written, with errors per row"""
+        rows = [{'sku': 9001, 'price': '1.00'}, {'sku': 8001, 'price': '1.00'},
+                {'sku': 9001, 'price': '2.00'}, {'sku': 9002, 'price': 'x'}]
+        response = self.client.post('/api/products/batch/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        results = response.data['results']
+        self.assertEqual([row['status'] for row in results], ['skipped', 'error', 'error', 'error'])
+        self.assertIn('sku', results[1]['errors'])
+        self.assertIn('price', results[3]['errors'])
+        self.assertFalse(Product.objects.filter(sku=9001).exists())
+
+    def test_batch_update_by_sku_and_id(self):
+        """Test a price sync refreshes caches and order totals once"""
+        self.assertEqual(price_cache.get('sku', 8001), Decimal('10.00'))
+        rows = [{'sku': 8001, 'price': '7.50'}, {'id': self.product2.pk, 'price': '1.00'}]
+        response = self.client.patch('/api/products/batch/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['data']['price'] for row in response.data['results']], ['7.50', '1.00'])
+        self.assertEqual(price_cache.get('sku', 8001), Decimal('7.50'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.subtotal, Decimal('15.00'))
+
+        response = self.client.patch('/api/products/batch/', [{'sku': 9999, 'price': '1.00'}, {'price': '1'}],
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['results'][0]['errors']['id'], ['Not found.'])
+
+    def test_batch_delete(self):
+        """Test deleting products and discounts reprices the affected orders once"""
+        self.order.discount = self.discount
+        self.order.save()
+        self.assertEqual(self.order.total, Decimal('10.00'))
+
+        response = self.client.patch('/api/discounts/batch/', [{'code': 'HALF', 'percentage': '25.00'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.discount_amount, Decimal('5.00'))
+
+        response = self.client.delete('/api/discounts/batch/', [self.discount.pk], format='json')
+        self.assertEqual(response.data['results'], [{'status': 'deleted', 'id': self.discount.pk}])
+        response = self.client.delete('/api/products/batch/', [{'sku': 8001}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.subtotal, self.order.total), (Decimal('0.00'), Decimal('0.00')))
+        self.assertIsNone(price_cache.get('sku', 8001))
+        call_command('rebuild_order_totals', '--check', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Asserts on the SQLite query plan format')
+class QueryPlanTest(TestCase):
+    def setUp(self):
+        """Create enough rows that the planner has something to choose from"""
+        self.user = User.objects.create_user(username='planner', password='testpass123')
+        product = Product.objects.create(sku=6001, price=Decimal('1.00'))
+        order = Order.objects.create(order_id=1, user=self.user)
+        OrderItem.objects.create(order=order, sku=6001, quantity=1)
+        CartItem.objects.create(session_key='abc', product=product)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)  # No sort outside the index
+
+    def test_hot_queries_use_indexes(self):
+        """Test the hot filters are answered from the matching indexes"""
+        self.assertUsesIndex(
+            OrderItem.objects.filter(sku__in=[6001, 6002]).values('order_id'),
+            'COVERING INDEX orderitem_sku_order_idx',
+        )
+        # Unique constraints created with the table get SQLite's own index
+        # names; by user, the foreign key index serves as well
+        self.assertUsesIndex(CartItem.objects.filter(session_key='abc'), 'sqlite_autoindex_orders_cartitem_')
+        self.assertUsesIndex(CartItem.objects.filter(user=self.user), 'USING INDEX')
+        self.assertUsesIndex(
+            Order.objects.filter(user=self.user).order_by('-created_at', '-id')[:10], 'order_user_created_idx',
+        )
+
+    def test_unit_prices_join_product_on_sku(self):
+        """Test item prices come from a join on Product's unique sku index"""
+        plan = OrderItem.objects.filter(order__user=self.user).with_unit_prices().explain()
+        self.assertRegex(plan, r'SEARCH (T\d+|orders_product) USING INDEX sqlite_autoindex_orders_product_\d+ \(sku=\?\)')
+        self.assertEqual(OrderItem.objects.with_unit_prices().get().unit_price, Decimal('1.00'))
+
+
+class OrderAdminTest(TestCase):
+    def setUp(self):
+        """Log in as a superuser"""
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_login(self.admin)
+        self.discount = Discount.objects.create(code='ADMIN10', percentage=Decimal('10.00'))
+        for sku in range(5001, 5004):
+            Product.objects.create(sku=sku, price=Decimal(sku - 5000))
+
+    def create_orders(self, count):
+        for n in range(count):
+            items = [{'sku': 5001 + i, 'quantity': n + 1} for i in range(n % 3 + 1)]
+            Checkout.from_items(self.admin, items, discount=self.discount if n % 2 else None)
+
+    def changelist(self, **params):
+        return self.client.get('/admin/orders/order/', params)
+
+    def test_changelist_query_count(self):
+        """Test a 100-row changelist page costs the same queries as a short one"""
+        # Session, user, counts, date hierarchy, list filters and one page of
+        # orders joined to their users
+        self.create_orders(5)
+        with self.assertNumQueries(10):
+            self.changelist()
+        self.create_orders(95)
+        with self.assertNumQueries(10):
+            response = self.changelist()
+        self.assertEqual(len(response.context['cl'].result_list), 100)
+
+    def test_total_columns_sort(self):
+        """Test the total columns sort by the stored totals"""
+        self.create_orders(6)
+        # list_display position 6 is get_total; "-" sorts descending
+        response = self.changelist(o='-6')
+        totals = [order.total for order in response.context['cl'].result_list]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        self.assertContains(response, str(totals[0]))
+
+
+class CartTest(APITestCase):
+    def setUp(self):
+        """Create a user and two products, with no cached cart summaries"""
+        # A test runs in one process, so the local cache stands in for a shared one
+        shared = mock.patch.object(cart_store, 'cache_alias', 'default')
+        shared.start()
+        self.addCleanup(shared.stop)
+        caches[cart_store.cache_alias].clear()
+        price_cache.clear()
+        self.user = User.objects.create_user(username='carter', password='testpass123')
+        self.product1 = Product.objects.create(sku=8001, price=Decimal('2.50'))
+        self.product2 = Product.objects.create(sku=8002, price=Decimal('4.00'))
+
+    def add(self, product, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/cart-items/', {'product': product.pk, 'quantity': quantity})
+
+    def test_one_row_per_product(self):
+        """Test adding a product twice increments one row"""
+        self.client.force_authenticate(user=self.user)
+        self.add(self.product1, 2)
+        response = self.add(self.product1, 3)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.create(user=self.user, product=self.product1)
+
+    def test_summary_maintained_incrementally(self):
+        """Test cart writes adjust the cached subtotal instead of recomputing it"""
+        cart = Cart(user=self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.summary(), {'subtotal': Decimal('0.00'), 'items': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            item = cart.add(self.product1, 2)
+            cart.add(self.product2, 1)
+            cart.set_quantity(item, 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.summary(), {'subtotal': Decimal('14.00'), 'items': 5})
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.remove(item)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.summary(), {'subtotal': Decimal('4.00'), 'items': 1})
+
+    def test_no_shared_cache(self):
+        """Test summaries are summed from the database when no shared cache is configured"""
+        cart = Cart(user=self.user)
+        with mock.patch.object(cart_store, 'cache_alias', None):
+            with self.captureOnCommitCallbacks(execute=True):
+                cart.add(self.product1, 2)
+            for _ in range(2):
+                with self.assertNumQueries(1):
+                    self.assertEqual(cart.summary(), {'subtotal': Decimal('5.00'), 'items': 2})
+            self.product1.price = Decimal('3.00')
+            self.product1.save()
+            self.assertEqual(cart.summary()['subtotal'], Decimal('6.00'))
+        self.assertIsNone(cart_store.get(cart.owner))
+
+    def test_price_change_invalidates_summary(self):
+        """Test a product price change retires cached subtotals"""
+        cart = Cart(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.add(self.product1, 2)
+        self.assertEqual(cart.summary()['subtotal'], Decimal('5.00'))
+        self.product1.price = Decimal('3.00')
+        self.product1.save()
+        self.assertEqual(cart.summary()['subtotal'], Decimal('6.00'))
+
+    def test_session_cart_merged_at_login(self):
+        """Test a session login merges the anonymous cart into the user's"""
+        Cart(user=self.user).add(self.product1, 1)
+        self.add(self.product1, 2)
+        self.add(self.product2, 1)
+        self.assertEqual(CartItem.objects.filter(user__isnull=True).count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='carter', password='testpass123')
+        quantities = dict(CartItem.objects.values_list('product__sku', 'quantity'))
+        self.assertEqual(quantities, {8001: 3, 8002: 1})
+        self.assertFalse(CartItem.objects.filter(user__isnull=True).exists())
+        self.assertEqual(Cart(user=self.user).summary(), {'subtotal': Decimal('11.50'), 'items': 4})
+
+    def test_session_cart_merged_for_token_clients(self):
+        """Test API clients that authenticate per request get the session cart merged too"""
+        self.add(self.product2, 2)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/cart-items/')
+        self.assertEqual(response.data['subtotal'], Decimal('8.00'))
+        self.assertEqual(CartItem.objects.get().user, self.user)
+
+    def test_cart_page_query_count(self):
+        """Test the cart list, summary and coupon cost the same queries for any cart size"""
+        self.client.force_authenticate(user=self.user)
+        discount = Discount.objects.create(code='CART10', percentage=Decimal('10'))
+        discount_registry.get(discount.code)  # Loaded once, not per request
+        for count in (1, 20):
+            for sku in range(9000, 9000 + count):
+                Cart(user=self.user).add(Product.objects.create(sku=sku + count * 100, price=Decimal('1.50')))
+            caches[cart_store.cache_alias].clear()
+            subtotal = Decimal('1.50') * CartItem.objects.filter(user=self.user).count()
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/cart-items/')
+            self.assertEqual(response.data['subtotal'], subtotal)
+            self.assertEqual(len(response.data['cart_items']), CartItem.objects.filter(user=self.user).count())
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/cart-items/')
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/cart-items/summary/').data['subtotal'], subtotal)
+            # apply_coupon is not routed, so call it directly
+            request = APIRequestFactory().post('/', {'code': discount.code})
+            force_authenticate(request, user=self.user)
+            with self.assertNumQueries(0):  # Discount from the registry, subtotal from the cart cache
+                response = apply_coupon(request)
+            self.assertEqual(response.data['discounted_total'], subtotal * Decimal('0.9'))
+
+
+class MergeDuplicateCartItemsTest(TransactionTestCase):
+    def setUp(self):
+        """Drop the one-row-per-product constraints, as on a database from before them"""
+        constraints = CartItem._meta.constraints
+        with mock.patch.object(CartItem._meta, 'constraints', []), connection.schema_editor() as editor:
+            for constraint in constraints:
+                editor.remove_constraint(CartItem, constraint)
+        self.addCleanup(self.restore_constraints, constraints)
+        self.user = User.objects.create_user(username='dupes', password='testpass123')
+        self.products = [Product.objects.create(sku=sku, price=Decimal('1.00')) for sku in (8101, 8102)]
+
+    def restore_constraints(self, constraints):
+        CartItem.objects.all().delete()
+        with connection.schema_editor() as editor:
+            for constraint in constraints:
+                editor.add_constraint(CartItem, constraint)
+
+    def test_quantities_are_added_up(self):
+        """Test duplicate rows of a user's or a session's cart become one"""
+        first, second = self.products
+        rows = [(self.user, None, first, 1), (self.user, None, first, 2), (self.user, None, second, 4),
+                (None, 'abc', first, 3), (None, 'abc', first, 5), (None, 'xyz', first, 7)]
+        for user, session_key, product, quantity in rows:
+            CartItem.objects.create(user=user, session_key=session_key, product=product, quantity=quantity)
+
+        out = StringIO()
+        call_command('merge_duplicate_cart_items', stdout=out)
+        self.assertIn('Merged 2 duplicate cart row(s)', out.getvalue())
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('user__username', 'session_key', 'product__sku', 'quantity'),
+                   key=str),
+            sorted([('dupes', None, 8101, 3), ('dupes', None, 8102, 4),
+                    (None, 'abc', 8101, 8), (None, 'xyz', 8101, 7)], key=str),
+        )
+
+
+class DiscountRegistryTest(TestCase):
+    def setUp(self):
+        """Create a discount and an unloaded registry"""
+        discount_registry.invalidate()
+        self.discount = Discount.objects.create(code='REG15', percentage=Decimal('15.00'))
+
+    def test_lazy_load_and_lookup(self):
+        """Test the registry loads every discount with one query, then answers from memory"""
+        Discount.objects.create(code='REG30', percentage=Decimal('30.00'))
+        with self.assertNumQueries(1):
+            rule = discount_registry.get('REG15')
+        with self.assertNumQueries(0):
+            self.assertEqual(discount_registry.get('REG30').fraction, Decimal('0.3'))
+            self.assertIsNone(discount_registry.get('NOPE'))
+            self.assertEqual(discount_registry.get_pk(self.discount.pk), rule)
+        self.assertEqual(rule.get_discount_amount(Decimal('40.00')), Decimal('6.00'))
+        self.assertEqual(self.discount.get_discount_amount(Decimal('40.00')), Decimal('6.00'))
+
+    def test_invalidated_on_writes(self):
+        """Test saves, deletes and batch writes are seen by the next lookup"""
+        discount_registry.get('REG15')
+        self.discount.percentage = Decimal('20.00')
+        self.discount.save()
+        self.assertEqual(discount_registry.get('REG15').percentage, Decimal('20.00'))
+        self.discount.delete()
+        self.assertIsNone(discount_registry.get('REG15'))
+
+        admin = User.objects.create_superuser(username='registrar', password='testpass123')
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        client.post('/api/discounts/batch/', [{'code': 'NEW5', 'percentage': '5.00'}], format='json')
+        self.assertEqual(discount_registry.get('NEW5').fraction, Decimal('0.05'))
+
+    def test_shared_version_reaches_other_registries(self):
+        """Test an invalidation in one process is seen by another sharing a cache"""
+        caches['default'].clear()
+        mine, theirs = DiscountRegistry(cache_alias='default'), DiscountRegistry(cache_alias='default')
+        theirs.get('REG15')
+        Discount.objects.filter(pk=self.discount.pk).update(percentage=Decimal('25.00'))
+        mine.invalidate()
+        self.assertEqual(theirs.get('REG15').percentage, Decimal('25.00'))
+
+    def test_rescale_fractional_percentages(self):
+        """Test discounts stored as fractions are rescaled to percent and their orders repriced"""
+        user = User.objects.create_user(username='legacy', password='testpass123')
+        Product.objects.create(sku=9102, price=Decimal('10.00'))
+        legacy = Discount.objects.create(code='OLD25', percentage=Decimal('0.25'))
+        order = Checkout.from_items(user, [{'sku': 9102, 'quantity': 2}], discount=legacy)
+        self.assertEqual(order.discount_amount, Decimal('0.05'))
+
+        out = StringIO()
+        call_command('rescale_discount_percentages', '--dry-run', stdout=out)
+        self.assertIn('OLD25: 0.25 -> 25.00', out.getvalue())
+        self.assertEqual(discount_registry.get('OLD25').percentage, Decimal('0.25'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rescale_discount_percentages', stdout=out)
+        self.assertIn('Rescaled 1 discount(s), repriced 1 order(s)', out.getvalue())
+        self.assertEqual(discount_registry.get('OLD25').percentage, Decimal('25.00'))
+        self.assertEqual(discount_registry.get('REG15').percentage, Decimal('15.00'))
+        order.refresh_from_db()
+        self.assertEqual((order.discount_amount, order.total), (Decimal('5.00'), Decimal('15.00')))
+
+    def test_one_rule_everywhere(self):
+        """Test orders, reports and coupons all take the percentage as a share of 100"""
+        user = User.objects.create_user(username='regular', password='testpass123')
+        Product.objects.create(sku=9101, price=Decimal('8.00'))
+        order = Checkout.from_items(user, [{'sku': 9101, 'quantity': 5}], discount=self.discount)
+        self.assertEqual(order.discount_amount, Decimal('6.00'))
+        self.assertEqual(Decimal(OrderCalculator.calculate_order_total(order)['discount_amount']), Decimal('6.00'))
+        line = OrderItem.objects.with_line_totals().get(order=order)
+        self.assertEqual(line.line_discount, Decimal('6.00'))
+
+
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        """Create a user with an order and a cart, signed in with a JWT"""
+        self.user = User.objects.create_user(username='async', password='testpass123')
+        product = Product.objects.create(sku=9201, price=Decimal('3.00'))
+        discount = Discount.objects.create(code='ASYNC10', percentage=Decimal('10.00'))
+        self.order = Checkout.from_items(self.user, [{'sku': 9201, 'quantity': 4}], discount=discount)
+        Cart(user=self.user).add(product, 2)
+        self.client = APIClient()
+        token = self.client.post('/auth/jwt/create/', {'username': 'async', 'password': 'testpass123'}).data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_views_are_async(self):
+        """Test the async endpoints are coroutine functions"""
+        for view in (async_views.product_list, async_views.order_detail,
+                     async_views.order_calculate_total, async_views.cart_summary):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    def test_same_responses_as_sync_endpoints(self):
+        """Test each async endpoint answers exactly like the one it mirrors"""
+        for path in ('products/?page_size=5', f'orders/{self.order.pk}/',
+                     f'orders/{self.order.pk}/calculate_total/', 'cart-items/summary/'):
+            sync_response = self.client.get(f'/api/{path}')
+            async_response = self.client.get(f'/api/async/{path}')
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK, path)
+            self.assertEqual(async_response.content, sync_response.content, path)
+        self.assertEqual(async_response.json()['subtotal'], 6.0)
+
+    def test_authentication_and_lookup(self):
+        """Test the async order endpoints keep the JWT auth and per-user lookup"""
+        other = Checkout.from_items(User.objects.create_user(username='other'), [{'sku': 9201, 'quantity': 1}])
+        self.assertEqual(self.client.get(f'/api/async/orders/{other.pk}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.client.credentials()
+        response = self.client.get(f'/api/async/orders/{self.order.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
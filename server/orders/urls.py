@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import ProductViewSet, DiscountViewSet, OrderItemViewSet, OrderViewSet, CartItemViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet)
@@ -11,4 +12,9 @@ router.register(r'cart-items', CartItemViewSet, basename='cart-item')
 
 urlpatterns = [
     path('', include(router.urls)),
+    # The same responses from async views, for deployments under ASGI
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/orders/<pk>/', async_views.order_detail, name='async-order-detail'),
+    path('async/orders/<pk>/calculate_total/', async_views.order_calculate_total, name='async-order-calculate-total'),
+    path('async/cart-items/summary/', async_views.cart_summary, name='async-cart-summary'),
 ]
\ No newline at end of file
@@ -1,31 +1,93 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from .models import Product, Discount, OrderItem, Order, CartItem
 from .serializers import ProductSerializer, DiscountSerializer, OrderItemSerializer, OrderSerializer, CartItemSerializer
-from .services import OrderCalculator
+from .batch import BatchWriteMixin
+from .cache import price_cache
+from .carts import Cart
+from .discounts import discount_registry
+from .importers import DiscountImporter, OrderImporter, ProductImporter
+from .services import Checkout, EmptyCartError, OrderCalculator, SalesReport
 from django.contrib.auth.decorators import login_required
+from django.utils.dateparse import parse_date
+from django.db.models import Prefetch
 from decimal import Decimal
+from server.pagination import IdKeysetPagination, KeysetPagination
 
-class ProductViewSet(viewsets.ModelViewSet):
+def run_import(request, importer):
+    """
+    Stream a JSON array from the request body (or a multipart ``file``)
+    through ``importer`` and report the row counts and rate.
+    """
+    if request.content_type.startswith('multipart/form-data'):
+        stream = request.FILES.get('file')
+    else:
+        stream = request.stream
+    if stream is None:
+        return Response({'error': 'Expected a JSON array body or a file upload'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        stats = importer.run(stream)
+    except ValueError as e:
+        # Batches written before the error stay imported
+        return Response({'error': f'Invalid JSON: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(stats.as_dict())
+
+class ProductViewSet(BatchWriteMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]  # Allow unauthenticated access
     filterset_fields = ['sku']
     search_fields = ['sku']
     ordering_fields = ['sku', 'price']
+    pagination_class = IdKeysetPagination
+    batch_lookup_field = 'sku'
+
+    def record_batch_changes(self, changes, created=(), updated=(), deleting=()):
+        # New SKUs may be on orders that were priced at zero until now
+        changes.add_products(product.sku for product in created)
+        for product, previous in updated:
+            old_sku = previous.get('sku', product.sku)
+            if old_sku != product.sku or previous.get('price', product.price) != product.price:
+                changes.add_products({product.sku, old_sku}, [product.pk])
+        # Deleted products are recorded by their delete signals
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def price_cache_stats(self, request):
+        """Hit/miss counters of this process's product price cache"""
+        return Response(price_cache.stats())
 
-class DiscountViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def bulk_import(self, request):
+        """Upsert products from ``[{"sku": ..., "price": ...}, ...]``"""
+        return run_import(request, ProductImporter())
+
+class DiscountViewSet(BatchWriteMixin, viewsets.ModelViewSet):
     queryset = Discount.objects.all()
     serializer_class = DiscountSerializer
     permission_classes = [AllowAny] 
     filterset_fields = ['code']
     search_fields = ['code']
     ordering_fields = ['code', 'percentage']
+    batch_lookup_field = 'code'
+
+    def record_batch_changes(self, changes, created=(), updated=(), deleting=()):
+        discount_registry.invalidate_on_commit()
+        # New discounts are on no order yet
+        repriced = [
+            discount.pk for discount, previous in updated
+            if previous.get('percentage', discount.percentage) != discount.percentage
+        ]
+        changes.add_discounts(repriced + [discount.pk for discount in deleting])
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def bulk_import(self, request):
+        """Upsert discounts from ``[{"key": ..., "value": ...}, ...]``"""
+        return run_import(request, DiscountImporter())
 
 class OrderItemViewSet(viewsets.ModelViewSet):
-    queryset = OrderItem.objects.all()
+    queryset = OrderItem.objects.with_unit_prices()
     serializer_class = OrderItemSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -35,12 +97,16 @@ class OrderViewSet(viewsets.ModelViewSet):
     filterset_fields = ['status', 'order_id']
     search_fields = ['order_id']
     ordering_fields = ['created_at', 'order_id']
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
-
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # Items come with their unit price and totals are stored on the order,
+        # so serializing a page costs the same few queries however big it is
+        return Order.objects.filter(user=self.request.user).select_related(
+            'discount', 'user'
+        ).prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.with_unit_prices())
+        )
 
     @action(detail=True, methods=['get'])
     def calculate_total(self, request, pk=None):
@@ -50,74 +116,85 @@ class OrderViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def sales_summary(self, request):
+        """
+        Sales totals computed in the database.
+
+        Optional query params: ``start`` / ``end`` (YYYY-MM-DD, inclusive),
+        ``status`` (comma separated) and ``bucket`` (``day`` or ``week``)
+        to include a time series.
+        """
         orders = Order.objects.all()
-        total_sales = sum(
-            float(OrderCalculator.calculate_order_total(order)['total']) 
-            for order in orders
-        )
-        return Response({
-            'total_orders': orders.count(),
-            'total_sales': str(total_sales)
-        })
 
-    def create(self, request, *args, **kwargs):
-        cart_items = CartItem.objects.filter(user=request.user)
-        if not cart_items.exists():
-            return Response({"message": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Create the order
-        order_data = request.data.copy()
-        order_data['user'] = request.user.id
-        order_data['order_id'] = Order.objects.count() + 1
-        serializer = self.get_serializer(data=order_data)
-        serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+        for param, lookup in (('start', 'created_at__date__gte'), ('end', 'created_at__date__lte')):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    date = parse_date(value)
+                except ValueError:  # Well formed but impossible, e.g. 2025-02-30
+                    date = None
+                if date is None:
+                    return Response({'error': f'Invalid {param} date, expected YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+                orders = orders.filter(**{lookup: date})
 
-        # Create order items from cart items
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                sku=cart_item.product.sku,
-                quantity=cart_item.quantity
-            )
+        statuses = request.query_params.get('status')
+        if statuses:
+            orders = orders.filter(status__in=statuses.split(','))
 
-        # Clear the cart
-        cart_items.delete()
+        bucket = request.query_params.get('bucket')
+        if bucket and bucket not in SalesReport.BUCKETS:
+            return Response({'error': f'Invalid bucket, expected one of {sorted(SalesReport.BUCKETS)}'}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(SalesReport(orders).summarize(bucket))
 
-class CartItemViewSet(viewsets.ModelViewSet):
-    serializer_class = CartItemSerializer
-    # Removed default permission_classes
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def bulk_import(self, request):
+        """Upsert orders from ``[{"orderId": ..., "discount": ..., "items": [...]}, ...]``, owned by the caller"""
+        return run_import(request, OrderImporter(request.user))
 
-    def get_permissions(self):
+    def create(self, request, *args, **kwargs):
         """
-        Instantiates and returns the list of permissions that this view requires.
+        Create an order from the explicit ``items`` in the payload or, when
+        none are given, by checking out the user's cart.
         """
-        if self.action in ['list', 'retrieve', 'summary']:
-            permission_classes = [AllowAny]
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if serializer.validated_data.get('items'):
+            order = serializer.save(user=request.user)
         else:
-            permission_classes = [IsAuthenticated]
-        return [permission() for permission in permission_classes]
+            order_fields = {key: value for key, value in serializer.validated_data.items() if key != 'items'}
+            try:
+                order = Checkout.from_cart(request.user, **order_fields)
+            except EmptyCartError:
+                return Response({"message": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Reload through get_queryset so the response uses the prefetched items
+        order = self.get_queryset().get(pk=order.pk)
+        return Response(self.get_serializer(order).data, status=status.HTTP_201_CREATED)
 
+class CartItemViewSet(viewsets.ModelViewSet):
+    """
+    The requesting user's cart or, for anonymous visitors, their session's.
+    Anonymous carts are merged into the user's cart once they sign in.
+    """
+    serializer_class = CartItemSerializer
+    permission_classes = [AllowAny]
+
+    def get_cart(self, create=False):
+        return Cart.for_request(self.request, create=create)
 
     def get_queryset(self):
-        # For authenticated users, filter by user
-        if self.request.user.is_authenticated:
-            return CartItem.objects.filter(user=self.request.user)
-        else:
-            # For anonymous users, attempt to filter by session key (or other identifier)
-            session_key = self.request.session.session_key
-            if session_key:
-                return CartItem.objects.filter(session_key=session_key)
-            else:
-                return CartItem.objects.none()  # Or handle the case where there's no session
+        cart = self.get_cart()
+        return cart.items() if cart else CartItem.objects.none()
 
     def list(self, request):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        subtotal = sum(item['total'] for item in serializer.data)
-        return Response({'cart_items': serializer.data, 'subtotal': subtotal})
+        # One query for the items with their products and, unless cached,
+        # one aggregate for the subtotal, however big the cart
+        cart = self.get_cart()
+        if cart is None:
+            return Response({'cart_items': [], 'subtotal': Decimal('0.00')})
+        serializer = self.get_serializer(cart.items(), many=True)
+        return Response({'cart_items': serializer.data, 'subtotal': cart.summary()['subtotal']})
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -126,40 +203,33 @@ class CartItemViewSet(viewsets.ModelViewSet):
         product_id = request.data.get('product')
         try:
             product = Product.objects.get(pk=product_id)
-        except Product.DoesNotExist:
+        except (Product.DoesNotExist, ValueError, TypeError):
             return Response({'error': 'Product not found'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # For authenticated users, save with user
-        if self.request.user.is_authenticated:
-            serializer.save(user=self.request.user, product=product)
-        else:
-            # For anonymous users, save with session key (or other identifier)
-            session_key = self.request.session.session_key
-            if not session_key:
-                self.request.session.create()
-                session_key = self.request.session.session_key
-            serializer.save(session_key=session_key, product=product)
-
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Adding a product already in the cart raises its quantity
+        item = self.get_cart(create=True).add(product, serializer.validated_data.get('quantity', 1))
+        return Response(self.get_serializer(item).data, status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data)
+        if 'quantity' in serializer.validated_data:
+            self.get_cart().set_quantity(instance, serializer.validated_data['quantity'])
+        return Response(self.get_serializer(instance).data)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.delete()
+        self.get_cart().remove(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        cart_items = self.get_queryset()
-        subtotal = sum(item.get_total() for item in cart_items)
-        return Response({'subtotal': subtotal})
+        cart = self.get_cart()
+        if cart is None:
+            return Response({'subtotal': Decimal('0.00'), 'items': 0})
+        return Response(cart.summary())
 
 @api_view(['POST'])
 @login_required # Ensure only logged-in users can add items
@@ -172,7 +242,7 @@ def create_cart_item(request):
 
     try:
         product = Product.objects.get(pk=product_id)
-        cart_item = CartItem.objects.create(user=request.user, product=product, quantity=quantity)
+        Cart(user=request.user).add(product, int(quantity))
         return Response({'message': 'Item added to cart'}, status=status.HTTP_201_CREATED)
     except Product.DoesNotExist:
         return Response({'error': 'Product not found'}, status=status.HTTP_400_BAD_REQUEST)
@@ -185,15 +255,12 @@ def create_cart_item(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def apply_coupon(request):
-    coupon_code = request.data.get('code')
-    try:
-        discount = Discount.objects.get(code=coupon_code)
-    except Discount.DoesNotExist:
+    discount = discount_registry.get(request.data.get('code'))
+    if discount is None:
         return Response({'error': 'Invalid coupon code'}, status=status.HTTP_400_BAD_REQUEST)
 
-    cart_items = CartItem.objects.filter(user=request.user)
-    subtotal = sum(item.get_total() for item in cart_items)
-    discount_amount = subtotal * (discount.percentage / 100)
+    subtotal = Cart(user=request.user).summary()['subtotal']
+    discount_amount = discount.get_discount_amount(subtotal)
     discounted_total = subtotal - discount_amount
 
     return Response({'discounted_total': discounted_total}, status=status.HTTP_200_OK)
@@ -0,0 +1,120 @@
+import os
+import mimetypes
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from invoice.downloads import parse_byte_range
+
+DEFAULTS = {
+    # None serves from Django, 'x-accel' hands off to nginx, 'x-sendfile' to Apache/lighttpd
+    'BACKEND': None,
+    # nginx ``internal`` location aliased to MEDIA_ROOT
+    'ACCEL_PREFIX': '/protected-media/',
+}
+BACKENDS = (None, 'x-accel', 'x-sendfile')
+
+
+def media_options():
+    options = {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+    if options['BACKEND'] not in BACKENDS:
+        raise ValueError(f"MEDIA_SERVING['BACKEND'] must be one of {BACKENDS}")
+    return options
+
+
+class RangeFile:
+    """
+    The ``length`` bytes of ``source`` from its current position.
+
+    It has no ``fileno`` on purpose: a WSGI file wrapper would otherwise
+    sendfile() to the end of the file rather than the end of the range.
+    """
+
+    def __init__(self, source, length):
+        self.source = source
+        self.remaining = length
+        self.name = source.name
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        block = self.source.read(size)
+        self.remaining -= len(block)
+        return block
+
+    def close(self):
+        self.source.close()
+
+
+def serve_media(request, path):
+    """
+    Serve a file under MEDIA_ROOT.
+
+    With a proxy backend configured only the headers are produced and the
+    front server sends the file, so no worker is held for the transfer.
+    Otherwise the file goes out as a FileResponse, which WSGI servers send
+    with sendfile(), answering conditional and single-range requests.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    options = media_options()
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if options['BACKEND'] == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = options['ACCEL_PREFIX'].rstrip('/') + '/' + quote(path.lstrip('/'))
+        return response
+    if options['BACKEND'] == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+
+    etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    # A stale If-Range validator means the client's partial copy is outdated
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+    if not if_range or if_range in (etag, http_date(last_modified)):
+        try:
+            byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    source = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(source, content_type=content_type)
+    else:
+        start, end = byte_range
+        source.seek(start)
+        # Ranges running to the end of the file ("resume from") keep sendfile()
+        body = source if end == stat.st_size - 1 else RangeFile(source, end - start + 1)
+        response = FileResponse(body, status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,53 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination, newest first by ``created_at`` with ``id`` breaking ties.
+
+    Each page is a range read from an index on the ordering columns, so it
+    costs the same however deep into the list it is, and no COUNT(*) is run.
+    Passing ``?page=N`` opts back into numbered pages (with a count) for
+    clients that need to jump to an arbitrary page.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    page_number_query_param = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_numbers = None
+        if self.page_number_query_param in request.query_params:
+            self.page_numbers = PageNumberPagination()
+            queryset = queryset.order_by(*self.get_ordering(request, queryset, view))
+            return self.page_numbers.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # ?ordering= from an OrderingFilter wins; unlike the base class, a
+        # view without a default ordering falls back to ``ordering`` here
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = tuple(ordering or self.ordering)
+        # A unique last column makes the order, and so every page, deterministic
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
+    def get_paginated_response(self, data):
+        if self.page_numbers is not None:
+            return self.page_numbers.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.page_numbers is not None:
+            return self.page_numbers.to_html()
+        return super().to_html()
+
+
+class IdKeysetPagination(KeysetPagination):
+    """KeysetPagination for models without a ``created_at``, in insertion order"""
+    ordering = ('id',)
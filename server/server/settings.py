@@ -101,6 +101,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# With REDIS_URL set, every worker process shares one cache; otherwise each
+# process has its own in-memory cache.
+
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -174,15 +189,61 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How /media/ is served: BACKEND None streams from Django, 'x-accel' hands the
+# file to nginx via an internal location at ACCEL_PREFIX, 'x-sendfile' to Apache
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get("MEDIA_SENDFILE_BACKEND") or None,
+    'ACCEL_PREFIX': os.environ.get("MEDIA_ACCEL_PREFIX", '/protected-media/'),
+}
+
 
 
 # Important for serving files
 FILE_UPLOAD_PERMISSIONS = 0o644
+
+# Number of processes used to render invoice PDFs (1 renders in-process)
+INVOICE_PDF_WORKERS = int(os.environ.get("INVOICE_PDF_WORKERS", 1))
+
+# Attempts per invoice job before failed accounts are given up on
+INVOICE_JOB_MAX_ATTEMPTS = int(os.environ.get("INVOICE_JOB_MAX_ATTEMPTS", 3))
+
+# Seconds a running invoice job may go without a heartbeat before it is requeued
+INVOICE_JOB_LEASE = int(os.environ.get("INVOICE_JOB_LEASE", 600))
+
+# Parsed invoice uploads, memory-mapped on reuse. Keep DIR outside MEDIA_ROOT,
+# which is served publicly, and shared by the server and the invoice worker.
+INVOICE_UPLOAD_CACHE = {
+    'DIR': os.environ.get("INVOICE_UPLOAD_CACHE_DIR", os.path.join(BASE_DIR, 'var', 'parsed_uploads')),
+    'MAX_BYTES': int(os.environ.get("INVOICE_UPLOAD_CACHE_MAX_BYTES", 2 * 1024 ** 3)),
+}
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Product price cache used by orders pricing (see orders/cache.py)
+PRICE_CACHE = {
+    "MAX_SIZE": int(os.environ.get("PRICE_CACHE_MAX_SIZE", 10000)),
+    "TTL": int(os.environ.get("PRICE_CACHE_TTL", 300)),
+    # Name of a CACHES alias to share prices between processes, or None
+    "CACHE_ALIAS": os.environ.get("PRICE_CACHE_ALIAS") or None,
+}
+
+# Cart subtotals are kept in this CACHES alias, which must be shared by all
+# workers; with no shared cache (None) they are summed from the database on
+# every read. The database stays authoritative either way.
+CART_CACHE = {
+    "CACHE_ALIAS": os.environ.get("CART_CACHE_ALIAS") or ("default" if REDIS_URL else None),
+    "TTL": int(os.environ.get("CART_CACHE_TTL", 3600)),
+}
+
+# Discount codes held in memory for coupons and pricing (see orders/discounts.py)
+DISCOUNT_REGISTRY = {
+    "TTL": int(os.environ.get("DISCOUNT_REGISTRY_TTL", 60)),
+    # Name of a CACHES alias that tells every worker about discount writes, or None
+    "CACHE_ALIAS": os.environ.get("DISCOUNT_REGISTRY_ALIAS") or None,
+}
+
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
@@ -7,7 +7,7 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from django.conf import settings
 from django.conf.urls.static import static
-from django.views.static import serve
+from .media import serve_media
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -46,9 +46,7 @@ urlpatterns += [
     path('api/crm/', include('crm.urls')),
     path('api/invoice/', include('invoice.urls')),
     # Media serving - add this before the static pattern
-    path('media/<path:path>', serve, {
-        'document_root': settings.MEDIA_ROOT,
-    }, name='media'),
+    path('media/<path:path>', serve_media, name='media'),
 ]
 
 # Add static and media patterns for development
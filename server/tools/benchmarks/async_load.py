@@ -0,0 +1,172 @@
+"""
+Load test of the read-heavy endpoints: gunicorn sync workers (server.wsgi)
+versus gunicorn with uvicorn workers (server.asgi) serving /api/async/.
+
+Both servers get the same number of workers and a fresh SQLite database
+seeded with products, orders and a cart. Each endpoint is then hit by
+--concurrency clients for --seconds, and the latency percentiles and
+throughput are reported. The ASGI rows need uvicorn (see requirements.txt).
+
+Usage (from the server directory):
+    python tools/benchmarks/async_load.py --workers 5 --concurrency 50 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+# Seed and serve a throwaway SQLite file rather than the configured database
+WORKDIR = tempfile.mkdtemp(prefix='async_load_')
+os.environ.update({'DB_ENGINE': 'django.db.backends.sqlite3', 'POSTGRES_DB': os.path.join(WORKDIR, 'db.sqlite3')})
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+from orders.carts import Cart  # noqa: E402
+from orders.models import Discount, Product  # noqa: E402
+from orders.services import Checkout  # noqa: E402
+
+SERVERS = {
+    # name: (gunicorn arguments, URL prefix)
+    'wsgi': (['server.wsgi'], '/api/'),
+    'asgi': (['-k', 'uvicorn.workers.UvicornWorker', 'server.asgi'], '/api/async/'),
+}
+
+
+def seed(products, orders, items):
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    user = User.objects.create_user('bench')
+    Product.objects.bulk_create(Product(sku=sku, price=Decimal(sku % 100) + Decimal('0.99'))
+                                for sku in range(1000, 1000 + products))
+    discount = Discount.objects.create(code='BENCH10', percentage=Decimal('10.00'))
+    for n in range(orders):
+        lines = [{'sku': 1000 + (n * items + i) % products, 'quantity': i + 1} for i in range(items)]
+        order = Checkout.from_items(user, lines, discount=discount if n % 2 else None)
+    cart = Cart(user=user)
+    for product in Product.objects.all()[:items]:
+        cart.add(product, 2)
+    return str(AccessToken.for_user(user)), order.pk
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers, arguments):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--chdir', SERVER_DIR, '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--log-level', 'warning', *arguments],
+        env=os.environ.copy(),
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with {process.returncode}')
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+async def fetch(port, request):
+    """One request on a fresh connection (sync workers do not keep connections alive)"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return response[9:12] == b'200'
+
+
+async def load(port, path, token, concurrency, seconds):
+    request = (f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n'
+               f'Connection: close\r\n\r\n').encode()
+    latencies, errors = [], 0
+    await fetch(port, request)  # Warm up the worker that takes it
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = await fetch(port, request)
+            except OSError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=5, help='gunicorn workers for both servers')
+    parser.add_argument('--concurrency', type=int, default=50, help='clients in flight')
+    parser.add_argument('--seconds', type=float, default=10, help='per endpoint and server')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--items', type=int, default=5, help='items per order and in the cart')
+    parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    args = parser.parse_args()
+
+    token, order_pk = seed(args.products, args.orders, args.items)
+    endpoints = {
+        'product list': 'products/?page_size=20',
+        'order retrieve': f'orders/{order_pk}/',
+        'calculate_total': f'orders/{order_pk}/calculate_total/',
+        'cart summary': 'cart-items/summary/',
+    }
+
+    print(f"{args.workers} workers per server, {args.concurrency} clients, {args.seconds:g}s per endpoint")
+    print(f"{'endpoint':<16} {'server':<6} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for server in args.servers:
+        arguments, prefix = SERVERS[server]
+        port = free_port()
+        try:
+            process = start_server(port, args.workers, arguments)
+        except RuntimeError as e:
+            print(f"{server}: {e} (is uvicorn installed?)" if server == 'asgi' else f"{server}: {e}")
+            continue
+        try:
+            for name, path in endpoints.items():
+                latencies, errors, elapsed = asyncio.run(
+                    load(port, prefix + path, token, args.concurrency, args.seconds)
+                )
+                print(f"{name:<16} {server:<6} {len(latencies):>9} {len(latencies) / elapsed:>8.0f} "
+                      f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+                      f"{errors:>7}")
+        finally:
+            process.terminate()
+            process.wait()
+    shutil.rmtree(WORKDIR)
+
+
+if __name__ == '__main__':
+    main()
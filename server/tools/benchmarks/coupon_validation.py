@@ -0,0 +1,96 @@
+"""
+Coupon validation throughput: discount lookups and apply_coupon calls per second.
+
+Compares looking each code up in the Discount table (and pricing the cart
+item by item, as apply_coupon used to) with the in-memory discount
+registry and the cached cart subtotal. A share of the codes tried are
+invalid, as during a promotion. Runs against a throwaway test database.
+
+Usage (from the server directory):
+    python tools/benchmarks/coupon_validation.py --codes 1000 --calls 20000 --cart-items 10
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+from orders.carts import Cart  # noqa: E402
+from orders.discounts import discount_registry  # noqa: E402
+from orders.models import CartItem, Discount, Product  # noqa: E402
+from orders.views import apply_coupon  # noqa: E402
+
+
+def database_lookup(user, code):
+    try:
+        discount = Discount.objects.get(code=code)
+    except Discount.DoesNotExist:
+        return None
+    subtotal = sum(item.get_total() for item in CartItem.objects.filter(user=user))
+    return subtotal - subtotal * (discount.percentage / 100)
+
+
+def registry_lookup(user, code):
+    discount = discount_registry.get(code)
+    if discount is None:
+        return None
+    subtotal = Cart(user=user).summary()['subtotal']
+    return subtotal - discount.get_discount_amount(subtotal)
+
+
+def view_call(user, code, factory=APIRequestFactory()):
+    request = factory.post('/api/apply-coupon/', {'code': code}, format='json')
+    force_authenticate(request, user=user)
+    return apply_coupon(request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--codes', type=int, default=1000, help='discount codes in the table')
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--cart-items', type=int, default=10)
+    parser.add_argument('--invalid-share', type=float, default=0.2, help='share of calls with an unknown code')
+    args = parser.parse_args()
+
+    connection.creation.create_test_db(verbosity=0)
+    user = User.objects.create_user('bench')
+    Discount.objects.bulk_create(
+        Discount(code=f'C{n:06d}', percentage=Decimal(n % 50 + 5)) for n in range(args.codes)
+    )
+    cart = Cart(user=user)
+    for sku in range(args.cart_items):
+        cart.add(Product.objects.create(sku=sku + 1000, price=Decimal('9.99')), quantity=2)
+
+    rng = random.Random(0)
+    codes = [
+        f'X{n:06d}' if rng.random() < args.invalid_share else f'C{rng.randrange(args.codes):06d}'
+        for n in range(args.calls)
+    ]
+    print(f"{args.calls} calls, {args.codes} codes, {args.cart_items} cart items, "
+          f"{args.invalid_share:.0%} invalid")
+    print(f"{'mode':<22} {'seconds':>8} {'calls/s':>10} {'queries':>8}")
+    for name, run in (('database', database_lookup), ('registry', registry_lookup),
+                      ('apply_coupon view', view_call)):
+        discount_registry.invalidate()
+        queries = []
+        with connection.execute_wrapper(lambda execute, *params: queries.append(1) or execute(*params)):
+            started = time.perf_counter()
+            for code in codes:
+                run(user, code)
+            seconds = time.perf_counter() - started
+        queries = len(queries)
+        print(f"{name:<22} {seconds:>8.2f} {args.calls / seconds:>10.0f} {queries:>8}")
+
+
+if __name__ == '__main__':
+    main()
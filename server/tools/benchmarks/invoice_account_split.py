@@ -0,0 +1,75 @@
+"""
+Per-account splitting of a CDR frame: boolean mask per account versus one groupby.
+
+The mask approach scans every row once per account (O(accounts x rows)), so
+for large inputs only the first ``--mask-sample`` accounts are timed and the
+rest is extrapolated.
+
+Usage (from the server directory):
+    python tools/benchmarks/invoice_account_split.py --sizes 100000:1000 1000000:10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from invoice.utils import account_totals, split_accounts  # noqa: E402
+
+
+def synthetic_cdr(rows, accounts, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Account id': pd.Series(rng.integers(0, accounts, rows)).map(lambda n: f'client{n}'),
+        'Area prefix': rng.integers(100, 99999, rows),
+        'Area name': 'Area',
+        'Total duration': rng.integers(1, 100000, rows),
+        'Call charges': rng.random(rows) * 100,
+    })
+
+
+def masks(data, sample):
+    """The previous approach: one boolean mask, copy and sum per account"""
+    account_ids = data['Account id'].unique()
+    start = time.perf_counter()
+    for account_id in account_ids[:sample]:
+        account_data = data[data['Account id'] == account_id].copy()
+        account_data['Call charges'].round(2).sum()
+    elapsed = time.perf_counter() - start
+    return elapsed * len(account_ids) / min(sample, len(account_ids))
+
+
+def groupby(data):
+    start = time.perf_counter()
+    split_accounts(data)
+    account_totals(data)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['10000:100', '100000:1000', '1000000:10000'],
+                        help='rows:accounts pairs')
+    parser.add_argument('--mask-sample', type=int, default=500,
+                        help='accounts timed for the mask approach before extrapolating')
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'accounts':>9} {'masks (s)':>10} {'groupby (s)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        rows, accounts = (int(part) for part in size.split(':'))
+        data = synthetic_cdr(rows, accounts)
+        mask_seconds = masks(data, args.mask_sample)
+        groupby_seconds = groupby(data)
+        print(f"{rows:>9} {accounts:>9} {mask_seconds:>10.2f} {groupby_seconds:>12.2f} "
+              f"{mask_seconds / groupby_seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+InvoicePDF.add_table: row-by-row iterrows rendering versus precomputed cell strings.
+
+Usage (from the server directory):
+    python tools/benchmarks/invoice_add_table.py --rows 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from invoice.utils import InvoicePDF  # noqa: E402
+
+
+class IterrowsInvoicePDF(InvoicePDF):
+    """The previous add_table, kept here for comparison"""
+
+    def add_table(self, data, sub_total=None):
+        self.set_fill_color(240, 240, 240)
+        self.set_font('Arial', 'B', 10)
+        cols = [('SN', 15), ('Area Prefix', 30), ('Area Name', 60),
+                ('Duration', 40), ('Charge', 40)]
+        for title, width in cols:
+            self.cell(width, 10, title, 1, 0, 'C', True)
+        self.ln()
+
+        self.set_font('Arial', '', 9)
+        total_charges = 0
+        for idx, row in data.iterrows():
+            duration = row['Total duration'] / 60
+            total_charges += row['Call charges']
+            self.cell(15, 8, str(idx + 1), 1, 0, 'C')
+            self.cell(30, 8, str(row['Area prefix']), 1, 0, 'C')
+            self.cell(60, 8, str(row['Area name']), 1, 0, 'L')
+            self.cell(40, 8, f"{duration:.2f} min", 1, 0, 'R')
+            self.cell(40, 8, f"${row['Call charges']:.2f}", 1, 1, 'R')
+
+        self.ln(5)
+        self.set_font('Arial', 'B', 10)
+        tax = total_charges * 0.10
+        self.cell(145, 8, 'Sub Total:', 0, 0, 'R')
+        self.cell(40, 8, f"${total_charges:.2f}", 0, 1, 'R')
+        self.cell(145, 8, 'Tax (10%):', 0, 0, 'R')
+        self.cell(40, 8, f"${tax:.2f}", 0, 1, 'R')
+        self.set_font('Arial', 'B', 12)
+        self.cell(145, 10, 'Total:', 0, 0, 'R')
+        self.cell(40, 10, f"${(total_charges + tax):.2f}", 0, 1, 'R')
+
+
+def table_data(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Area prefix': rng.integers(100, 99999, rows),
+        'Area name': 'Area',
+        'Total duration': rng.integers(1, 100000, rows).round(2),
+        'Call charges': (rng.random(rows) * 100).round(2),
+    })
+
+
+def time_add_table(pdf_class, data, repeat):
+    best = None
+    for _ in range(repeat):
+        pdf = pdf_class()
+        pdf.add_page()
+        start = time.perf_counter()
+        pdf.add_table(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>7} {'iterrows (s)':>13} {'cells (s)':>10} {'speedup':>8}")
+    for rows in args.rows:
+        data = table_data(rows)
+        before = time_add_table(IterrowsInvoicePDF, data, args.repeat)
+        after = time_add_table(InvoicePDF, data, args.repeat)
+        print(f"{rows:>7} {before:>13.3f} {after:>10.3f} {before / after:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
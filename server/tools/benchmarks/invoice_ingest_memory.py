@@ -0,0 +1,113 @@
+"""
+Peak RSS of invoice upload ingestion: reading the whole file with pandas
+versus the streaming readers in invoice.readers.
+
+Each measurement runs in a fresh subprocess so peak RSS is not shared.
+
+Usage (from the server directory):
+    python tools/benchmarks/invoice_ingest_memory.py --rows 200000 --accounts 2000 --formats csv xlsx
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from invoice.cache import AccountPartitions, ParsedUploadCache  # noqa: E402
+from invoice.readers import read_header  # noqa: E402
+
+MODES = {
+    'startup': 'nothing read; interpreter, Django and pandas only',
+    'full-read': 'pd.read_csv / pd.read_excel of the whole file (previous validation and generation)',
+    'header': 'read_header (validation)',
+    'partitions': 'AccountPartitions on a cold upload cache: parse once, then every partition (generation)',
+    'cached': 'AccountPartitions again, memory-mapping the parsed upload (regeneration)',
+}
+
+
+def write_cdr(path, rows, accounts, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'Account id': pd.Series(rng.integers(0, accounts, rows)).map(lambda n: f'client{n}'),
+        'Area prefix': rng.integers(100, 99999, rows),
+        'Area name': 'Area',
+        'Total duration': rng.integers(1, 100000, rows),
+        'Call charges': (rng.random(rows) * 100).round(4),
+    })
+    if path.endswith('.csv'):
+        data.to_csv(path, index=False)
+    else:
+        data.to_excel(path, index=False)
+
+
+def measure(mode, path):
+    """Runs inside the subprocess"""
+    start = time.perf_counter()
+    if mode == 'startup':
+        pass
+    elif mode == 'full-read':
+        (pd.read_csv if path.endswith('.csv') else pd.read_excel)(path)
+    elif mode == 'header':
+        read_header(path)
+    else:
+        cache = ParsedUploadCache(path + '.parsed')
+        with AccountPartitions(path, cache=cache) as partitions:
+            for _ in partitions:
+                pass
+    elapsed = time.perf_counter() - start
+    print(f"{peak_rss_mb():.1f} {elapsed:.2f}")
+
+
+def peak_rss_mb():
+    # ru_maxrss survives exec on Linux, so it would include the parent's
+    # peak; VmHWM belongs to this process image only
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--accounts', type=int, default=2000)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'xlsx'])
+    parser.add_argument('--measure', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    print(f"{args.rows} rows, {args.accounts} accounts")
+    print('\n'.join(f"  {mode}: {description}" for mode, description in MODES.items()))
+    print(f"{'format':>6} {'file MB':>8} {'mode':>11} {'peak RSS MB':>12} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fmt in args.formats:
+            path = os.path.join(tmp_dir, f'cdr.{fmt}')
+            write_cdr(path, args.rows, args.accounts)
+            size = os.path.getsize(path) / 2 ** 20
+            for mode in MODES:
+                output = subprocess.run(
+                    [sys.executable, __file__, '--measure', mode, path],
+                    capture_output=True, text=True, check=True,
+                ).stdout.split()
+                print(f"{fmt:>6} {size:>8.1f} {mode:>11} {float(output[0]):>12.1f} {float(output[1]):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
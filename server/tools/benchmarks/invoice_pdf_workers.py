@@ -0,0 +1,64 @@
+"""
+Invoice PDF rendering throughput versus number of worker processes.
+
+Usage (from the server directory):
+    python tools/benchmarks/invoice_pdf_workers.py --accounts 500 --rows 40 --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from invoice.utils import invoice_context, render_invoice_pdfs  # noqa: E402
+
+
+def synthetic_cdr(accounts, rows_per_account, seed=0):
+    rng = np.random.default_rng(seed)
+    size = accounts * rows_per_account
+    return pd.DataFrame({
+        'Account id': rng.integers(0, accounts, size).astype(str),
+        'Area prefix': rng.integers(100, 99999, size),
+        'Area name': 'Area',
+        'Total duration': rng.integers(1, 100000, size),
+        'Call charges': rng.random(size) * 100,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=40, help='rows per account')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    data = synthetic_cdr(args.accounts, args.rows)
+    invoice = SimpleNamespace(from_company='Provider', to_company='Client', gmt='+00:00',
+                              billing_date=date(2025, 2, 1))
+    context = invoice_context(invoice, issued_at=datetime(2025, 3, 1))
+    accounts = data['Account id'].nunique()
+    print(f"{len(data)} rows, {accounts} accounts, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'seconds':>9} {'accounts/s':>11} {'speedup':>8}")
+
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = time.perf_counter()
+            render_invoice_pdfs(data, {**context, 'output_dir': output_dir}, workers)
+            elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {accounts / elapsed:>11.1f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
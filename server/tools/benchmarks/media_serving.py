@@ -0,0 +1,130 @@
+"""
+Media download throughput: django.views.static.serve versus server.media.serve_media.
+
+A gunicorn server is started for each mode and a pool of client threads
+downloads the same file repeatedly. "x-accel" only measures the hand-off
+response, which is all a worker does when nginx sends the file.
+
+Usage (from the server directory):
+    python tools/benchmarks/media_serving.py --size-mb 5 --requests 400 --concurrency 8
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.urls import path  # noqa: E402
+from django.views.static import serve  # noqa: E402
+from server.media import serve_media  # noqa: E402
+
+# gunicorn imports this module as the app, with only the two media views routed
+settings.ROOT_URLCONF = __name__
+if 'BENCHMARK_MEDIA_ROOT' in os.environ:
+    settings.MEDIA_ROOT = os.environ['BENCHMARK_MEDIA_ROOT']
+urlpatterns = [
+    path('static-serve/<path:path>', serve, {'document_root': settings.MEDIA_ROOT}),
+    path('media/<path:path>', serve_media),
+]
+if __name__ != '__main__':
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+MODES = {
+    # name: (url prefix, extra request headers, MEDIA_SENDFILE_BACKEND)
+    'static.serve': ('/static-serve/', {}, ''),
+    'serve_media': ('/media/', {}, ''),
+    'serve_media range': ('/media/', {'Range': 'bytes=1024-'}, ''),
+    'x-accel': ('/media/', {}, 'x-accel'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers, media_root, backend):
+    env = {**os.environ, 'MEDIA_SENDFILE_BACKEND': backend, 'BENCHMARK_MEDIA_ROOT': media_root}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--chdir', os.path.dirname(os.path.abspath(__file__)),
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning',
+         'media_serving:application'],
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def fetch(port, url, headers):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        connection.request('GET', url, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status not in (200, 206):
+            raise RuntimeError(f'{url}: HTTP {response.status}')
+        return len(body)
+    finally:
+        connection.close()
+
+
+def run(port, url, headers, requests, concurrency):
+    fetch(port, url, headers)  # Warm up imports and the page cache
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        sent = sum(pool.map(lambda _: fetch(port, url, headers), range(requests)))
+    return time.perf_counter() - start, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=5)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn sync workers')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as media_root:
+        with open(os.path.join(media_root, 'Invoice_bench.pdf'), 'wb') as pdf_file:
+            pdf_file.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+
+        print(f"{args.size_mb} MB file, {args.requests} requests, {args.concurrency} clients, "
+              f"{args.workers} gunicorn workers")
+        print(f"{'mode':<18} {'seconds':>8} {'req/s':>8} {'MB/s':>9}")
+        for mode in args.modes:
+            prefix, headers, backend = MODES[mode]
+            port = free_port()
+            server = start_server(port, args.workers, media_root, backend)
+            try:
+                elapsed, sent = run(port, prefix + 'Invoice_bench.pdf', headers, args.requests, args.concurrency)
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{mode:<18} {elapsed:>8.2f} {args.requests / elapsed:>8.1f} "
+                  f"{sent / elapsed / 1024 ** 2:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Bulk import throughput and peak memory for orders in the todo/orders.json format.
+
+A synthetic file is written first, then imported into a throwaway test
+database. Peak memory stays flat as --orders grows, because the file is
+streamed and upserted batch by batch.
+
+Usage (from the server directory):
+    python tools/benchmarks/orders_import.py --orders 200000 --items 5 --batch-size 1000 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from orders.importers import DiscountImporter, OrderImporter, ProductImporter  # noqa: E402
+from orders.models import Order, OrderItem  # noqa: E402
+
+
+def peak_rss_mb():
+    # VmHWM is this process's own peak, unlike ru_maxrss
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def write_orders(path, orders, items, skus, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w') as out:
+        out.write('[')
+        for order_id in range(1, orders + 1):
+            record = {
+                'orderId': order_id,
+                'items': [{'sku': rng.randrange(skus) + 1000, 'quantity': rng.randint(1, 9)} for _ in range(items)],
+            }
+            if order_id % 3 == 0:
+                record['discount'] = 'SALE10'
+            out.write((',\n' if order_id > 1 else '') + json.dumps(record))
+        out.write(']')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--items', type=int, default=5, help='items per order')
+    parser.add_argument('--skus', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[500, 1000, 2000])
+    args = parser.parse_args()
+
+    connection.creation.create_test_db(verbosity=0)
+    user = User.objects.create_user('bench')
+    products = [{'sku': sku + 1000, 'price': round(1 + sku * 0.37, 2)} for sku in range(args.skus)]
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, importer, records in (('products', ProductImporter(), products),
+                                        ('discounts', DiscountImporter(), [{'key': 'SALE10', 'value': 0.1}])):
+            path = os.path.join(workdir, f'{name}.json')
+            with open(path, 'w') as out:
+                json.dump(records, out)
+            with open(path, 'rb') as source:
+                importer.run(source)
+
+        path = os.path.join(workdir, 'orders.json')
+        write_orders(path, args.orders, args.items, args.skus)
+        size_mb = os.path.getsize(path) / 1024 ** 2
+        print(f"{args.orders} orders x {args.items} items, {size_mb:.1f} MB file")
+        print(f"{'batch':>6} {'seconds':>8} {'orders/s':>9} {'lines/s':>9} {'peak MB':>8}")
+        for batch_size in args.batch_size:
+            # Start each run from an empty table, without per-row delete signals
+            for queryset in (OrderItem.objects.all(), Order.objects.all()):
+                queryset._raw_delete(queryset.db)
+            with open(path, 'rb') as source:
+                stats = OrderImporter(user, batch_size).run(source)
+            lines = OrderItem.objects.count()
+            print(f"{batch_size:>6} {stats.seconds:>8.2f} {stats.rows_per_second:>9.0f} "
+                  f"{lines / stats.seconds:>9.0f} {peak_rss_mb():>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -53,7 +53,7 @@ class InvoicePDF(FPDF):
         # Reset position for table with more space
         self.set_xy(10, 100)  # Increased spacing before table
 
-    def add_table(self, data):
+    def add_table(self, data, total_charges=None):
         # Table headers with light gray background
         self.set_fill_color(240, 240, 240)
         self.set_font('Arial', 'B', 10)
@@ -69,13 +69,11 @@ class InvoicePDF(FPDF):
 
         # Data rows
         self.set_font('Arial', '', 9)
-        total_duration = 0
-        total_charges = 0
+        if total_charges is None:
+            total_charges = data['Call charges'].sum()
         
         for idx, row in data.iterrows():
             duration = row['Total duration'] / 60
-            total_duration += duration
-            total_charges += row['Call charges']
             
             self.cell(15, 8, str(idx + 1), 1, 0, 'C')
             self.cell(30, 8, str(row['Area prefix']), 1, 0, 'C')
@@ -138,24 +136,23 @@ def generate_invoices(input_file, from_company, to_company, billing_month, gmt):
         output_dir = 'invoices'
         os.makedirs(output_dir, exist_ok=True)
 
-        # Generate separate invoices for each Account ID
-        unique_accounts = data['Account id'].unique()
+        # Per-account totals in one pass instead of summing each slice
+        account_totals = data.groupby('Account id', sort=False)['Call charges'].sum()
 
-        for account_id in unique_accounts:
-            account_data = data[data['Account id'] == account_id]
-            
+        # Generate separate invoices for each Account ID, splitting the rows in a single groupby
+        for account_id, account_data in data.groupby('Account id', sort=False):
             # Generate invoice number (you can modify this format)
             invoice_number = f"{datetime.now().strftime('%Y%m')}-{account_id}"
             
             # Calculate total amount
-            total_amount = account_data['Call charges'].sum()
+            total_amount = account_totals[account_id]
 
             # Create PDF with new design
             pdf = InvoicePDF()
             pdf.add_page()
             pdf.design_header(invoice_number, 'logo.jpg')
             pdf.add_company_details(from_company, to_company, billing_month, gmt)
-            pdf.add_table(account_data[['Area prefix', 'Area name', 'Total duration', 'Call charges']])
+            pdf.add_table(account_data[['Area prefix', 'Area name', 'Total duration', 'Call charges']], total_amount)
 
             # Save PDF
             output_file = os.path.join(output_dir, f'Invoice_{invoice_number}.pdf')